@@ -1,136 +1,498 @@
-from fastapi import APIRouter, Request, Query
+import json
+import os
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Request, Response, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Awaitable, Callable
 
 # typing.Annotated was imported but not used.
 # Import the llm_services module to avoid naming conflicts and allow proper calling.
-from core.services import llm_services, firestore_service, admin_chat_agent_service, financial_advice_service, budget_planning_service
+from core.services import llm_services, firestore_service, admin_chat_agent_service, financial_advice_service, budget_planning_service, resilience
 from core.services.financial_advice_service import QuestionType
 
 router = APIRouter(prefix="/api")
 
+# Limits of the batch endpoint: prompts per request and prompts generated concurrently.
+batch_max_prompts = int(os.getenv('BATCH_MAX_PROMPTS', '100'))
+batch_max_concurrency = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+
+
+def _chat_session_id(api_name: str, user_email: str, conversation_id: Optional[str]) -> str:
+    """Builds the key under which a user's conversation history is stored."""
+    return f"{api_name}:{user_email}:{conversation_id or 'default'}"
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formats a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_sse_response(
+    api_name: str,
+    prompt: str,
+    user_details: Dict[str, Any],
+    request_data: Dict[str, Any],
+    start_stream: Callable[[], Awaitable[llm_services.LLMStream]]
+) -> StreamingResponse:
+    """
+    Streams a model response to the client as Server-Sent Events.
+
+    Each text chunk is sent as a `chunk` event as soon as the model produces it,
+    followed by a final `done` event carrying the token usage. The API call is
+    logged to Firestore once the stream has finished. `start_stream` returns only
+    once the stream has produced its first chunk (or is replayed from the cache),
+    whether the stream is the caller's own or shared with identical requests, so
+    a request the admission queue rejects is still reported as a 429, an
+    unavailable model as a 503/504 and a rejected request with its mapped status.
+    Only failures after the first chunk arrive as an `error` event.
+    """
+    try:
+        stream = await start_stream()
+    except Exception as e:
+        _log_failed_call(api_name, prompt, user_details, request_data, e, streamed=True)
+        raise
+
+    async def event_source():
+        response_metadata: Dict[str, Any] = {"streamed": True}
+        try:
+            async for text in stream:
+                yield _sse_event("chunk", {"text": text})
+            response_metadata.update({
+                "response_length": len(stream.text),
+                "usage": stream.usage,
+                "cached": stream.cached,
+                "model_name": stream.model_name,
+                "first_token_ms": _to_ms(stream.first_token_seconds),
+                "latency_ms": _to_ms(stream.latency_seconds)
+            })
+            yield _sse_event("done", response_metadata)
+        except Exception as e:
+            print(f"Error streaming response for '{api_name}': {e}")
+            response_metadata["error"] = str(e)
+            yield _sse_event("error", {"detail": f"Error generating AI response: {e}"})
+        finally:
+            await stream.aclose()
+
+        firestore_service.log_api_call(
+            api_name=api_name,
+            prompt=prompt,
+            user_details=user_details,
+            request_data=request_data,
+            response_metadata=response_metadata
+        )
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Closes the stream even if the body never started (e.g. the client left first).
+        background=BackgroundTask(stream.aclose)
+    )
+
+
+def _to_ms(seconds: Optional[float]) -> Optional[int]:
+    return round(seconds * 1000) if seconds is not None else None
+
+
+def _response_metadata(ai_response: llm_services.LLMResponse) -> Dict[str, Any]:
+    """The token usage, model and latency of a response, stored with its API log."""
+    return {
+        "cached": ai_response.cached,
+        "model_name": ai_response.model_name,
+        "usage": ai_response.usage,
+        "latency_ms": _to_ms(ai_response.latency_seconds)
+    }
+
+
+def _log_failed_call(
+    api_name: str,
+    prompt: str,
+    user_details: Dict[str, Any],
+    request_data: Dict[str, Any],
+    error: Exception,
+    streamed: bool = False,
+    status_code: Optional[int] = None
+):
+    """
+    Logs an API call that failed, e.g. because the model was unavailable, too slow or
+    rejected the request. `status_code` overrides the status mapped from the error.
+    """
+    firestore_service.log_api_call(
+        api_name=api_name,
+        prompt=prompt,
+        user_details=user_details,
+        request_data=request_data,
+        response_metadata={"streamed": streamed, "error": str(error), "status_code": status_code or resilience.error_status(error)}
+    )
+
+
+async def _respond(
+    api_name: str,
+    prompt: str,
+    user_details: Dict[str, Any],
+    request_data: Dict[str, Any],
+    generate: Callable[[], Awaitable[llm_services.LLMResponse]]
+) -> Dict[str, Any]:
+    """
+    Generates a model response and logs the API call to Firestore, flagging
+    responses served from the cache. Failures are logged and re-raised so they
+    reach the client with their mapped status (e.g. 503/504 for upstream errors).
+    """
+    try:
+        ai_response = await generate()
+    except Exception as e:
+        _log_failed_call(api_name, prompt, user_details, request_data, e)
+        raise
+    firestore_service.log_api_call(
+        api_name=api_name,
+        prompt=prompt,
+        user_details=user_details,
+        request_data=request_data,
+        response_metadata=_response_metadata(ai_response)
+    )
+    return {"response": ai_response.text, "cached": ai_response.cached}
+
+
 class GenerateAIResponseRequest(BaseModel):
     prompt: str
     user_name: str
     user_email: str
 
 @router.post("/v1/ai-agents/generate_ai_response")
-async def generate_ai_response(details: GenerateAIResponseRequest, request: Request):
+async def generate_ai_response(
+    details: GenerateAIResponseRequest,
+    request: Request,
+    stream: bool = Query(False, description="Stream the response as Server-Sent Events.")
+):
     """
     Generates an AI response based on the provided prompt.
 
     Args:
         details: An object containing the prompt, user_name, and user_email.
         request: The incoming FastAPI request object for logging.
+        stream: If true, the response is streamed as Server-Sent Events.
 
     Returns:
-        A dictionary containing the generated AI response.
+        A dictionary containing the generated AI response and whether it was served from the cache.
     """
-    # Log the API call to Firestore
     user_details = {
         "client_host": request.client.host if request.client else "unknown",
         "user_name": details.user_name,
         "user_email": details.user_email
     }
-    await firestore_service.log_api_call(
-        api_name="generate_ai_response",
-        prompt=details.prompt,
-        user_details=user_details,
-        request_data=details.model_dump()
+    if stream:
+        return await _stream_sse_response(
+            "generate_ai_response", details.prompt, user_details, details.model_dump(),
+            lambda: llm_services.stream_ai_response(details.prompt)
+        )
+    return await _respond(
+        "generate_ai_response", details.prompt, user_details, details.model_dump(),
+        lambda: llm_services.generate_ai_response(details.prompt)
     )
 
-    # Call the service function correctly. The previous call was recursive.
-    ai_response_content = llm_services.generate_ai_response(details.prompt)
-    return {"response": ai_response_content}
+class BatchGenerateAIResponseRequest(BaseModel):
+    prompts: List[str]
+    user_name: str
+    user_email: str
+    max_concurrency: Optional[int] = None # Capped at BATCH_MAX_CONCURRENCY
+
+@router.post("/v1/ai-agents/generate_ai_response/batch")
+async def generate_ai_response_batch(
+    details: BatchGenerateAIResponseRequest,
+    request: Request,
+    stream: bool = Query(False, description="Stream each result as an NDJSON line as soon as it completes.")
+):
+    """
+    Generates AI responses for a list of prompts in one request, running them
+    concurrently under a bounded limit. All calls are logged in one batched Firestore write.
+
+    Args:
+        details: An object containing the prompts, user_name, and user_email.
+        request: The incoming FastAPI request object for logging.
+        stream: If true, results are streamed as NDJSON in completion order.
+
+    Returns:
+        The results in prompt order, each with its index, response, cached flag and any error.
+    """
+    if not details.prompts:
+        raise HTTPException(status_code=400, detail="At least one prompt is required.")
+    if len(details.prompts) > batch_max_prompts:
+        raise HTTPException(status_code=400, detail=f"A batch holds at most {batch_max_prompts} prompts.")
+
+    user_details = {
+        "client_host": request.client.host if request.client else "unknown",
+        "user_name": details.user_name,
+        "user_email": details.user_email
+    }
+    max_concurrency = min(details.max_concurrency or batch_max_concurrency, batch_max_concurrency)
+
+    def result_of(index: int, ai_response: llm_services.LLMResponse) -> Dict[str, Any]:
+        result = {"index": index, "response": ai_response.text, "cached": ai_response.cached}
+        if ai_response.error:
+            result["error"] = ai_response.error
+        return result
+
+    def log_entry(index: int, ai_response: llm_services.LLMResponse) -> Dict[str, Any]:
+        response_metadata = {**_response_metadata(ai_response), "batched": True}
+        if ai_response.error:
+            response_metadata["error"] = ai_response.error
+        return {
+            "api_name": "generate_ai_response",
+            "prompt": details.prompts[index],
+            "user_details": user_details,
+            "request_data": {"prompt": details.prompts[index], "batch_index": index, "batch_size": len(details.prompts)},
+            "response_metadata": response_metadata
+        }
+
+    completions = llm_services.generate_ai_responses(details.prompts, max_concurrency)
+    if stream:
+        async def ndjson_lines():
+            async for index, ai_response in completions:
+                # Logged as each result goes out, so a client that disconnects midway loses no log entries.
+                firestore_service.log_api_call(**log_entry(index, ai_response))
+                yield json.dumps(result_of(index, ai_response)) + "\n"
+
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(details.prompts)
+    log_entries = []
+    try:
+        async for index, ai_response in completions:
+            results[index] = result_of(index, ai_response)
+            log_entries.append(log_entry(index, ai_response))
+    finally:
+        # Also logs the prompts completed before a client disconnect cancelled the request.
+        firestore_service.log_api_calls(log_entries)
+    return {"responses": results}
 
 class AdviseChatRequest(BaseModel):
     prompt: str
     user_name: str
     user_email: str
     language: Optional[str] = "English"
+    conversation_id: Optional[str] = None # Separates concurrent conversations of the same user
 
 @router.post('/v1/ai-agents/advise_chat', tags=["Financial Advice"])
-async def financial_advisor_chat(details: AdviseChatRequest, request: Request):
+async def financial_advisor_chat(
+    details: AdviseChatRequest,
+    request: Request,
+    stream: bool = Query(False, description="Stream the response as Server-Sent Events.")
+):
     """Endpoint for chat-based financial advice."""
-    # Log the API call to Firestore
     user_details = {
         "client_host": request.client.host if request.client else "unknown",
         "user_name": details.user_name,
         "user_email": details.user_email
     }
-    await firestore_service.log_api_call(
-        api_name="financial_advisor_chat",
-        prompt=details.prompt,
-        user_details=user_details,
-        request_data=details.model_dump()
+    session_id = _chat_session_id("financial_advisor_chat", details.user_email, details.conversation_id)
+    if stream:
+        return await _stream_sse_response(
+            "financial_advisor_chat", details.prompt, user_details, details.model_dump(),
+            lambda: financial_advice_service.stream_financial_advice_chat(
+                user_question=details.prompt,
+                session_id=session_id,
+                language=details.language
+            )
+        )
+    return await _respond(
+        "financial_advisor_chat", details.prompt, user_details, details.model_dump(),
+        lambda: financial_advice_service.get_financial_advice_chat(
+            user_question=details.prompt,
+            session_id=session_id,
+            language=details.language
+        )
     )
 
-    # The business logic is now in the service layer.
-    ai_response_content = financial_advice_service.get_financial_advice_chat(
-        user_question=details.prompt,
-        language=details.language
+
+class UploadDocumentRequest(BaseModel):
+    document_content: str
+    user_name: str
+    user_email: str
+
+def _store_document(document_content: str):
+    """Stores an uploaded document, answering 413 if it is too large to keep."""
+    try:
+        return financial_advice_service.store_document(document_content)
+    except financial_advice_service.DocumentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@router.post('/v1/ai-agents/documents', tags=["Financial Advice"])
+async def upload_document(details: UploadDocumentRequest, request: Request):
+    """
+    Uploads a financial document once. The returned `document_id` (the SHA-256 of
+    the normalized content) is then sent with each review question instead of the
+    document itself.
+    """
+    user_details = {
+        "client_host": request.client.host if request.client else "unknown",
+        "user_name": details.user_name,
+        "user_email": details.user_email
+    }
+    document = _store_document(details.document_content)
+    firestore_service.log_api_call(
+        api_name="upload_document",
+        prompt="",
+        user_details=user_details,
+        request_data={"user_name": details.user_name, "user_email": details.user_email},
+        response_metadata=document.metadata()
     )
-    return {"response": ai_response_content}
+    return document.metadata()
+
+
+@router.get('/v1/ai-agents/documents/{document_id}', tags=["Financial Advice"])
+async def get_document(document_id: str):
+    """Returns the metadata of an uploaded document, or 404 if it has to be uploaded again."""
+    document = financial_advice_service.document_store.get(document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"Document '{document_id}' not found.")
+    return document.metadata()
 
 
 class ReviewDocumentRequest(BaseModel):
-    document_content: str
     prompt: str
     user_name: str
     user_email: str
+    document_id: Optional[str] = None # Returned by /v1/ai-agents/documents; preferred over resending the content
+    document_content: Optional[str] = None # The full document, for clients that do not upload it first
+    conversation_id: Optional[str] = None # Separates concurrent conversations of the same user
+
+def _review_document(details: ReviewDocumentRequest):
+    """Finds the document a review question is about, storing it if its content was sent."""
+    if details.document_id:
+        document = financial_advice_service.document_store.get(details.document_id)
+        if document is not None:
+            return document
+        if details.document_content is None:
+            raise HTTPException(status_code=404, detail=f"Document '{details.document_id}' not found. Upload it again.")
+    if details.document_content is None:
+        raise HTTPException(status_code=400, detail="Either document_id or document_content is required.")
+    return _store_document(details.document_content)
 
 @router.post('/v1/ai-agents/review_document_chat', tags=["Financial Advice"])
-async def document_reviewer_chat(details: ReviewDocumentRequest, request: Request):
+async def document_reviewer_chat(
+    details: ReviewDocumentRequest,
+    request: Request,
+    stream: bool = Query(False, description="Stream the response as Server-Sent Events.")
+):
     """
     Endpoint for chat-based financial document review.
-    User provides document content and a prompt for analysis.
+    User provides a prompt for analysis and either the id of an uploaded document
+    or the document content itself.
     """
     user_details = {
         "client_host": request.client.host if request.client else "unknown",
         "user_name": details.user_name,
         "user_email": details.user_email
     }
-    await firestore_service.log_api_call(
-        api_name="document_reviewer_chat",
-        prompt=details.prompt,
-        user_details=user_details,
-        request_data=details.model_dump()
+    document = _review_document(details)
+    # The document is logged by id, not by content.
+    request_data = {**details.model_dump(exclude={"document_content"}), "document_id": document.document_id}
+    session_id = _chat_session_id("document_reviewer_chat", details.user_email, details.conversation_id)
+    if stream:
+        return await _stream_sse_response(
+            "document_reviewer_chat", details.prompt, user_details, request_data,
+            lambda: financial_advice_service.stream_document_review_chat(
+                document=document,
+                user_question=details.prompt,
+                session_id=session_id
+            )
+        )
+    return await _respond(
+        "document_reviewer_chat", details.prompt, user_details, request_data,
+        lambda: financial_advice_service.get_document_review_chat(
+            document=document,
+            user_question=details.prompt,
+            session_id=session_id
+        )
     )
 
-    ai_response_content = financial_advice_service.get_document_review_chat(document_content=details.document_content, user_question=details.prompt)
-    return {"response": ai_response_content}
-
 
 class BudgetChatRequest(BaseModel):
     history: List[Dict[str, Any]] # e.g. [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}]
     prompt: str
     user_name: str
     user_email: str
+    conversation_id: Optional[str] = None # Lets the summary of older turns be reused across requests
 
 @router.post('/v1/ai-agents/budget_planner_chat', tags=["Financial Advice"])
-async def budget_planner_chat(details: BudgetChatRequest, request: Request):
+async def budget_planner_chat(
+    details: BudgetChatRequest,
+    request: Request,
+    stream: bool = Query(False, description="Stream the response as Server-Sent Events."),
+    structured: bool = Query(False, description="Return the final budget plan as typed JSON and store it for later use.")
+):
     """
     Endpoint for an interactive chat to create a budget plan.
     Manages a conversation where the AI asks questions to gather financial details
     and then generates a budget plan.
+
+    With `structured=true` the final plan is returned as typed JSON (categories,
+    amounts, percentages and tips) together with a `plan_id`, under which it can
+    be loaded again from `/v1/ai-agents/budget_plans/{plan_id}`.
     """
     user_details = {
         "client_host": request.client.host if request.client else "unknown",
         "user_name": details.user_name,
         "user_email": details.user_email
     }
+    conversation_key = _chat_session_id("budget_planner_chat", details.user_email, details.conversation_id)
+    if structured:
+        if stream:
+            raise HTTPException(status_code=400, detail="Structured budget plans cannot be streamed.")
+        try:
+            result = await budget_planning_service.create_structured_budget_plan(
+                history=details.history,
+                user_message=details.prompt,
+                conversation_key=conversation_key,
+                user_details=user_details
+            )
+        except budget_planning_service.BudgetPlanGenerationError as e:
+            # The model's plan did not match the schema: logged like any other failed call.
+            _log_failed_call("budget_planner_chat", details.prompt, user_details, details.model_dump(), e, status_code=502)
+            raise HTTPException(status_code=502, detail=str(e))
+        except Exception as e:
+            _log_failed_call("budget_planner_chat", details.prompt, user_details, details.model_dump(), e)
+            raise
+        firestore_service.log_api_call(
+            api_name="budget_planner_chat",
+            prompt=details.prompt,
+            user_details=user_details,
+            request_data=details.model_dump(),
+            response_metadata={
+                **_response_metadata(result["response"]),
+                "structured": True,
+                "plan_id": result["plan_id"]
+            }
+        )
+        return {"plan_id": result["plan_id"], "plan": result["plan"], "cached": result["response"].cached}
+    if stream:
+        return await _stream_sse_response(
+            "budget_planner_chat", details.prompt, user_details, details.model_dump(),
+            lambda: budget_planning_service.stream_budget_plan_chat_response(
+                history=details.history, user_message=details.prompt, conversation_key=conversation_key
+            )
+        )
     # The prompt for logging will be just the user's latest message.
-    await firestore_service.log_api_call(
-        api_name="budget_planner_chat",
-        prompt=details.prompt,
-        user_details=user_details,
-        request_data=details.model_dump()
+    return await _respond(
+        "budget_planner_chat", details.prompt, user_details, details.model_dump(),
+        lambda: budget_planning_service.get_budget_plan_chat_response(
+            history=details.history, user_message=details.prompt, conversation_key=conversation_key
+        )
     )
 
-    ai_response_content = budget_planning_service.get_budget_plan_chat_response(
-        history=details.history, user_message=details.prompt
-    )
-    return {"response": ai_response_content}
+
+@router.get("/v1/ai-agents/budget_plans/{plan_id}", response_model=Dict[str, Any], tags=["Financial Advice"])
+async def get_budget_plan(plan_id: str):
+    """
+    Returns a budget plan stored by `budget_planner_chat?structured=true`,
+    without calling the model again.
+    """
+    stored_plan = await budget_planning_service.get_budget_plan(plan_id)
+    if stored_plan is None:
+        raise HTTPException(status_code=404, detail=f"Budget plan '{plan_id}' not found.")
+    return stored_plan
 
 
 @router.get("/v1/ai-agents/popular-financial-questions", response_model=List[str], tags=["Financial Advice"])
@@ -150,18 +512,109 @@ async def get_popular_financial_questions(
 
 @router.get("/v1/admin/api-logs", response_model=List[Dict[str, Any]], tags=["Admin"])
 async def get_api_logs(
+    response: Response,
     api_name: Optional[str] = Query(None, description="Filter logs by API name. e.g., 'generate_ai_response'"),
-    limit: int = Query(20, description="Maximum number of logs to return", ge=1, le=100)
+    limit: int = Query(20, description="Maximum number of logs to return", ge=1, le=100),
+    include_request_data: bool = Query(False, description="Also return each log's full request body, which can be large"),
+    cursor: Optional[str] = Query(None, description="The X-Next-Cursor header of the previous page")
 ):
     """
     Retrieves API call logs from Firestore.
 
     This endpoint allows querying the `api_logs` collection.
     You can filter by `api_name` and limit the number of results returned.
-    The logs are returned in reverse chronological order (newest first).
+    The logs are returned in reverse chronological order (newest first),
+    without their request bodies unless `include_request_data` is set.
+    When there may be more logs, the `X-Next-Cursor` response header holds the
+    `cursor` to pass for the next page.
+    """
+    fields = None if include_request_data else firestore_service.API_LOG_LIST_FIELDS
+    try:
+        page = await firestore_service.query_api_logs_page(api_name=api_name, limit=limit, fields=fields, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["logs"]
+
+
+@router.get("/v1/admin/api-logs/export", tags=["Admin"])
+async def export_api_logs(
+    api_name: Optional[str] = Query(None, description="Filter logs by API name"),
+    start: Optional[datetime] = Query(None, description="Only logs at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only logs before this time"),
+    include_request_data: bool = Query(False, description="Also export each log's full request body"),
+    cursor: Optional[str] = Query(None, description="Resume after the log with this `cursor`")
+):
+    """
+    Streams API call logs as newline-delimited JSON, newest first, straight from the
+    Firestore query without loading them all. Each line carries the log's `id` and
+    `cursor`; if the export is cut off, pass the last `cursor` received to resume.
+    """
+    if cursor:
+        try:
+            firestore_service.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not firestore_service.db:
+        raise HTTPException(status_code=503, detail="Firestore is not available.")
+    fields = None if include_request_data else firestore_service.API_LOG_LIST_FIELDS
+
+    async def lines():
+        async for log in firestore_service.stream_api_logs(api_name=api_name, start=start, end=end, fields=fields, cursor=cursor):
+            yield json.dumps(log, default=str) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/v1/admin/llm-stats", response_model=Dict[str, Any], tags=["Admin"])
+async def get_llm_stats():
+    """
+    Returns runtime statistics of the LLM service layer, such as the number of
+    live chat sessions and their hit/eviction counters.
+    """
+    stats = llm_services.get_stats()
+    stats["popular_answers"] = financial_advice_service.popular_answers.stats()
+    stats["document_review"] = financial_advice_service.document_reviewer.stats()
+    stats["document_store"] = financial_advice_service.document_store.stats()
+    stats["api_log_writer"] = firestore_service.api_log_writer.stats()
+    stats["firestore_queries"] = firestore_service.query_stats()
+    stats["budget_history_compaction"] = budget_planning_service.history_compactor.stats()
+    return stats
+
+
+@router.post("/v1/admin/rollups/run", response_model=Dict[str, Any], tags=["Admin"])
+async def run_api_log_rollups(
+    max_logs: int = Query(5000, description="Maximum number of logs to roll up in this run", ge=1, le=50000)
+):
+    """
+    Folds the API logs written since the last run into the hourly and daily usage
+    rollups. Meant to be called on a schedule (e.g. every few minutes by Cloud
+    Scheduler); overlapping or failed runs are safe.
+    """
+    if not firestore_service.db:
+        raise HTTPException(status_code=503, detail="Firestore is not available.")
+    return await firestore_service.materialize_api_log_rollups(max_logs=max_logs)
+
+
+@router.post("/v1/admin/rollups/rebuild", response_model=Dict[str, Any], tags=["Admin"])
+async def rebuild_api_log_rollups(
+    start: datetime = Query(..., description="First day to rebuild (UTC)"),
+    end: datetime = Query(..., description="End of the range to rebuild (UTC, rounded up to a whole day)")
+):
+    """
+    Recomputes the usage rollups of whole days from the API logs, e.g. to backfill
+    logs written before the rollups existed. Returns 409 if a rollup run moved the
+    high-water mark meanwhile; the rebuild can then be rerun.
     """
-    logs = await firestore_service.query_api_logs(api_name=api_name, limit=limit)
-    return logs
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'end' must be after 'start'.")
+    if not firestore_service.db:
+        raise HTTPException(status_code=503, detail="Firestore is not available.")
+    try:
+        return await firestore_service.rebuild_api_log_rollups(start, end)
+    except firestore_service.RollupConflictError:
+        raise HTTPException(status_code=409, detail="A rollup run moved the high-water mark during the rebuild; rerun it.")
 
 
 class AdminChatRequest(BaseModel):
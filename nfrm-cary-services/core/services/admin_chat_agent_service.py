@@ -1,22 +1,20 @@
+import asyncio
 import os
 import json
-from typing import TypedDict, Annotated, List, Dict, Any
+from datetime import datetime
+from typing import List, Dict, Any, Optional
 
-from langchain_core.messages import HumanMessage, BaseMessage
-from langchain_core.tools import tool
-from langchain_google_vertexai import ChatVertexAI
-from langgraph.graph import StateGraph, END
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode
+from core.services import firestore_service, llm_services, resilience
+from core.services.tokens import estimate_tokens
 
-from core.services import firestore_service
+# LangChain, LangGraph and the chat model are imported and built on the first admin
+# question rather than at import time, so they do not slow down every cold start.
 
 # --- 1. Define Tools ---
 
-@tool
-async def query_firestore_api_logs(filters: List[Dict[str, Any]], limit: int = 10) -> str:
+async def query_firestore_api_logs(filters: List[Dict[str, Any]], limit: int = 10, fields: Optional[List[str]] = None) -> str:
     """
-    Queries and retrieves full documents from the 'api_logs' collection in Firestore.
+    Queries and retrieves documents from the 'api_logs' collection in Firestore.
     Use this to answer questions that require seeing the content of logs, such as "Show me the latest 5 logs for user X".
     Do NOT use this for counting. Use the `count_api_logs` tool instead.
     The filters argument should be a list of dictionaries, where each dictionary
@@ -25,13 +23,16 @@ async def query_firestore_api_logs(filters: List[Dict[str, Any]], limit: int = 1
     'op' is the comparison operator (e.g., '==', '!=', '<', '<=', '>', '>=').
     'value' is the value to compare against. For timestamps, use ISO 8601 format strings.
     'limit' is the maximum number of documents to return.
+    'fields' lists the fields to return (e.g. ['prompt', 'timestamp']). By default every field except
+    'request_data' is returned; include 'request_data' only when the question is about the request body.
     """
     print(f"Executing Firestore query with filters: {filters} and limit: {limit}")
     try:
         results = await firestore_service.query_collection_with_filters(
             collection_name='api_logs',
             filters=filters,
-            limit=limit
+            limit=limit,
+            fields=fields or firestore_service.API_LOG_LIST_FIELDS
         )
         if not results:
             return "No documents found matching the criteria."
@@ -40,7 +41,6 @@ async def query_firestore_api_logs(filters: List[Dict[str, Any]], limit: int = 1
         print(f"Error during Firestore query tool execution: {e}")
         return f"An error occurred while querying Firestore: {str(e)}"
 
-@tool
 async def count_api_logs(filters: List[Dict[str, Any]]) -> str:
     """
     Counts documents in the 'api_logs' collection based on filters.
@@ -61,7 +61,6 @@ async def count_api_logs(filters: List[Dict[str, Any]]) -> str:
         print(f"Error during Firestore count tool execution: {e}")
         return f"An error occurred while counting documents in Firestore: {str(e)}"
 
-@tool
 async def get_distinct_api_log_values(field_name: str, filters: List[Dict[str, Any]], limit: int = 100) -> str:
     """
     Gets distinct (unique) values for a specific field from the 'api_logs' collection.
@@ -85,7 +84,6 @@ async def get_distinct_api_log_values(field_name: str, filters: List[Dict[str, A
         print(f"Error during Firestore distinct value tool execution: {e}")
         return f"An error occurred while getting distinct values from Firestore: {str(e)}"
 
-@tool
 async def get_api_call_count_by_group(group_by_field: str, filters: List[Dict[str, Any]], limit: int = 1000) -> str:
     """
     Groups API logs by a specific field and returns the count for each group.
@@ -109,28 +107,56 @@ async def get_api_call_count_by_group(group_by_field: str, filters: List[Dict[st
         print(f"Error during Firestore group and count tool execution: {e}")
         return f"An error occurred while grouping and counting data from Firestore: {str(e)}"
 
-# --- 2. Define Agent State and Graph ---
-
-class AgentState(TypedDict):
-    messages: Annotated[list, add_messages]
-
-# --- 3. Define Agent Logic ---
-
-# This node decides whether to call a tool or to generate a final response.
-def should_continue(state: AgentState) -> str:
-    last_message = state['messages'][-1]
-    # If the LLM returned a tool call, then we call the tool node.
-    if last_message.tool_calls:
-        return "call_tool"
-    # Otherwise, we are done.
-    return END
-
-# This is the agent node. It calls the model to decide what to do next.
-async def call_model(state: AgentState):
-    response = await llm_with_tools.ainvoke(state['messages'])
-    return {"messages": [response]}
+async def get_api_call_counts(group_by_field: str, start: str, end: str) -> str:
+    """
+    Returns the exact number of API calls per API or per user between two times, read from
+    pre-aggregated counters instead of scanning the logs.
+    Use this for questions like "How many calls per API this week?" or "Calls per user since Monday".
+    'group_by_field' is either 'api_name' or 'user_details.user_email'.
+    'start' and 'end' are ISO 8601 timestamps (e.g. '2024-05-20T00:00:00Z'); 'end' is exclusive.
+    Per-API counts are kept per hour and per-user counts per day; the range actually counted is returned.
+    """
+    print(f"Reading API call counters for '{group_by_field}' from {start} to {end}")
+    try:
+        result = await firestore_service.get_api_call_counts(
+            group_by_field=group_by_field,
+            start=datetime.fromisoformat(start.replace('Z', '+00:00')),
+            end=datetime.fromisoformat(end.replace('Z', '+00:00'))
+        )
+        if result is None:
+            return f"Calls are not counted per '{group_by_field}'. Use `get_api_call_count_by_group` instead."
+        return json.dumps(result, indent=2)
+    except ValueError as e:
+        return f"Invalid timestamp: {e}. Use ISO 8601 format, e.g. '2024-05-20T00:00:00Z'."
+    except Exception as e:
+        print(f"Error during API call counter tool execution: {e}")
+        return f"An error occurred while reading the API call counters: {str(e)}"
 
-# --- 4. Initialize and Compile the Agent ---
+async def get_api_usage_summary(granularity: str, start: str, end: str, api_name: str = "") -> str:
+    """
+    Summarizes API usage per API between two times from hourly or daily rollups: calls, errors,
+    distinct users, and prompt-length and latency statistics (mean, p50, p95).
+    Use this for questions like "What was the p95 latency of each API yesterday?" or
+    "How many distinct users used advise_chat this week?".
+    'granularity' is 'hour' or 'day'; use 'day' whenever the range is whole days.
+    'start' and 'end' are ISO 8601 timestamps (e.g. '2024-05-20T00:00:00Z'); 'end' is exclusive.
+    'api_name' limits the summary to one API. The range actually summarized is returned, along with
+    the rollups' high-water mark: logs written after it are not included yet.
+    """
+    print(f"Reading {granularity} API usage rollups from {start} to {end}")
+    try:
+        result = await firestore_service.get_api_log_rollups(
+            granularity=granularity,
+            start=datetime.fromisoformat(start.replace('Z', '+00:00')),
+            end=datetime.fromisoformat(end.replace('Z', '+00:00')),
+            api_name=api_name or None
+        )
+        return json.dumps(result, indent=2)
+    except ValueError as e:
+        return f"Invalid argument: {e}. Use 'hour' or 'day' and ISO 8601 timestamps, e.g. '2024-05-20T00:00:00Z'."
+    except Exception as e:
+        print(f"Error during API usage summary tool execution: {e}")
+        return f"An error occurred while reading the API usage rollups: {str(e)}"
 
 # The schema of the api_logs collection is crucial for the LLM to construct correct queries.
 # This should be updated if your schema changes.
@@ -140,8 +166,8 @@ You have access to a set of tools to query this collection. You must choose the
 
 **Tool Descriptions:**
 
-1.  `query_firestore_api_logs(filters: List[Dict], limit: int)`:
-    - **Use Case:** When you need to retrieve and view the full content of log documents.
+1.  `query_firestore_api_logs(filters: List[Dict], limit: int, fields: List[str])`:
+    - **Use Case:** When you need to retrieve and view the content of log documents. Pass only the `fields` the answer needs; `request_data` is left out unless you ask for it.
     - **Example Questions:** "Show me the last 5 logs for 'test@example.com'", "What was the request data for the latest 'astrology_chat' call?"
     - **Do NOT use this for counting.**
 
@@ -158,6 +184,16 @@ You have access to a set of tools to query this collection. You must choose the
     - **Example Questions:** "Show me the total API calls per user", "What is the breakdown of API calls by api_name in the last week?", "Count calls for each user email".
     - **Fields to group by:** `api_name`, `user_details.user_email`.
 
+5.  `get_api_call_counts(group_by_field: str, start: str, end: str)`:
+    - **Use Case:** Exact call counts per API (`api_name`) or per user (`user_details.user_email`) over a time range. It reads pre-aggregated counters, so it is fast and never truncated.
+    - **Example Questions:** "How many calls per API this week?", "Which users made the most calls since Monday?"
+    - **Prefer this over `get_api_call_count_by_group`** whenever the grouping is by `api_name` or `user_details.user_email` and there are no other filters.
+
+6.  `get_api_usage_summary(granularity: str, start: str, end: str, api_name: str)`:
+    - **Use Case:** Usage summaries per API over a time range: calls, errors, distinct users, prompt lengths and latencies. It reads hourly or daily rollups, so it is fast for any range.
+    - **Example Questions:** "What was the average latency of each API last week?", "How many distinct users called advise_chat yesterday?", "What is the error rate per API this month?"
+    - **Prefer this over scanning logs** for distinct users, errors, prompt lengths or latencies per API. Use `granularity` 'day' for whole days and 'hour' otherwise. If the question covers the last few minutes, mention that logs written after the returned `high_water_mark` are not included.
+
 **Log Schema:**
 The schema for the documents in the 'api_logs' collection is as follows:
 - `api_name` (string): The name of the API endpoint.
@@ -175,42 +211,94 @@ The schema for the documents in the 'api_logs' collection is as follows:
 - **Conversation:** If the user asks a general question like "What's up?", do not call any tools and just have a friendly conversation.
 """
 
-# Initialize the model and tools
-tools = [query_firestore_api_logs, count_api_logs, get_distinct_api_log_values, get_api_call_count_by_group]
+# --- 2. Build the Agent Graph ---
+
+tools = [query_firestore_api_logs, count_api_logs, get_distinct_api_log_values, get_api_call_count_by_group, get_api_call_counts, get_api_usage_summary]
 model_name = os.getenv('VERTEX_MODEL_NAME', "gemini-2.0-flash-001")
-llm = ChatVertexAI(model_name=model_name, system_instruction=FIRESTORE_SCHEMA_PROMPT)
-llm_with_tools = llm.bind_tools(tools)
 
-# The tool node that executes the function calls
-tool_node = ToolNode(tools)
+agent_graph = None
+_agent_graph_lock = asyncio.Lock()
+
+
+def _build_agent_graph():
+    """Binds the tools to the chat model and compiles the LangGraph agent."""
+    from typing import Annotated, TypedDict
+
+    from langchain_core.tools import tool
+    from langgraph.graph import StateGraph, END
+    from langgraph.graph.message import add_messages
+    from langgraph.prebuilt import ToolNode
+
+    class AgentState(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    # The chat model comes from the configured LLM backend (Vertex AI, or the fake one for load tests).
+    llm = llm_services.backend.create_agent_chat_model(model_name, FIRESTORE_SCHEMA_PROMPT)
+    agent_tools = [tool(fn) for fn in tools]
+    llm_with_tools = llm.bind_tools(agent_tools)
+
+    # This node decides whether to call a tool or to generate a final response.
+    def should_continue(state: AgentState) -> str:
+        last_message = state['messages'][-1]
+        # If the LLM returned a tool call, then we call the tool node.
+        if last_message.tool_calls:
+            return "call_tool"
+        # Otherwise, we are done.
+        return END
+
+    # This is the agent node. It calls the model to decide what to do next.
+    async def call_model(state: AgentState):
+        # The admin agent shares the Vertex AI quota with user traffic, at a lower priority.
+        context_tokens = estimate_tokens(FIRESTORE_SCHEMA_PROMPT) + sum(estimate_tokens(str(m.content)) for m in state['messages'])
+        async with llm_services.admission.slot("admin_chat", context_tokens + llm_services.admission_output_token_reserve):
+            response = await llm_with_tools.ainvoke(state['messages'])
+        return {"messages": [response]}
+
+    # Define the graph
+    workflow = StateGraph(AgentState)
+    workflow.add_node("agent", call_model)
+    # The tool node that executes the function calls
+    workflow.add_node("call_tool", ToolNode(agent_tools))
+
+    # Define the edges
+    workflow.set_entry_point("agent")
+    workflow.add_conditional_edges(
+        "agent",
+        should_continue,
+    )
+    workflow.add_edge("call_tool", "agent")
+
+    # Compile the graph into a runnable
+    return workflow.compile()
 
-# Define the graph
-workflow = StateGraph(AgentState)
-workflow.add_node("agent", call_model)
-workflow.add_node("call_tool", tool_node)
 
-# Define the edges
-workflow.set_entry_point("agent")
-workflow.add_conditional_edges(
-    "agent",
-    should_continue,
-)
-workflow.add_edge("call_tool", "agent")
+async def get_agent_graph():
+    """Returns the compiled agent, building it on first use."""
+    global agent_graph
+    if agent_graph is None:
+        async with _agent_graph_lock:
+            if agent_graph is None:
+                # Importing LangGraph and the model SDK takes a while; keep it off the event loop.
+                agent_graph = await asyncio.to_thread(_build_agent_graph)
+                print("Admin chat agent built.")
+    return agent_graph
 
-# Compile the graph into a runnable
-agent_graph = workflow.compile()
 
 async def run_agent_chat(question: str) -> str:
     """
     Runs the agent graph to get an answer for the user's question.
     """
     try:
-        final_state = await agent_graph.ainvoke({
+        graph = await get_agent_graph()
+        from langchain_core.messages import HumanMessage
+        final_state = await graph.ainvoke({
             "messages": [HumanMessage(content=question)]
         })
         # The final response is the last message from the agent
         response_message = final_state['messages'][-1]
         return response_message.content
+    except resilience.UpstreamError:
+        raise
     except Exception as e:
         print(f"Error running agent chat: {e}")
         return "I'm sorry, but I encountered an error while processing your request."
\ No newline at end of file
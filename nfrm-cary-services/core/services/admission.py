@@ -0,0 +1,276 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from core.services import metrics
+from core.services.resilience import UpstreamError
+
+# Lower values are admitted first. Interactive user chats go ahead of stateless
+# calls, which go ahead of background work and the admin agent.
+DEFAULT_PRIORITIES: Dict[str, int] = {
+    "financial_advisor_chat": 0,
+    "document_reviewer_chat": 0,
+    "document_review_extract": 0,
+    "budget_planner_chat": 0,
+    "generate_ai_response": 1,
+    "generate_ai_response_batch": 2,
+    "budget_history_summary": 1,
+    "admin_chat": 2,
+    "popular_answers_warmer": 3,
+}
+DEFAULT_PRIORITY = 1
+
+
+class QuotaExceededError(UpstreamError):
+    """The request could not be admitted within the quota (HTTP 429)."""
+    status_code = 429
+
+
+class TokenBucket:
+    """Refills at a constant rate up to its capacity; requests take from it."""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        if rate_per_second <= 0:
+            raise ValueError(f"A token bucket needs a positive refill rate, got {rate_per_second}")
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def time_until(self, amount: float) -> float:
+        """Returns the seconds until `amount` can be taken (0 if it can be taken now)."""
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate_per_second) if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        self._refill()
+        self._tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Charges (positive) or refunds (negative) the bucket once the real cost is known."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    endpoint: str = field(compare=False)
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+@dataclass
+class Permit:
+    """An admitted request. Released once its upstream call has finished."""
+    endpoint: str
+    tokens: int
+    released: bool = False
+
+
+class AdmissionController:
+    """
+    Governs the calls sent to Vertex AI so traffic spikes queue up here instead of
+    turning into upstream 429s.
+
+    A request is admitted once a concurrency slot is free and the request-per-minute
+    and token-per-minute buckets, sized to the project quota, can cover it. Requests
+    that cannot be admitted at once wait in a bounded queue ordered by endpoint
+    priority; once the queue is full, or a request has waited `max_wait_seconds`,
+    it is rejected with a QuotaExceededError carrying a Retry-After hint.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_concurrency: int,
+        max_queue: int,
+        max_wait_seconds: float,
+        priorities: Optional[Dict[str, int]] = None
+    ):
+        if requests_per_minute <= 0 or tokens_per_minute <= 0:
+            raise ValueError("The requests and tokens per minute quotas must be positive.")
+        if max_concurrency < 1 or max_queue < 0 or max_wait_seconds < 0:
+            raise ValueError("max_concurrency must be at least 1, and max_queue and max_wait_seconds not negative.")
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.priorities = {**DEFAULT_PRIORITIES, **(priorities or {})}
+        self._requests = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 6.0))
+        self._tokens = TokenBucket(tokens_per_minute / 60.0, max(1.0, tokens_per_minute / 6.0))
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def _can_admit(self, tokens: int) -> float:
+        """Returns 0 if a request of `tokens` can be admitted now, otherwise the seconds to wait for quota."""
+        return max(self._requests.time_until(1), self._tokens.time_until(tokens))
+
+    def _admit(self, endpoint: str, tokens: int) -> Permit:
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        self._in_flight += 1
+        self._admitted += 1
+        return Permit(endpoint=endpoint, tokens=tokens)
+
+    def _retry_after(self) -> float:
+        # Roughly how long the requests already queued take to drain.
+        return max(1.0, (len(self._queue) + 1) / self._requests.rate_per_second)
+
+    def _publish_queue_depth(self):
+        metrics.registry.set_gauge("llm_admission_queue_depth", len(self._queue))
+        metrics.registry.set_gauge("llm_admission_in_flight", self._in_flight)
+
+    async def acquire(self, endpoint: str, tokens: int) -> Permit:
+        """
+        Waits until a request may be sent upstream.
+
+        Args:
+            endpoint: The calling endpoint, which sets the request's priority.
+            tokens: The estimated tokens of the request, charged to the TPM bucket.
+
+        Returns:
+            A permit to pass to `release` once the upstream call has finished.
+
+        Raises:
+            QuotaExceededError: The queue is full or the request waited too long.
+        """
+        started_at = time.monotonic()
+        if not self._queue and self._in_flight < self.max_concurrency and self._can_admit(tokens) == 0:
+            permit = self._admit(endpoint, tokens)
+            metrics.registry.observe("llm_admission_wait_seconds", 0.0, {"endpoint": endpoint})
+            self._publish_queue_depth()
+            return permit
+
+        priority = self.priorities.get(endpoint, DEFAULT_PRIORITY)
+        pending = [w for w in self._queue if not w.future.done()]
+        if len(pending) >= self.max_queue:
+            # A full queue sheds its lowest-priority, most recent waiter if the new request outranks it.
+            lowest = max(pending) if pending else None
+            if lowest is None or lowest.priority <= priority:
+                self._reject(endpoint)
+            self._reject(lowest.endpoint, lowest.future)
+
+        waiter = _Waiter(
+            priority=priority,
+            seq=next(self._seq),
+            endpoint=endpoint,
+            tokens=tokens,
+            future=asyncio.get_running_loop().create_future(),
+            enqueued_at=started_at
+        )
+        heapq.heappush(self._queue, waiter)
+        self._queued += 1
+        self._publish_queue_depth()
+        self._dispatch()
+        try:
+            permit = await asyncio.wait_for(waiter.future, timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            self._timed_out += 1
+            metrics.registry.inc("llm_admission_rejected_total", {"endpoint": endpoint, "reason": "wait_timeout"})
+            raise QuotaExceededError("vertex", f"not admitted within {self.max_wait_seconds}s", retry_after=self._retry_after())
+        finally:
+            # A waiter that timed out or was cancelled is skipped by the dispatcher.
+            self._publish_queue_depth()
+        metrics.registry.observe("llm_admission_wait_seconds", time.monotonic() - started_at, {"endpoint": endpoint})
+        return permit
+
+    def _reject(self, endpoint: str, future: Optional[asyncio.Future] = None):
+        """Rejects a new request (raising) or a queued one (through its future) because the queue is full."""
+        self._rejected += 1
+        metrics.registry.inc("llm_admission_rejected_total", {"endpoint": endpoint, "reason": "queue_full"})
+        error = QuotaExceededError("vertex", "admission queue is full", retry_after=self._retry_after())
+        if future is None:
+            raise error
+        future.set_exception(error)
+
+    def release(self, permit: Permit, actual_tokens: Optional[int] = None):
+        """
+        Frees the permit's concurrency slot and, when the real token usage is known,
+        corrects the estimate charged to the TPM bucket.
+        """
+        if permit.released:
+            return
+        permit.released = True
+        self._in_flight -= 1
+        if actual_tokens is not None:
+            self._tokens.adjust(actual_tokens - permit.tokens)
+        self._dispatch()
+        self._publish_queue_depth()
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, tokens: int):
+        """Holds an admission permit for the duration of a block."""
+        permit = await self.acquire(endpoint, tokens)
+        try:
+            yield permit
+        finally:
+            self.release(permit)
+
+    def _dispatch(self):
+        """Admits queued requests in priority order while slots and quota are available."""
+        while self._queue:
+            waiter = self._queue[0]
+            if waiter.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if self._in_flight >= self.max_concurrency:
+                return
+            wait = self._can_admit(waiter.tokens)
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._queue)
+            waiter.future.set_result(self._admit(waiter.endpoint, waiter.tokens))
+
+    def _schedule(self, delay: float):
+        # Wakes the dispatcher once the buckets have refilled enough for the head of the queue.
+        if self._timer is not None and not self._timer.cancelled():
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+        self._publish_queue_depth()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the queue state, admission counters and the remaining quota."""
+        wait_seconds = {}
+        for endpoint in self.priorities:
+            histogram = metrics.registry.histogram("llm_admission_wait_seconds", {"endpoint": endpoint})
+            if histogram is not None:
+                wait_seconds[endpoint] = histogram.snapshot()
+        return {
+            "in_flight": self._in_flight,
+            "queue_depth": len([w for w in self._queue if not w.future.done()]),
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "rejected_queue_full": self._rejected,
+            "rejected_wait_timeout": self._timed_out,
+            "available_requests": round(self._requests.tokens, 2),
+            "available_tokens": round(self._tokens.tokens, 2),
+            "wait_seconds": wait_seconds,
+        }
@@ -1,25 +1,14 @@
-from typing import List, Dict, Any
+import os
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Literal, Optional
 
-from core.services import llm_services
+from pydantic import BaseModel, Field, ValidationError
 
+from core.services import firestore_service, llm_services, prompt_templates
+from core.services.history_compaction import HistoryCompactor
 
-def get_budget_plan_chat_response(history: List[Dict[str, Any]], user_message: str) -> str:
-    """
-    Handles the chat interaction for creating a budget plan.
-
-    This function manages a conversational flow where an AI assistant asks a series of
-    questions to gather financial information from a user and then constructs a
-    budget plan based on their responses.
-
-    Args:
-        history: A list of previous messages in the conversation, where each message
-                 is a dict with "role" ('user' or 'assistant') and "content".
-        user_message: The latest message from the user.
-
-    Returns:
-        The AI's next response in the conversation.
-    """
-    system_prompt = """
+# Registered as a template so it is compiled once and sent as a stable system instruction.
+BUDGET_PLANNER_SYSTEM_PROMPT = """
 You are a friendly and expert financial assistant specializing in budget planning. Your goal is to interactively guide the user through a series of questions to gather all the necessary information to create a comprehensive budget plan for them.
 
 **Your Process:**
@@ -40,28 +29,283 @@ You are a friendly and expert financial assistant specializing in budget plannin
 Maintain the context of the conversation. Use the provided chat history to understand what has already been discussed and what to ask next.
 """
 
+BUDGET_HISTORY_SUMMARY_SYSTEM_PROMPT = """
+You maintain a running summary of a budget planning conversation between a user and a financial assistant.
+You are given the current summary (if any) and the next messages of the conversation.
+Return an updated summary that keeps every fact the assistant needs to continue, as a concise list:
+- **Budget type:** Personal or Business.
+- **Income / Revenue:** amounts and frequency.
+- **Expenses:** fixed and variable, with amounts.
+- **Debts:** type, balance, interest rate, payments.
+- **Goals:** savings or business goals, with targets and timelines.
+- **Open questions:** what the assistant still has to ask.
+- **Plan status:** whether a plan was already proposed and any changes the user requested.
+Do not invent numbers. Keep amounts exactly as the user stated them. Return only the summary.
+"""
+
+BUDGET_PLAN_JSON_SYSTEM_PROMPT = """
+You are an expert financial assistant specializing in budget planning.
+From the budget planning conversation you are given, create the final budget plan as JSON matching the response schema.
+- Use only the income, expenses, debts and goals the user stated. Do not invent numbers; if an amount is unknown, estimate it from the stated figures and say so in the category's note.
+- Amounts are per `period` in the user's `currency`. Percentages are shares of `total_income` and the category percentages add up to at most 100.
+- Give 3 to 6 practical, specific tips.
+- Put the disclaimer that you are an AI assistant and the plan is a suggestion, to be reviewed with a human financial professional, in `disclaimer`.
+"""
+
+prompt_templates.registry.register("budget_planner", BUDGET_PLANNER_SYSTEM_PROMPT)
+prompt_templates.registry.register("budget_history_summary", BUDGET_HISTORY_SUMMARY_SYSTEM_PROMPT)
+prompt_templates.registry.register("budget_plan_json", BUDGET_PLAN_JSON_SYSTEM_PROMPT)
+
+
+class BudgetCategory(BaseModel):
+    name: str
+    kind: Literal["income", "fixed_expense", "variable_expense", "savings", "debt_repayment"]
+    amount: float = Field(ge=0)
+    percentage: float = Field(ge=0, le=100)
+    note: Optional[str] = None
+
+
+class BudgetPlan(BaseModel):
+    """A budget plan as typed data, so clients can chart and edit it without another model call."""
+    budget_type: Literal["Personal", "Business"]
+    currency: str
+    period: Literal["monthly", "yearly"]
+    total_income: float = Field(ge=0)
+    categories: List[BudgetCategory]
+    tips: List[str]
+    summary: str
+    disclaimer: str
+
+
+# The response schema for constrained generation, in the OpenAPI subset accepted by Gemini.
+# Kept in step with BudgetPlan, which validates the result.
+BUDGET_PLAN_RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "budget_type": {"type": "string", "enum": ["Personal", "Business"]},
+        "currency": {"type": "string"},
+        "period": {"type": "string", "enum": ["monthly", "yearly"]},
+        "total_income": {"type": "number"},
+        "categories": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "kind": {"type": "string", "enum": ["income", "fixed_expense", "variable_expense", "savings", "debt_repayment"]},
+                    "amount": {"type": "number"},
+                    "percentage": {"type": "number"},
+                    "note": {"type": "string", "nullable": True},
+                },
+                "required": ["name", "kind", "amount", "percentage"],
+            },
+        },
+        "tips": {"type": "array", "items": {"type": "string"}},
+        "summary": {"type": "string"},
+        "disclaimer": {"type": "string"},
+    },
+    "required": ["budget_type", "currency", "period", "total_income", "categories", "tips", "summary", "disclaimer"],
+}
+
+BUDGET_PLANS_COLLECTION = 'budget_plans'
+
+
+class BudgetPlanGenerationError(Exception):
+    """The model did not return a budget plan matching the schema."""
+
+
+def _format_messages(messages: List[Dict[str, Any]]) -> List[str]:
+    lines = []
+    for message in messages:
+        role = message.get("role", "user")
+        content = message.get("content", "")
+        lines.append(f"{role.capitalize()}: {content}")
+    return lines
+
+
+async def _summarize_budget_history(summary: Optional[str], messages: List[Dict[str, Any]]) -> Optional[str]:
+    """Folds older messages of a budget conversation into its running summary of facts."""
+    prompt_payload = "\n".join(
+        [f"Current summary:\n{summary or '(none yet)'}", "", "Next messages:"]
+        + _format_messages(messages)
+        + ["", "Updated summary:"]
+    )
+    try:
+        response = await llm_services.generate_ai_response(
+            prompt_payload,
+            system_prompt=prompt_templates.registry.get("budget_history_summary"),
+            endpoint="budget_history_summary"
+        )
+    except Exception as e:
+        # The fold is retried on the next message; the history is sent uncompacted meanwhile.
+        print(f"Skipping budget history summary: {e}")
+        return None
+    return response.text
+
+
+# Long planning sessions keep their last turns verbatim and fold older turns into a
+# cached rolling summary, so the prompt stays roughly constant in size.
+history_compactor = HistoryCompactor(
+    summarize=_summarize_budget_history,
+    keep_turns=int(os.getenv('BUDGET_HISTORY_KEEP_TURNS', '3')),
+    max_tokens=int(os.getenv('BUDGET_HISTORY_MAX_TOKENS', '1500')),
+    max_conversations=int(os.getenv('BUDGET_HISTORY_MAX_CONVERSATIONS', '1000'))
+)
+
+
+async def _build_budget_plan_prompt(
+    history: List[Dict[str, Any]],
+    user_message: str,
+    conversation_key: str,
+    closing: str = "\nAssistant:"
+) -> str:
+    """Builds the stateless prompt containing the (compacted) chat history, ended by `closing`."""
+
     # To maintain conversation context without relying on a stateful global object,
-    # we construct a single prompt that includes the system instructions and the entire chat history.
+    # we construct a single prompt that includes the chat history; the system
+    # instructions are sent separately as the model's system instruction.
     # This makes the call to the LLM stateless and safe for concurrent users.
     # We use `generate_ai_response` as it is a stateless call, unlike `chat_with_ai`.
 
-    full_prompt = [system_prompt]
+    compacted = await history_compactor.compact(conversation_key, history)
+    full_prompt = []
+    if compacted.summary:
+        full_prompt.append(f"Summary of the earlier conversation:\n{compacted.summary}\n")
 
-    # Reconstruct history for the prompt
-    for message in history:
-        role = message.get("role", "user")
-        content = message.get("content", "")
-        full_prompt.append(f"{role.capitalize()}: {content}")
+    # Reconstruct the recent history for the prompt
+    full_prompt.extend(_format_messages(compacted.messages))
 
     full_prompt.append(f"User: {user_message}")
-    full_prompt.append("\nAssistant:")
+    full_prompt.append(closing)
 
-    prompt_payload = "\n".join(full_prompt)
+    return "\n".join(full_prompt)
 
-    try:
-        # Using generate_ai_response because it's stateless, which is safer than the global chat object.
-        advice_text = llm_services.generate_ai_response(prompt_payload)
-        return advice_text
-    except Exception as e:
-        print(f"Error in get_budget_plan_chat_response: {e}")
-        return f"An error occurred during budget plan generation: {e}"
\ No newline at end of file
+
+async def get_budget_plan_chat_response(
+    history: List[Dict[str, Any]],
+    user_message: str,
+    conversation_key: str
+) -> llm_services.LLMResponse:
+    """
+    Handles the chat interaction for creating a budget plan.
+
+    This function manages a conversational flow where an AI assistant asks a series of
+    questions to gather financial information from a user and then constructs a
+    budget plan based on their responses.
+
+    Args:
+        history: A list of previous messages in the conversation, where each message
+                 is a dict with "role" ('user' or 'assistant') and "content".
+        user_message: The latest message from the user.
+        conversation_key: Identifies the conversation whose history summary is cached.
+
+    Returns:
+        The AI's next response in the conversation.
+    """
+    prompt_payload = await _build_budget_plan_prompt(history, user_message, conversation_key)
+    # Using generate_ai_response because it's stateless, which is safer than the global chat object.
+    return await llm_services.generate_ai_response(
+        prompt_payload,
+        system_prompt=prompt_templates.registry.get("budget_planner"),
+        endpoint="budget_planner_chat"
+    )
+
+
+async def stream_budget_plan_chat_response(
+    history: List[Dict[str, Any]],
+    user_message: str,
+    conversation_key: str
+) -> llm_services.LLMStream:
+    """
+    Streams the AI's next budget planning response as it is generated.
+
+    Args:
+        history: A list of previous messages in the conversation.
+        user_message: The latest message from the user.
+        conversation_key: Identifies the conversation whose history summary is cached.
+
+    Returns:
+        An LLMStream yielding the response text chunk by chunk.
+    """
+    prompt_payload = await _build_budget_plan_prompt(history, user_message, conversation_key)
+    return await llm_services.stream_ai_response(
+        prompt_payload,
+        system_prompt=prompt_templates.registry.get("budget_planner"),
+        endpoint="budget_planner_chat"
+    )
+
+
+async def create_structured_budget_plan(
+    history: List[Dict[str, Any]],
+    user_message: str,
+    conversation_key: str,
+    user_details: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Creates the final budget plan of a conversation as typed JSON, using
+    response-schema constrained generation, and stores it in Firestore.
+
+    Args:
+        history: A list of previous messages in the conversation.
+        user_message: The latest message from the user.
+        conversation_key: Identifies the conversation whose history summary is cached.
+        user_details: The requesting user, stored with the plan.
+
+    Returns:
+        A dict with the stored plan's `plan_id` (None if it could not be stored), the `plan`
+        and the model `response` it was parsed from.
+
+    Raises:
+        BudgetPlanGenerationError: The model's output did not validate against BudgetPlan.
+    """
+    prompt_payload = await _build_budget_plan_prompt(
+        history, user_message, conversation_key,
+        closing="\nCreate the final budget plan from the conversation above."
+    )
+    generation_config = {"response_mime_type": "application/json", "response_schema": BUDGET_PLAN_RESPONSE_SCHEMA}
+
+    plan, ai_response, error = None, None, None
+    # A second attempt bypasses the response cache in case a bad completion was cached.
+    for attempt in range(2):
+        ai_response = await llm_services.generate_ai_response(
+            prompt_payload,
+            refresh_cache=attempt > 0,
+            system_prompt=prompt_templates.registry.get("budget_plan_json"),
+            endpoint="budget_planner_chat",
+            generation_config=generation_config
+        )
+        try:
+            plan = BudgetPlan.model_validate_json(ai_response.text)
+            break
+        except ValidationError as e:
+            error = str(e)
+            print(f"Budget plan did not match the schema (attempt {attempt + 1}): {e}")
+    if plan is None:
+        raise BudgetPlanGenerationError(f"Could not generate a valid budget plan: {error}")
+
+    plan_data = plan.model_dump()
+    plan_id = await firestore_service.save_document(BUDGET_PLANS_COLLECTION, {
+        'plan': plan_data,
+        'conversation_key': conversation_key,
+        'user_details': user_details,
+        'model_name': ai_response.model_name,
+        'created_at': datetime.now(timezone.utc)
+    })
+    return {"plan_id": plan_id, "plan": plan_data, "response": ai_response}
+
+
+async def get_budget_plan(plan_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Loads a stored budget plan without calling the model.
+
+    Args:
+        plan_id: The id returned when the plan was created.
+
+    Returns:
+        The plan with its id and creation time, or None if there is no such plan.
+    """
+    stored = await firestore_service.get_document(BUDGET_PLANS_COLLECTION, plan_id)
+    if stored is None:
+        return None
+    # The owner's details stay in Firestore; only the plan itself is returned.
+    return {"plan_id": stored["id"], "plan": stored.get("plan"), "created_at": stored.get("created_at")}
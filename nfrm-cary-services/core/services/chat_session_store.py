@@ -0,0 +1,141 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Tuple
+
+from core.services.tokens import estimate_tokens
+
+# A single chat message as (role, text). Roles follow the Vertex AI convention: 'user' or 'model'.
+Message = Tuple[str, str]
+
+
+@dataclass
+class _Session:
+    history: List[Message] = field(default_factory=list)
+    token_count: int = 0
+    size_bytes: int = 0
+    last_access: float = field(default_factory=time.monotonic)
+
+
+class ChatSessionStore:
+    """
+    Keeps the chat history of each conversation, keyed by a session id.
+
+    History is capped per session both in turns (user + model message pairs) and
+    in estimated tokens, so a prompt never grows with the lifetime of the process.
+    Idle sessions expire after `ttl_seconds`, and the least recently used sessions
+    are evicted once `max_sessions` or the `max_bytes` memory ceiling is exceeded.
+    """
+
+    def __init__(
+        self,
+        max_turns: int = 10,
+        max_tokens: int = 8000,
+        ttl_seconds: float = 1800,
+        max_sessions: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024
+    ):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._ttl_evictions = 0
+        self._lru_evictions = 0
+        self._trimmed_turns = 0
+
+    def get_history(self, session_id: str) -> List[Message]:
+        """
+        Returns a copy of the history of a session, or an empty list for a new session.
+        """
+        self._evict_expired()
+        session = self._sessions.get(session_id)
+        if session is None:
+            self._misses += 1
+            return []
+        self._hits += 1
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return list(session.history)
+
+    def has_history(self, session_id: str) -> bool:
+        """Returns whether a live session with history exists, without counting a hit or miss."""
+        self._evict_expired()
+        session = self._sessions.get(session_id)
+        return session is not None and bool(session.history)
+
+    def token_count(self, session_id: str) -> int:
+        """Returns the estimated token count of a session's history (0 once it has expired)."""
+        self._evict_expired()
+        session = self._sessions.get(session_id)
+        return session.token_count if session is not None else 0
+
+    def append_turn(self, session_id: str, user_text: str, model_text: str):
+        """
+        Appends a user message and the model's reply to a session, trimming the
+        oldest turns once the session exceeds its turn or token cap. An expired
+        session is started afresh rather than extended.
+        """
+        self._evict_expired()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = _Session()
+            self._sessions[session_id] = session
+        self._total_bytes -= session.size_bytes
+
+        session.history.extend([("user", user_text), ("model", model_text)])
+        session.token_count += estimate_tokens(user_text) + estimate_tokens(model_text)
+        while len(session.history) > 2 and (
+            len(session.history) > 2 * self.max_turns or session.token_count > self.max_tokens
+        ):
+            for _ in range(2):
+                _, text = session.history.pop(0)
+                session.token_count -= estimate_tokens(text)
+            self._trimmed_turns += 1
+
+        session.size_bytes = sum(len(text.encode("utf-8")) for _, text in session.history)
+        session.last_access = time.monotonic()
+        self._total_bytes += session.size_bytes
+        self._sessions.move_to_end(session_id)
+        self._evict_lru()
+
+    def clear(self, session_id: str):
+        """Removes a session and its history."""
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._total_bytes -= session.size_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the current size of the store and its hit/eviction counters."""
+        return {
+            "sessions": len(self._sessions),
+            "total_bytes": self._total_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "ttl_evictions": self._ttl_evictions,
+            "lru_evictions": self._lru_evictions,
+            "trimmed_turns": self._trimmed_turns,
+        }
+
+    def _evict_expired(self):
+        # Sessions are kept in access order, so expired sessions are always at the front.
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access >= cutoff:
+                break
+            self.clear(session_id)
+            self._ttl_evictions += 1
+
+    def _evict_lru(self):
+        self._evict_expired()
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes
+        ):
+            session_id = next(iter(self._sessions))
+            self.clear(session_id)
+            self._lru_evictions += 1
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+from core.services.tokens import estimate_tokens
+
+# Extracts the facts relevant to any later question from one chunk: chunk text -> notes, or None on failure.
+Extractor = Callable[[str], Awaitable[Optional[str]]]
+
+# Lines that start a new page ("\f", "Page 3", "Page 3 of 10") or section (markdown
+# and numbered headings, all-caps titles). Table rows never count as boundaries.
+_PAGE_RE = re.compile(r"^(\f|\s*page\s+\d+(\s+of\s+\d+)?\s*$)", re.IGNORECASE)
+_HEADING_RE = re.compile(r"^(#{1,6}\s+\S|\d+(\.\d+)*\.?\s+[A-Z]|[A-Z][A-Z &/,()'-]{3,80}:?$)")
+
+
+@dataclass
+class ChunkNotes:
+    """The notes extracted from one chunk of a document."""
+    index: int
+    content_hash: str
+    notes: Optional[str]
+    cached: bool = False
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _is_boundary(line: str) -> bool:
+    if "|" in line or "\t" in line:
+        return False
+    return bool(_PAGE_RE.match(line) or _HEADING_RE.match(line.strip()))
+
+
+def _blocks(text: str) -> List[List[str]]:
+    """
+    Splits a document into blocks that are never broken up unless they alone exceed
+    a chunk: paragraphs separated by blank lines, and runs of table rows. A block
+    starting at a page or section boundary begins with that boundary line.
+    """
+    blocks: List[List[str]] = []
+    current: List[str] = []
+    for line in text.replace("\r\n", "\n").split("\n"):
+        if not line.strip():
+            if current:
+                blocks.append(current)
+                current = []
+            continue
+        if _is_boundary(line) and current:
+            blocks.append(current)
+            current = []
+        current.append(line)
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+def split_document(text: str, max_chunk_tokens: int) -> List[str]:
+    """
+    Splits a document into chunks of at most `max_chunk_tokens`, cutting at page,
+    section and paragraph boundaries and keeping tables together where possible.
+
+    Args:
+        text: The document content.
+        max_chunk_tokens: The largest chunk size, in estimated tokens.
+
+    Returns:
+        The chunks, in document order.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append("\n\n".join(current))
+        current, current_tokens = [], 0
+
+    for block in _blocks(text):
+        block_text = "\n".join(block)
+        block_tokens = estimate_tokens(block_text)
+        # Prefer to start a new chunk at a page or section boundary once the current one is half full.
+        if current and _is_boundary(block[0]) and current_tokens >= max_chunk_tokens // 2:
+            flush()
+        # A block larger than a chunk is cut between lines below, so a heading or page marker
+        # before it stays with its first lines instead of becoming a chunk of its own.
+        if current_tokens + block_tokens > max_chunk_tokens and block_tokens <= max_chunk_tokens:
+            flush()
+        if block_tokens <= max_chunk_tokens:
+            current.append(block_text)
+            current_tokens += block_tokens
+            continue
+        # A single block (e.g. a very long table) larger than a chunk is cut between lines.
+        lines: List[str] = []
+        for line in block:
+            line_tokens = estimate_tokens(line)
+            if lines and current_tokens + line_tokens > max_chunk_tokens:
+                current.append("\n".join(lines))
+                flush()
+                lines = []
+            lines.append(line)
+            current_tokens += line_tokens
+        current.append("\n".join(lines))
+    flush()
+    return chunks
+
+
+class DocumentReviewer:
+    """
+    Reviews documents too large for a single prompt in a map-reduce fashion.
+
+    The document is split on its structure, the notes relevant to any question are
+    extracted from each chunk in parallel (at most `max_concurrency` at a time),
+    and the question is then answered from the notes. Notes are cached by the
+    SHA-256 of the chunk, so follow-up questions on the same document, or documents
+    sharing pages, only extract the chunks not seen before.
+    """
+
+    def __init__(self, extract: Extractor, max_chunk_tokens: int = 4000, max_concurrency: int = 4, max_entries: int = 2000):
+        self._extract = extract
+        self.max_chunk_tokens = max_chunk_tokens
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_entries = max_entries
+        self._notes: "OrderedDict[str, str]" = OrderedDict()
+        self._documents = 0
+        self._chunks = 0
+        self._cache_hits = 0
+        self._failed_chunks = 0
+
+    async def extract_notes(self, document_content: str) -> List[ChunkNotes]:
+        """
+        Splits a document and extracts the notes of every chunk.
+
+        Args:
+            document_content: The text content of the document.
+
+        Returns:
+            The notes of each chunk, in document order. A chunk whose extraction
+            failed has `notes` set to None.
+        """
+        return await self.extract_chunk_notes(split_document(document_content, self.max_chunk_tokens))
+
+    async def extract_chunk_notes(self, chunks: List[str]) -> List[ChunkNotes]:
+        """
+        Extracts the notes of every chunk of an already split document, in document order.
+        A chunk whose extraction fails is recorded as failed without stopping the
+        others; only if every chunk failed is the first error raised.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._documents += 1
+        self._chunks += len(chunks)
+        errors: List[Exception] = []
+
+        async def extract(index: int, chunk: str) -> ChunkNotes:
+            content_hash = _content_hash(chunk)
+            notes = self._notes.get(content_hash)
+            if notes is not None:
+                self._notes.move_to_end(content_hash)
+                self._cache_hits += 1
+                return ChunkNotes(index=index, content_hash=content_hash, notes=notes, cached=True)
+            async with semaphore:
+                try:
+                    notes = await self._extract(chunk)
+                except Exception as e:
+                    print(f"Failed to extract the notes of chunk {index}: {e}")
+                    errors.append(e)
+                    notes = None
+            if notes:
+                self._store(content_hash, notes)
+            else:
+                self._failed_chunks += 1
+            return ChunkNotes(index=index, content_hash=content_hash, notes=notes or None)
+
+        notes = list(await asyncio.gather(*(extract(index, chunk) for index, chunk in enumerate(chunks))))
+        if errors and not any(chunk.notes for chunk in notes):
+            # Nothing to answer from (e.g. the model is unavailable): report the error instead.
+            raise errors[0]
+        return notes
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns how many chunks were extracted and how often notes were reused."""
+        return {
+            "documents": self._documents,
+            "chunks": self._chunks,
+            "cache_hits": self._cache_hits,
+            "failed_chunks": self._failed_chunks,
+            "cached_chunks": len(self._notes),
+        }
+
+    def _store(self, content_hash: str, notes: str):
+        self._notes[content_hash] = notes
+        self._notes.move_to_end(content_hash)
+        while len(self._notes) > self.max_entries:
+            self._notes.popitem(last=False)
@@ -0,0 +1,151 @@
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+from core.services.document_review import split_document
+from core.services.tokens import estimate_tokens
+
+
+@dataclass
+class StoredDocument:
+    """
+    An uploaded document with the artifacts derived from it once, at upload time:
+    its token count, its sections and, for large documents, the section notes
+    that questions are answered from.
+    """
+    document_id: str
+    text: str
+    token_count: int
+    chunks: List[str]
+    created_at: float = field(default_factory=time.time)
+    summary: Optional[str] = None
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self.text.encode("utf-8")) + sum(len(chunk.encode("utf-8")) for chunk in self.chunks) + len((self.summary or "").encode("utf-8"))
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "document_id": self.document_id,
+            "token_count": self.token_count,
+            "chunks": len(self.chunks),
+            "size_bytes": len(self.text.encode("utf-8")),
+            "summarized": self.summary is not None,
+        }
+
+
+class DocumentTooLargeError(Exception):
+    """The document alone is larger than the store's memory budget."""
+
+
+def normalize_document(text: str) -> str:
+    """
+    Normalizes document text so the same content uploaded twice (e.g. with
+    different line endings or trailing spaces) gets the same id.
+    """
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+class DocumentStore:
+    """
+    An in-memory, content-addressed store of uploaded documents, so clients upload
+    a document once and refer to it by id in every question about it.
+
+    Documents are evicted least recently used first once there are more than
+    `max_documents` of them or together they exceed `max_bytes`; a single document
+    larger than `max_bytes` is rejected. The store is per instance: a client whose
+    document id is not found uploads it again.
+    """
+
+    def __init__(self, max_chunk_tokens: int, max_documents: int = 500, max_bytes: int = 128 * 1024 * 1024):
+        self.max_chunk_tokens = max_chunk_tokens
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self._documents: "OrderedDict[str, StoredDocument]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._uploads = 0
+        self._evictions = 0
+
+    def put(self, text: str) -> StoredDocument:
+        """
+        Stores a document, or returns the stored one if the same content was uploaded before.
+
+        Args:
+            text: The document content.
+
+        Returns:
+            The stored document, with its id, token count and sections.
+
+        Raises:
+            DocumentTooLargeError: The document is larger than `max_bytes` on its own.
+        """
+        normalized = normalize_document(text)
+        document_id = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        self._uploads += 1
+        document = self._documents.get(document_id)
+        if document is not None:
+            self._documents.move_to_end(document_id)
+            return document
+        # Checked on the text first so an oversized upload is not split for nothing.
+        self._check_size(len(normalized.encode("utf-8")))
+        document = StoredDocument(
+            document_id=document_id,
+            text=normalized,
+            token_count=estimate_tokens(normalized),
+            chunks=split_document(normalized, self.max_chunk_tokens)
+        )
+        self._check_size(document.size_bytes)
+        self._documents[document_id] = document
+        self._bytes += document.size_bytes
+        self._evict()
+        return document
+
+    def get(self, document_id: str) -> Optional[StoredDocument]:
+        """Returns a stored document, or None if it was never uploaded or has been evicted."""
+        document = self._documents.get(document_id)
+        if document is None:
+            self._misses += 1
+            return None
+        self._documents.move_to_end(document_id)
+        self._hits += 1
+        return document
+
+    def set_summary(self, document: StoredDocument, summary: str):
+        """Attaches the section notes of a document, which count towards the store's size."""
+        if document.summary == summary:
+            return
+        size_before = document.size_bytes
+        document.summary = summary
+        if self._documents.get(document.document_id) is document:
+            self._bytes += document.size_bytes - size_before
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the store's size and how often documents were found by id."""
+        return {
+            "documents": len(self._documents),
+            "bytes": self._bytes,
+            "uploads": self._uploads,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+        }
+
+    def _check_size(self, size_bytes: int):
+        if size_bytes > self.max_bytes:
+            raise DocumentTooLargeError(f"The document is too large to keep: {size_bytes} bytes, at most {self.max_bytes} allowed.")
+
+    def _evict(self):
+        # The most recently used document is kept, so one whose notes push it over the budget stays readable.
+        while len(self._documents) > 1 and (len(self._documents) > self.max_documents or self._bytes > self.max_bytes):
+            _, evicted = self._documents.popitem(last=False)
+            self._bytes -= evicted.size_bytes
+            self._evictions += 1
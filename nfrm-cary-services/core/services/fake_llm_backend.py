@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from google.api_core import exceptions as google_exceptions
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from core.services.llm_backend import LLMBackend
+from core.services.prompt_templates import CompiledPrompt
+from core.services.tokens import estimate_tokens
+
+_WORDS = (
+    "budget savings income expenses debt credit interest retirement investment portfolio "
+    "cash flow emergency fund plan goal monthly rate risk return tax account balance "
+    "allocation payment loan revenue cost growth review summary advice consider"
+).split()
+
+
+class Distribution:
+    """
+    A random distribution parsed from a spec string:
+    "fixed:V", "uniform:MIN,MAX", "exponential:MEAN" or "lognormal:MEDIAN,SIGMA".
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, args = spec.partition(":")
+        self.kind = kind.strip().lower()
+        self.args = [float(arg) for arg in args.split(",") if arg.strip()]
+        if self.kind not in ("fixed", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"Unknown distribution '{spec}'")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "uniform":
+            return rng.uniform(self.args[0], self.args[1])
+        if self.kind == "exponential":
+            return rng.expovariate(1.0 / self.args[0])
+        return rng.lognormvariate(math.log(self.args[0]), self.args[1])
+
+
+def _fake_value(schema: Dict[str, Any], rng: random.Random) -> Any:
+    """Generates a value matching an OpenAPI-style response schema."""
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    kind = str(schema.get("type", "string")).lower()
+    if kind == "object":
+        return {name: _fake_value(prop, rng) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_fake_value(schema.get("items", {}), rng) for _ in range(rng.randint(2, 5))]
+    if kind == "number":
+        return round(rng.uniform(10, 5000), 2)
+    if kind == "integer":
+        return rng.randint(1, 100)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 6)))
+
+
+@dataclass
+class FakeResponse:
+    """A response (or streamed chunk) shaped like the Vertex AI SDK's."""
+    text: str
+    usage_metadata: Optional[Dict[str, int]] = None
+
+
+class FakeBackend(LLMBackend):
+    """
+    An in-process stand-in for Vertex AI, for benchmarking the service without
+    GCP credentials or network access.
+
+    Responses are deterministic for a given seed, model and prompt. Each call waits
+    for a sampled time to first token, then produces a sampled number of output
+    tokens at `tokens_per_second`, streamed `chunk_tokens` at a time. A fraction
+    `error_rate` of calls fails with a retryable ServiceUnavailable error.
+    """
+    name = "fake"
+
+    def __init__(
+        self,
+        first_token_latency_ms: Distribution,
+        output_tokens: Distribution,
+        tokens_per_second: float,
+        chunk_tokens: int = 8,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        tool_script: Optional[List[Dict[str, Any]]] = None
+    ):
+        self.first_token_latency_ms = first_token_latency_ms
+        self.output_tokens = output_tokens
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.error_rate = error_rate
+        self.seed = seed
+        self.tool_script = tool_script if tool_script is not None else [{"tool": "count_api_logs", "args": {"filters": []}}]
+
+    def initialize(self):
+        print(
+            f"Using the fake LLM backend: first token {self.first_token_latency_ms.spec} ms, "
+            f"{self.output_tokens.spec} output tokens at {self.tokens_per_second} tokens/s, error rate {self.error_rate}."
+        )
+
+    def get_model(self, model_name: str, system_instruction: Optional[str] = None) -> "FakeModel":
+        return FakeModel(self, model_name, system_instruction)
+
+    def create_context_cached_model(self, model_name: str, system_prompt: CompiledPrompt, ttl_seconds: float) -> "FakeModel":
+        return FakeModel(self, model_name, system_prompt.text)
+
+    def start_chat(self, chat_model: "FakeModel", history: List[Tuple[str, str]]) -> "FakeChat":
+        return FakeChat(chat_model, list(history))
+
+    def create_agent_chat_model(self, model_name: str, system_instruction: str) -> BaseChatModel:
+        return ScriptedToolChatModel(script=self.tool_script, backend=self)
+
+    def rng(self, *parts: str) -> random.Random:
+        digest = hashlib.sha256("\x1f".join((str(self.seed),) + parts).encode("utf-8")).hexdigest()
+        return random.Random(digest)
+
+    def first_token_delay(self, rng: random.Random) -> float:
+        return max(0.0, self.first_token_latency_ms.sample(rng)) / 1000.0
+
+    def check_error(self, rng: random.Random):
+        if self.error_rate and rng.random() < self.error_rate:
+            raise google_exceptions.ServiceUnavailable("Injected fake backend error")
+
+
+class FakeModel:
+    """A fake GenerativeModel."""
+
+    def __init__(self, backend: FakeBackend, model_name: str, system_instruction: Optional[str]):
+        self.backend = backend
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    async def generate_content_async(
+        self,
+        prompt: str,
+        stream: bool = False,
+        history_text: str = "",
+        generation_config: Optional[Dict[str, Any]] = None
+    ):
+        # Errors are sampled from a fresh source so retries of the same prompt can succeed.
+        self.backend.check_error(random.Random())
+        rng = self.backend.rng(self.model_name, self.system_instruction or "", history_text, prompt)
+        schema = (generation_config or {}).get("response_schema")
+        if schema:
+            # Constrained generation: a JSON document matching the schema, "streamed" word by word.
+            words = json.dumps(_fake_value(schema, rng)).split(" ")
+            output_tokens = len(words)
+        else:
+            output_tokens = max(1, int(self.backend.output_tokens.sample(rng)))
+            words = [rng.choice(_WORDS) for _ in range(output_tokens)]
+        usage = {
+            "prompt_token_count": estimate_tokens((self.system_instruction or "") + history_text + prompt),
+            "candidates_token_count": output_tokens,
+            "total_token_count": 0,
+            "cached_content_token_count": 0,
+        }
+        usage["total_token_count"] = usage["prompt_token_count"] + output_tokens
+        first_token_delay = self.backend.first_token_delay(rng)
+
+        if stream:
+            return self._stream(words, usage, first_token_delay)
+        await asyncio.sleep(first_token_delay + output_tokens / self.backend.tokens_per_second)
+        return FakeResponse(text=" ".join(words), usage_metadata=usage)
+
+    async def _stream(self, words: List[str], usage: Dict[str, int], first_token_delay: float) -> AsyncIterator[FakeResponse]:
+        await asyncio.sleep(first_token_delay)
+        size = self.backend.chunk_tokens
+        for start in range(0, len(words), size):
+            chunk = words[start:start + size]
+            last = start + size >= len(words)
+            await asyncio.sleep(len(chunk) / self.backend.tokens_per_second)
+            yield FakeResponse(
+                text=(" " if start else "") + " ".join(chunk),
+                usage_metadata=usage if last else None
+            )
+
+
+class FakeChat:
+    """A fake ChatSession."""
+
+    def __init__(self, chat_model: FakeModel, history: List[Tuple[str, str]]):
+        self.chat_model = chat_model
+        self.history = history
+
+    async def send_message_async(self, prompt: str, stream: bool = False):
+        history_text = "\n".join(f"{role}: {text}" for role, text in self.history)
+        return await self.chat_model.generate_content_async(prompt, stream=stream, history_text=history_text)
+
+
+class ScriptedToolChatModel(BaseChatModel):
+    """
+    A LangChain chat model for the admin agent that follows a tool-call script.
+
+    Each step of the script is either {"tool": name, "args": {...}}, answered with a
+    tool call, or {"text": "..."}, answered with that text. Once the script is
+    exhausted the model answers with the output of the last tool call.
+    """
+    script: List[Dict[str, Any]]
+    backend: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-scripted-tools"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ScriptedToolChatModel":
+        return self
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        step = sum(1 for message in messages if isinstance(message, AIMessage))
+        if step < len(self.script):
+            action = self.script[step]
+            if "tool" in action:
+                message = AIMessage(content="", tool_calls=[{
+                    "name": action["tool"],
+                    "args": action.get("args", {}),
+                    "id": f"call_{step}",
+                }])
+            else:
+                message = AIMessage(content=action.get("text", ""))
+        else:
+            tool_outputs = [m.content for m in messages if isinstance(m, ToolMessage)]
+            message = AIMessage(content=f"Here is what I found: {tool_outputs[-1]}" if tool_outputs else "Hello! How can I help?")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.backend is not None:
+            rng = self.backend.rng("agent", *(str(m.content) for m in messages))
+            await asyncio.sleep(self.backend.first_token_delay(rng))
+        return self._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def create_fake_backend_from_env() -> FakeBackend:
+    """Builds the fake backend from the FAKE_LLM_* env vars."""
+    tool_script = None
+    raw_script = os.getenv('FAKE_LLM_TOOL_SCRIPT')
+    if raw_script:
+        try:
+            tool_script = json.loads(raw_script)
+        except json.JSONDecodeError as e:
+            print(f"Ignoring invalid FAKE_LLM_TOOL_SCRIPT: {e}")
+    return FakeBackend(
+        first_token_latency_ms=Distribution(os.getenv('FAKE_LLM_FIRST_TOKEN_LATENCY_MS', 'lognormal:250,0.4')),
+        output_tokens=Distribution(os.getenv('FAKE_LLM_OUTPUT_TOKENS', 'uniform:80,400')),
+        tokens_per_second=float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', '80')),
+        chunk_tokens=int(os.getenv('FAKE_LLM_CHUNK_TOKENS', '8')),
+        error_rate=float(os.getenv('FAKE_LLM_ERROR_RATE', '0')),
+        seed=int(os.getenv('FAKE_LLM_SEED', '0')),
+        tool_script=tool_script
+    )
@@ -1,7 +1,12 @@
-from typing import List, Literal
+import asyncio
+import os
+from typing import Dict, List, Literal, Optional
 
 # Import the llm_services module to interact with the AI model
-from core.services import llm_services
+from core.services import llm_services, prompt_templates
+from core.services.document_review import ChunkNotes, DocumentReviewer
+from core.services.document_store import DocumentStore, DocumentTooLargeError, StoredDocument
+from core.services.popular_answers_warmer import PopularAnswersWarmer
 
 # Using Literal for type hinting the allowed question types
 QuestionType = Literal["Personal", "Business"]
@@ -33,6 +38,93 @@ POPULAR_BUSINESS_FINANCE_QUESTIONS = [
     "What are the tax implications of different business structures?",
 ]
 
+# System prompts are registered as templates so each is compiled once per language
+# and sent as a stable system instruction instead of being rebuilt on every request.
+FINANCIAL_ADVICE_SYSTEM_PROMPT = """You are a comprehensive and expert financial advisor AI. Your goal is to provide clear, practical, and responsible financial guidance. You are equipped to handle a wide range of financial topics.
+
+**IMPORTANT: You MUST provide your entire response in the following language: {language}.**
+
+You must be able to answer questions related to:
+- **Personal Finance:** Budgeting, saving, debt management (credit cards, loans), retirement planning (401k, IRA), and building an emergency fund.
+- **Investing:** Stock market basics, mutual funds, ETFs, bonds, real estate, and risk tolerance assessment. Explain concepts clearly and provide general information, but do NOT give personalized investment advice to buy or sell specific securities.
+- **Small Business:** Guidance on starting a business, creating a business plan, managing cash flow, understanding funding options, and basic accounting principles.
+- **Finding Investors:** Strategies for seeking seed funding, venture capital, angel investors, and preparing a pitch deck.
+
+**Your Persona:**
+- **Knowledgeable & Clear:** Break down complex topics into easy-to-understand language.
+- **Prudent & Responsible:** Always include a disclaimer that you are an AI assistant and that users should consult with a qualified human financial professional for personalized advice before making any financial decisions.
+- **Supportive & Unbiased:** Provide balanced information about different financial strategies and products.
+- **Conversational:** Engage with the user in a helpful and approachable manner. Do not refer to yourself as a language model. Act as a human advisor.
+
+Remember to maintain the context of the conversation if it's an ongoing chat.
+"""
+
+DOCUMENT_REVIEW_SYSTEM_PROMPT = """You are an expert financial document analyst AI. Your primary function is to review the content of financial documents provided by the user, offer insightful suggestions, and answer specific questions.
+
+**Your Task:**
+1.  **Analyze the Document:** Carefully read and understand the provided financial document content.
+2.  **Provide Suggestions:** Based on the user's request, offer suggestions to improve clarity, identify potential risks, highlight key figures or clauses, or point out missing information.
+3.  **Answer Questions:** Address the user's follow-up questions about the document accurately. Use the document content as the primary source of truth for your answers.
+4.  **Maintain Context:** Remember the document content and previous questions to provide coherent, conversational follow-up responses.
+
+**Your Persona:**
+- **Analytical & Meticulous:** Pay close attention to detail.
+- **Helpful & Clear:** Explain your findings and suggestions in an easy-to-understand manner.
+- **Objective & Neutral:** Do not offer personal opinions or advice beyond the scope of analyzing the document.
+- **Prudent & Responsible:** Always include a disclaimer that you are an AI assistant and that users should consult with qualified human professionals (like lawyers or financial advisors) for legally binding or personalized advice.
+"""
+
+DOCUMENT_EXTRACT_SYSTEM_PROMPT = """You are an expert financial document analyst AI. You are given one section of a larger financial document. Other sections are processed separately, and questions about the document will later be answered from your notes alone, so write notes that stand on their own.
+
+**Your Task:**
+- Record every figure with its label, period and currency: balances, totals, amounts, rates, fees and dates.
+- Summarize table contents, keeping the rows that carry totals, unusual values or recurring items.
+- Note clauses, obligations, deadlines, risks, inconsistencies and missing information.
+- Keep the section's own headings so the notes can be traced back to the document.
+
+Write concise bullet points. Do not answer questions, give advice or add a disclaimer. If the section holds nothing of substance, reply with "No relevant content."
+"""
+
+prompt_templates.registry.register("financial_advice", FINANCIAL_ADVICE_SYSTEM_PROMPT)
+prompt_templates.registry.register("document_review", DOCUMENT_REVIEW_SYSTEM_PROMPT)
+prompt_templates.registry.register("document_extract", DOCUMENT_EXTRACT_SYSTEM_PROMPT)
+
+# Answers to the popular questions are pre-generated in the background, in each of
+# these languages, so a one-tap suggestion is answered without a cold model call.
+popular_answers = PopularAnswersWarmer(
+    languages=[lang.strip() for lang in os.getenv('POPULAR_ANSWERS_LANGUAGES', 'English').split(',') if lang.strip()],
+    refresh_seconds=float(os.getenv('POPULAR_ANSWERS_REFRESH_SECONDS', str(6 * 3600))),
+    max_requests_per_minute=float(os.getenv('POPULAR_ANSWERS_MAX_REQUESTS_PER_MINUTE', '30'))
+)
+
+async def _extract_chunk_notes(chunk: str) -> Optional[str]:
+    """Extracts the notes of one section of a large document, to answer questions from later."""
+    response = await llm_services.generate_ai_response(
+        f"**Section of the user's document:**\n---\n{chunk}\n---\n\nYour notes:",
+        system_prompt=prompt_templates.registry.get("document_extract"),
+        endpoint="document_review_extract"
+    )
+    return response.text
+
+# Documents of at least this many tokens are reviewed map-reduce style: sections are
+# extracted in parallel and the question is answered from the extracted notes.
+document_map_reduce_min_tokens = int(os.getenv('DOCUMENT_REVIEW_MAP_REDUCE_MIN_TOKENS', '12000'))
+document_reviewer = DocumentReviewer(
+    _extract_chunk_notes,
+    max_chunk_tokens=int(os.getenv('DOCUMENT_REVIEW_CHUNK_TOKENS', '4000')),
+    max_concurrency=int(os.getenv('DOCUMENT_REVIEW_MAX_CONCURRENCY', '4')),
+    max_entries=int(os.getenv('DOCUMENT_REVIEW_MAX_CACHED_CHUNKS', '2000'))
+)
+
+# Uploaded documents, referenced by id in review questions instead of being resent.
+document_store = DocumentStore(
+    max_chunk_tokens=document_reviewer.max_chunk_tokens,
+    max_documents=int(os.getenv('DOCUMENT_STORE_MAX_DOCUMENTS', '500')),
+    max_bytes=int(os.getenv('DOCUMENT_STORE_MAX_BYTES', str(128 * 1024 * 1024)))
+)
+# The note extraction in progress per document id, shared by the upload and the first questions.
+_summarize_tasks: Dict[str, asyncio.Task] = {}
+
 def get_popular_questions(question_type: QuestionType, count: int) -> List[str]:
     """
     Retrieves a specified number of popular financial questions based on the type.
@@ -51,86 +143,233 @@ def get_popular_questions(question_type: QuestionType, count: int) -> List[str]:
     return []
 
 
-def get_financial_advice_chat(user_question: str, language: str = "English") -> str:
+async def _generate_popular_answer(question: str, language: str) -> Optional[str]:
+    """Generates a fresh answer to a popular question, as advise_chat would for an opening message."""
+    prompt_payload = _build_financial_advice_prompt(question)
+    response = await llm_services.generate_ai_response(
+        prompt_payload,
+        language=language,
+        refresh_cache=True,
+        system_prompt=prompt_templates.registry.get("financial_advice", language),
+        endpoint="popular_answers_warmer"
+    )
+    return response.text
+
+
+def start_popular_answers_warmer():
+    """
+    Starts pre-generating answers for the popular questions catalogue in the background.
+    Disabled by setting POPULAR_ANSWERS_WARMER_ENABLED=false.
+    """
+    if os.getenv('POPULAR_ANSWERS_WARMER_ENABLED', 'true').lower() != 'true':
+        print("Popular answers warmer is disabled.")
+        return
+    questions = POPULAR_PERSONAL_FINANCE_QUESTIONS + POPULAR_BUSINESS_FINANCE_QUESTIONS
+    popular_answers.start(questions, _generate_popular_answer)
+
+
+def _build_financial_advice_prompt(user_question: str) -> str:
+    """Builds the chat message for a financial advice question."""
+    return f"User's question: \"{user_question}\"\n\nYour financial advice:"
+
+
+def _popular_answer(user_question: str, session_id: str, language: str) -> Optional[str]:
+    """
+    Returns the pre-generated answer to a popular question, but only as the opening
+    message of a conversation: a follow-up is answered in the context of its history.
+    """
+    if llm_services.session_store.has_history(session_id):
+        return None
+    return popular_answers.get(user_question, language)
+
+
+async def get_financial_advice_chat(user_question: str, session_id: str, language: str = "English") -> llm_services.LLMResponse:
     """
     Gets financial advice from the AI in a chat session.
     This function is moved from the router to the service layer for better code organization.
+    Popular questions that open a conversation are answered instantly from their pre-generated answers.
 
     Args:
         user_question: The financial question from the user.
+        session_id: Identifies the user's conversation so its history is kept separate.
         language: The language for the AI's response.
 
     Returns:
-        The AI's financial advice, or an error message.
+        The AI's financial advice, flagged if it was served from the cache.
     """
-    system_prompt = f"""You are a comprehensive and expert financial advisor AI. Your goal is to provide clear, practical, and responsible financial guidance. You are equipped to handle a wide range of financial topics.
+    prompt_payload = _build_financial_advice_prompt(user_question)
+    popular_answer = _popular_answer(user_question, session_id, language)
+    if popular_answer is not None:
+        return llm_services.chat_reply_from_text(prompt_payload, session_id, popular_answer)
 
-**IMPORTANT: You MUST provide your entire response in the following language: {language}.**
+    return await llm_services.chat_with_ai(
+        prompt_payload,
+        session_id,
+        language=language,
+        system_prompt=prompt_templates.registry.get("financial_advice", language),
+        endpoint="financial_advisor_chat"
+    )
 
-You must be able to answer questions related to:
-- **Personal Finance:** Budgeting, saving, debt management (credit cards, loans), retirement planning (401k, IRA), and building an emergency fund.
-- **Investing:** Stock market basics, mutual funds, ETFs, bonds, real estate, and risk tolerance assessment. Explain concepts clearly and provide general information, but do NOT give personalized investment advice to buy or sell specific securities.
-- **Small Business:** Guidance on starting a business, creating a business plan, managing cash flow, understanding funding options, and basic accounting principles.
-- **Finding Investors:** Strategies for seeking seed funding, venture capital, angel investors, and preparing a pitch deck.
 
-**Your Persona:**
-- **Knowledgeable & Clear:** Break down complex topics into easy-to-understand language.
-- **Prudent & Responsible:** Always include a disclaimer that you are an AI assistant and that users should consult with a qualified human financial professional for personalized advice before making any financial decisions.
-- **Supportive & Unbiased:** Provide balanced information about different financial strategies and products.
-- **Conversational:** Engage with the user in a helpful and approachable manner. Do not refer to yourself as a language model. Act as a human advisor.
+async def stream_financial_advice_chat(user_question: str, session_id: str, language: str = "English") -> llm_services.LLMStream:
+    """
+    Streams financial advice from the AI chat session as it is generated.
+
+    Args:
+        user_question: The financial question from the user.
+        session_id: Identifies the user's conversation so its history is kept separate.
+        language: The language for the AI's response.
+
+    Returns:
+        An LLMStream yielding the advice text chunk by chunk.
+    """
+    prompt_payload = _build_financial_advice_prompt(user_question)
+    popular_answer = _popular_answer(user_question, session_id, language)
+    if popular_answer is not None:
+        return llm_services.stream_chat_reply_from_text(prompt_payload, session_id, popular_answer)
+    return await llm_services.stream_chat_with_ai(
+        prompt_payload,
+        session_id,
+        language=language,
+        system_prompt=prompt_templates.registry.get("financial_advice", language),
+        endpoint="financial_advisor_chat"
+    )
+
+
+def _build_document_review_prompt(document_content: str, user_question: str) -> str:
+    """Builds the chat message for a question about a financial document."""
+    # Combine the document and user question into a single message for the chat.
+    # The chat model will use the system prompt and document as context for the user's question.
+    return f"**User's Document:**\n---\n{document_content}\n---\n\nUser's question about the document: \"{user_question}\"\n\nYour analysis and response:"
 
-Remember to maintain the context of the conversation if it's an ongoing chat.
-"""
-    
-    prompt_payload = f"{system_prompt}\n\nUser's question: \"{user_question}\"\n\nYour financial advice:"
-    
-    try:
-        advice_text = llm_services.chat_with_ai(prompt_payload)
-        return advice_text
-    except Exception as e:
-        print(f"Error in get_financial_advice_chat: {e}")
-        return f"An error occurred during financial advice generation: {e}"
 
+def _format_document_notes(notes: List[ChunkNotes]) -> str:
+    """Joins the notes of a large document's sections into the text questions are answered from."""
+    return "\n\n".join(
+        f"[Section {chunk.index + 1} of {len(notes)}]\n{chunk.notes or 'This section could not be analysed.'}"
+        for chunk in notes
+    )
 
-def get_document_review_chat(document_content: str, user_question: str) -> str:
+
+def _build_document_notes_prompt(document_notes: str, user_question: str) -> str:
+    """Builds the chat message for a question about a large document, from the notes of its sections."""
+    return (
+        f"**Notes on the user's document, section by section:**\n---\n{document_notes}\n---\n\n"
+        f"User's question about the document: \"{user_question}\"\n\nYour analysis and response:"
+    )
+
+
+async def _extract_document_notes(document: StoredDocument) -> str:
+    notes = await document_reviewer.extract_chunk_notes(document.chunks)
+    print(f"Extracted notes of a large document from {len(notes)} sections ({sum(1 for n in notes if n.cached)} cached).")
+    document_notes = _format_document_notes(notes)
+    # Notes with failed sections are used once but not kept, so the next question retries them.
+    if all(chunk.notes for chunk in notes):
+        document_store.set_summary(document, document_notes)
+    return document_notes
+
+
+def _summary_task(document: StoredDocument) -> asyncio.Task:
+    """Returns the note extraction in progress for a document, starting it if there is none."""
+    task = _summarize_tasks.get(document.document_id)
+    if task is not None:
+        return task
+    task = asyncio.create_task(_extract_document_notes(document))
+    _summarize_tasks[document.document_id] = task
+
+    def done(finished: asyncio.Task):
+        if _summarize_tasks.get(document.document_id) is finished:
+            del _summarize_tasks[document.document_id]
+        if not finished.cancelled() and finished.exception() is not None:
+            print(f"Error extracting notes of document '{document.document_id}': {finished.exception()}")
+
+    task.add_done_callback(done)
+    return task
+
+
+async def _summarize_document(document: StoredDocument) -> str:
     """
-    Analyzes financial document content and answers user questions about it.
+    Returns the section notes of a large document, extracting them on first use.
+    A question asked while the extraction started at upload is still running waits
+    for it instead of extracting the document again.
+    """
+    if document.summary is not None:
+        return document.summary
+    # Shielded so a client disconnecting does not cancel the extraction other questions wait on.
+    return await asyncio.shield(_summary_task(document))
+
+
+def store_document(document_content: str) -> StoredDocument:
+    """
+    Stores an uploaded document. The notes of a large document are extracted in
+    the background right away, so the first question about it is answered sooner.
 
     Args:
         document_content: The text content of the financial document.
+
+    Returns:
+        The stored document, whose `document_id` is used to ask questions about it.
+
+    Raises:
+        DocumentTooLargeError: The document is larger than the store's memory budget.
+    """
+    document = document_store.put(document_content)
+    if document.token_count >= document_map_reduce_min_tokens and document.summary is None:
+        _summary_task(document)
+    return document
+
+
+async def _document_review_prompt(document: StoredDocument, user_question: str) -> str:
+    """
+    Builds the review prompt: the whole document if it is small enough, otherwise
+    the notes extracted from each of its sections.
+    """
+    if document.token_count < document_map_reduce_min_tokens:
+        return _build_document_review_prompt(document.text, user_question)
+    return _build_document_notes_prompt(await _summarize_document(document), user_question)
+
+
+async def get_document_review_chat(document: StoredDocument, user_question: str, session_id: str) -> llm_services.LLMResponse:
+    """
+    Analyzes financial document content and answers user questions about it.
+    Documents too large for one prompt are answered from notes extracted from
+    each of their sections; the notes are cached for follow-up questions.
+
+    Args:
+        document: The stored financial document.
         user_question: The user's specific question or request about the document.
+        session_id: Identifies the user's conversation so its history is kept separate.
 
     Returns:
         The AI's analysis and response.
     """
-    system_prompt = f"""You are an expert financial document analyst AI. Your primary function is to review the content of financial documents provided by the user, offer insightful suggestions, and answer specific questions.
+    prompt_payload = await _document_review_prompt(document, user_question)
+    # Use the chat_with_ai function to maintain conversation context for follow-up questions.
+    return await llm_services.chat_with_ai(
+        prompt_payload,
+        session_id,
+        system_prompt=prompt_templates.registry.get("document_review"),
+        endpoint="document_reviewer_chat"
+    )
 
-**Your Task:**
-1.  **Analyze the Document:** Carefully read and understand the provided financial document content.
-2.  **Provide Suggestions:** Based on the user's request, offer suggestions to improve clarity, identify potential risks, highlight key figures or clauses, or point out missing information.
-3.  **Answer Questions:** Address the user's follow-up questions about the document accurately. Use the document content as the primary source of truth for your answers.
-4.  **Maintain Context:** Remember the document content and previous questions to provide coherent, conversational follow-up responses.
 
-**Your Persona:**
-- **Analytical & Meticulous:** Pay close attention to detail.
-- **Helpful & Clear:** Explain your findings and suggestions in an easy-to-understand manner.
-- **Objective & Neutral:** Do not offer personal opinions or advice beyond the scope of analyzing the document.
-- **Prudent & Responsible:** Always include a disclaimer that you are an AI assistant and that users should consult with qualified human professionals (like lawyers or financial advisors) for legally binding or personalized advice.
+async def stream_document_review_chat(document: StoredDocument, user_question: str, session_id: str) -> llm_services.LLMStream:
+    """
+    Streams the AI's analysis of a financial document as it is generated.
+    Large documents are first reduced to per-section notes, as in get_document_review_chat.
 
-**User's Document:**
----
-{document_content}
----
-"""
-    
-    # Combine the system prompt, document, and user question into a single payload for the chat.
-    # The chat model will use the system prompt and document as context for the user's question.
-    prompt_payload = f"{system_prompt}\n\nUser's question about the document: \"{user_question}\"\n\nYour analysis and response:"
-    
-    try:
-        # Use the chat_with_ai function to maintain conversation context for follow-up questions.
-        analysis_text = llm_services.chat_with_ai(prompt_payload)
-        return analysis_text
-    except Exception as e:
-        print(f"Error in get_document_review_chat: {e}")
-        return f"An error occurred during document review: {e}"
\ No newline at end of file
+    Args:
+        document: The stored financial document.
+        user_question: The user's specific question or request about the document.
+        session_id: Identifies the user's conversation so its history is kept separate.
+
+    Returns:
+        An LLMStream yielding the analysis text chunk by chunk.
+    """
+    prompt_payload = await _document_review_prompt(document, user_question)
+    return await llm_services.stream_chat_with_ai(
+        prompt_payload,
+        session_id,
+        system_prompt=prompt_templates.registry.get("document_review"),
+        endpoint="document_reviewer_chat"
+    )
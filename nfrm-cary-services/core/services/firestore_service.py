@@ -1,11 +1,22 @@
+import base64
+import json
 import os
-from datetime import datetime, timezone
-from google.cloud import firestore
-from typing import Dict, Any, List
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, AsyncIterator, Awaitable, Callable, Tuple
 from collections import Counter
 
+from core.services import log_counters, log_rollups, metrics, resilience
+from core.services.log_spool import open_spool
+from core.services.log_writer import BackgroundLogWriter
+
 # Asynchronous Firestore client, initialized at startup
-db: firestore.AsyncClient = None
+db: Any = None
+# The google.cloud.firestore module. Importing it (and gRPC) is slow, so it is
+# only imported when the client is initialized, off the startup path.
+firestore: Any = None
 
 def initialize_firestore():
     """
@@ -13,7 +24,7 @@ def initialize_firestore():
     This function should be called once at application startup.
     It uses the project ID from environment variables and connects to the specified database.
     """
-    global db
+    global db, firestore
     project_id = os.getenv('GCP_PROJECT_ID', 'ai-agent-repo')
     # The user specified 'ai-agents-db' as the database name (ID).
     # The Firestore client needs this ID during initialization if it's not '(default)'.
@@ -21,6 +32,8 @@ def initialize_firestore():
     
     print(f"Initializing Firestore client for project: {project_id}, database: {database_id}")
     try:
+        from google.cloud import firestore as firestore_module
+        firestore = firestore_module
         # Application Default Credentials (ADC) will be used automatically.
         db = firestore.AsyncClient(project=project_id, database=database_id)
         print("Firestore client initialized successfully.")
@@ -29,74 +42,428 @@ def initialize_firestore():
         db = None
 
 
-async def log_api_call(
+async def _guarded(fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Runs a Firestore call under the Firestore deadline, retry and circuit breaker policy."""
+    return await resilience.call("firestore", "firestore", fn)
+
+
+# Bucket upper bounds for the bytes returned by a query.
+QUERY_BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# The fields of an API log shown in list views: everything but the potentially large `request_data`.
+API_LOG_LIST_FIELDS = ['api_name', 'prompt', 'user_details', 'response_metadata', 'timestamp']
+
+
+def _value_size(value: Any) -> int:
+    """Estimates the stored size of a field value, following Firestore's storage size rules."""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(key).encode('utf-8')) + 1 + _value_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_value_size(item) for item in value)
+    # References, geo points and vectors are rare in these collections.
+    return 16
+
+
+def _document_size(snapshot) -> int:
+    """Estimates the size of a document as read, including its name and the per-document overhead."""
+    name_size = sum(len(part.encode('utf-8')) + 1 for part in snapshot.reference.path.split('/')) + 16
+    return name_size + _value_size(snapshot.to_dict() or {}) + 32
+
+
+async def _fetch_documents(query, label: str = 'other', fields: Optional[List[str]] = None) -> List[Any]:
+    """
+    Streams all documents of a query, retrying the whole query on retryable errors.
+
+    Args:
+        query: The query to run.
+        label: Names the query in the `firestore_query_*` metrics.
+        fields: Only read these fields (dot notation for nested ones), if given.
+
+    Returns:
+        The document snapshots.
+    """
+    if fields:
+        query = query.select(fields)
+
+    async def fetch():
+        return [doc async for doc in query.stream()]
+    started_at = time.monotonic()
+    documents = await _guarded(fetch)
+    # Latency and (estimated) bytes per query, split by projection, show what leaner reads save.
+    labels = {"query": label, "projected": bool(fields)}
+    metrics.registry.observe("firestore_query_seconds", time.monotonic() - started_at, labels)
+    metrics.registry.observe("firestore_query_bytes", sum(_document_size(doc) for doc in documents), labels, buckets=QUERY_BYTES_BUCKETS)
+    metrics.registry.inc("firestore_query_documents_total", labels, len(documents))
+    return documents
+
+
+def query_stats() -> Dict[str, Any]:
+    """Returns the mean latency and bytes read per query, by query and whether it was projected."""
+    histograms = metrics.registry.snapshot()["histograms"]
+    bytes_read = {tuple(sorted(entry["labels"].items())): entry for entry in histograms.get("firestore_query_bytes", [])}
+    stats = {}
+    for entry in histograms.get("firestore_query_seconds", []):
+        key = f"{entry['labels']['query']}{' (projected)' if entry['labels']['projected'] == 'True' else ''}"
+        size = bytes_read.get(tuple(sorted(entry["labels"].items())), {})
+        stats[key] = {
+            "queries": entry["count"],
+            "mean_seconds": round(entry["sum"] / entry["count"], 4) if entry["count"] else None,
+            "p95_seconds": entry["p95"],
+            "mean_bytes": round(size["sum"] / size["count"]) if size.get("count") else None,
+        }
+    return stats
+
+
+async def warm_up_connection():
+    """
+    Opens the gRPC channel (and fetches credentials) with a one-document read, so
+    the first request after a cold start does not pay for the connection setup.
+    """
+    if not db:
+        return
+    try:
+        await _fetch_documents(db.collection('api_logs').limit(1), 'warm_up', ['timestamp'])
+    except Exception as e:
+        print(f"Firestore connection warm-up failed: {e}")
+
+
+def _api_log_document(
+    api_name: str,
+    prompt: str,
+    user_details: Dict[str, Any],
+    request_data: Dict[str, Any],
+    response_metadata: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    log_document = {
+        'api_name': api_name,
+        'prompt': prompt,
+        'user_details': user_details,
+        'request_data': request_data,
+        # Stamped when the call is logged, not when the batch is written.
+        'timestamp': datetime.now(timezone.utc)
+    }
+    if response_metadata is not None:
+        log_document['response_metadata'] = response_metadata
+    return log_document
+
+
+# Counter documents of the API logs, incremented in the same commit as the logs themselves.
+API_LOG_COUNTERS_COLLECTION = 'api_log_counters'
+# Each counter is spread over this many documents, so busy counters stay under
+# Firestore's sustained write rate for a single document.
+api_log_counter_shards = int(os.getenv('API_LOG_COUNTER_SHARDS', '8'))
+# Logs per transaction: each log adds at most one write per counter dimension,
+# which keeps a transaction under Firestore's 500 writes.
+_API_LOG_TRANSACTION_SIZE = 500 // (len(log_counters.DIMENSIONS) + 1)
+
+
+async def _write_api_log_chunk(records: List[Dict[str, Any]]):
+    """
+    Writes API log records and increments their counters in one transaction.
+    Logs that already exist (e.g. a replayed record whose first commit went
+    through) are skipped, so counters stay exact across retries and replays.
+    """
+    collection_ref = db.collection('api_logs')
+    counters_ref = db.collection(API_LOG_COUNTERS_COLLECTION)
+    refs = {record['id']: collection_ref.document(record['id']) for record in records}
+
+    @firestore.async_transactional
+    async def commit(transaction):
+        snapshots = await transaction.get_all(list(refs.values()))
+        existing = {snapshot.id async for snapshot in snapshots if snapshot.exists}
+        new_records = [record for record in records if record['id'] not in existing]
+        updates = log_counters.counter_updates([record['data'] for record in new_records], random.randrange(api_log_counter_shards))
+        for record in new_records:
+            # `written_at` (commit time, unlike the call's `timestamp`) lets the rollup job read logs incrementally,
+            # including logs replayed from the spool long after the call.
+            transaction.set(refs[record['id']], {**record['data'], 'written_at': firestore.SERVER_TIMESTAMP})
+        for document_id, update in updates.items():
+            transaction.set(counters_ref.document(document_id), {**update, "count": firestore.Increment(update["count"])}, merge=True)
+
+    await _guarded(lambda: commit(db.transaction()))
+
+
+async def write_api_logs(records: List[Dict[str, Any]]):
+    """
+    Writes API log records, each {"id": document id, "data": log document}, to the
+    'api_logs' collection, and increments the per-API and per-user call counters
+    in the same commits. Writing a record twice (e.g. when it is replayed from
+    the spool) neither duplicates it nor counts it twice.
+    Raises if Firestore is unavailable or a commit fails after the Firestore retries.
+    """
+    if not db:
+        raise RuntimeError("Firestore client is not initialized")
+    for start in range(0, len(records), _API_LOG_TRANSACTION_SIZE):
+        await _write_api_log_chunk(records[start:start + _API_LOG_TRANSACTION_SIZE])
+
+
+# API logs are written in the background, in batches, instead of on the request path.
+# Logs that cannot be written (Firestore down, slow or never initialized) are kept in
+# a local spool and replayed once Firestore recovers. Worker processes can share the
+# spool file: each replays only the records it claimed. Set API_LOG_SPOOL_PATH to ""
+# to disable the spool.
+api_log_writer = BackgroundLogWriter(
+    "api_logs",
+    write_api_logs,
+    max_queue=int(os.getenv('API_LOG_MAX_QUEUE', '10000')),
+    max_batch=int(os.getenv('API_LOG_MAX_BATCH', '500')),
+    flush_interval_seconds=float(os.getenv('API_LOG_FLUSH_INTERVAL_SECONDS', '1')),
+    shutdown_timeout_seconds=float(os.getenv('API_LOG_SHUTDOWN_TIMEOUT_SECONDS', '10')),
+    write_timeout_seconds=float(os.getenv('API_LOG_WRITE_TIMEOUT_SECONDS', '5')),
+    spool=open_spool(
+        "api_logs",
+        os.getenv('API_LOG_SPOOL_PATH', '/tmp/nfrm-cary/api_log_spool.sqlite'),
+        max_bytes=int(os.getenv('API_LOG_SPOOL_MAX_BYTES', str(256 * 1024 * 1024)))
+    ),
+    replay_interval_seconds=float(os.getenv('API_LOG_REPLAY_INTERVAL_SECONDS', '30'))
+)
+
+
+def log_api_call(
     api_name: str,
     prompt: str,
     user_details: Dict[str, Any],
-    request_data: Dict[str, Any]
+    request_data: Dict[str, Any],
+    response_metadata: Optional[Dict[str, Any]] = None
 ):
     """
     Logs the details of an API call to the 'api_logs' collection in Firestore.
+    `response_metadata` is stored alongside the request when the call is logged
+    after the response has been produced (e.g. for streamed responses).
+
+    The log is queued and written by `api_log_writer` in the background, so the
+    caller never waits for Firestore.
+    """
+    # The document id is fixed here so that retried and replayed writes are idempotent.
+    api_log_writer.enqueue({
+        'id': uuid.uuid4().hex,
+        'data': _api_log_document(api_name, prompt, user_details, request_data, response_metadata)
+    })
+
+
+def log_api_calls(entries: List[Dict[str, Any]]):
+    """
+    Logs several API calls to the 'api_logs' collection.
+    Each entry holds the keyword arguments of `log_api_call`.
+    """
+    for entry in entries:
+        log_api_call(**entry)
+
+
+async def save_document(collection_name: str, data: Dict[str, Any]) -> Optional[str]:
+    """
+    Stores a document under a new id in a Firestore collection.
+
+    Args:
+        collection_name: The name of the collection to write to.
+        data: The document's fields.
+
+    Returns:
+        The new document's id, or None if it could not be stored.
     """
     if not db:
-        print("Firestore client is not initialized. Skipping log.")
-        return
+        print("Firestore client is not initialized. Cannot save document.")
+        return None
 
     try:
-        collection_ref = db.collection('api_logs')
-        log_document = {
-            'api_name': api_name,
-            'prompt': prompt,
-            'user_details': user_details,
-            'request_data': request_data,
-            'timestamp': datetime.now(timezone.utc)
-        }
-        await collection_ref.add(log_document)
-        print(f"Successfully logged API call for '{api_name}' to Firestore.")
+        doc_ref = db.collection(collection_name).document()
+        await _guarded(lambda: doc_ref.set(data))
+        print(f"Successfully saved document '{doc_ref.id}' to '{collection_name}'.")
+        return doc_ref.id
     except Exception as e:
-        print(f"Error logging API call to Firestore: {e}")
+        print(f"Error saving document to collection '{collection_name}': {e}")
+        return None
 
 
-async def query_api_logs(api_name: str = None, limit: int = 20) -> List[Dict[str, Any]]:
+async def get_document(collection_name: str, document_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
     """
-    Queries the 'api_logs' collection in Firestore.
+    Reads a single document from a Firestore collection by id.
 
     Args:
-        api_name: The name of the API to filter logs by. If None, no filter is applied.
-        limit: The maximum number of logs to return.
+        collection_name: The name of the collection to read from.
+        document_id: The document's id.
+        fields: Only read these fields (dot notation for nested ones), if given.
 
     Returns:
-        A list of log documents.
+        The document's fields with its `id`, or None if it does not exist.
     """
     if not db:
-        print("Firestore client is not initialized. Cannot query logs.")
-        return []
+        print("Firestore client is not initialized. Cannot read document.")
+        return None
 
     try:
-        collection_ref = db.collection('api_logs')
-        # Base query ordered by timestamp descending
-        query = collection_ref.order_by('timestamp', direction=firestore.Query.DESCENDING)
+        snapshot = await _guarded(lambda: db.collection(collection_name).document(document_id).get(field_paths=fields))
+        if not snapshot.exists:
+            return None
+        doc_data = snapshot.to_dict()
+        for field_name, value in doc_data.items():
+            if isinstance(value, datetime):
+                doc_data[field_name] = value.isoformat()
+        doc_data['id'] = snapshot.id
+        return doc_data
+    except resilience.UpstreamError:
+        raise
+    except Exception as e:
+        print(f"Error reading document '{document_id}' from collection '{collection_name}': {e}")
+        return None
 
-        # Apply filter if api_name is provided
-        if api_name:
-            query = query.where(filter=firestore.FieldFilter('api_name', '==', api_name))
 
-        # Apply limit
-        query = query.limit(limit)
+def encode_cursor(timestamp: datetime, document_id: str) -> str:
+    """Builds an opaque page token from the sort key of the last document on a page."""
+    payload = json.dumps({"t": timestamp.isoformat(), "id": document_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
 
-        documents = []
-        async for doc in query.stream():
-            doc_data = doc.to_dict()
-            # Firestore timestamp needs to be converted to a string for JSON serialization
-            if 'timestamp' in doc_data and isinstance(doc_data['timestamp'], datetime):
-                doc_data['timestamp'] = doc_data['timestamp'].isoformat()
-            documents.append(doc_data)
 
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Reads a page token built by `encode_cursor`. Raises ValueError if it is malformed."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(payload["t"]), str(payload["id"])
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def _api_logs_query(api_name: Optional[str], cursor: Optional[str]):
+    """Builds the newest-first query over the API logs, resuming after `cursor` if given."""
+    # The document id breaks ties between logs with the same timestamp, so pages never skip or repeat a log.
+    query = (
+        db.collection('api_logs')
+        .order_by('timestamp', direction=firestore.Query.DESCENDING)
+        .order_by(firestore.FieldPath.document_id(), direction=firestore.Query.DESCENDING)
+    )
+    if api_name:
+        query = query.where(filter=firestore.FieldFilter('api_name', '==', api_name))
+    if cursor:
+        timestamp, document_id = decode_cursor(cursor)
+        query = query.start_after({'timestamp': timestamp, '__name__': db.collection('api_logs').document(document_id)})
+    return query
+
+
+def _serializable_log(doc) -> Dict[str, Any]:
+    doc_data = doc.to_dict()
+    # Firestore timestamp needs to be converted to a string for JSON serialization
+    for field_name in ('timestamp', 'written_at'):
+        if isinstance(doc_data.get(field_name), datetime):
+            doc_data[field_name] = doc_data[field_name].isoformat()
+    return doc_data
+
+
+async def query_api_logs_page(
+    api_name: str = None,
+    limit: int = 20,
+    fields: Optional[List[str]] = None,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Reads one page of the 'api_logs' collection, newest first.
+
+    Args:
+        api_name: The name of the API to filter logs by. If None, no filter is applied.
+        limit: The maximum number of logs on the page.
+        fields: Only return these fields (dot notation for nested ones); all fields if None.
+        cursor: The `next_cursor` of the previous page, or None for the first page.
+
+    Returns:
+        The page's `logs` and the `next_cursor` to read the following page with,
+        None if this was the last page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if not db:
+        print("Firestore client is not initialized. Cannot query logs.")
+        return {"logs": [], "next_cursor": None}
+
+    query = _api_logs_query(api_name, cursor)
+    if fields and 'timestamp' not in fields:
+        # The cursor is built from the timestamp.
+        fields = fields + ['timestamp']
+    try:
+        documents = await _fetch_documents(query.limit(limit), 'api_logs', fields)
+        next_cursor = None
+        if len(documents) == limit:
+            last = documents[-1]
+            next_cursor = encode_cursor(last.get('timestamp'), last.id)
         print(f"Successfully queried {len(documents)} logs from Firestore.")
-        return documents
+        return {"logs": [_serializable_log(doc) for doc in documents], "next_cursor": next_cursor}
+    except resilience.UpstreamError:
+        raise
     except Exception as e:
         print(f"Error querying API logs from Firestore: {e}")
-        return []
+        return {"logs": [], "next_cursor": None}
+
+
+async def query_api_logs(api_name: str = None, limit: int = 20, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Queries the 'api_logs' collection in Firestore.
+
+    Args:
+        api_name: The name of the API to filter logs by. If None, no filter is applied.
+        limit: The maximum number of logs to return.
+        fields: Only return these fields (dot notation for nested ones); all fields if None.
+
+    Returns:
+        A list of log documents.
+    """
+    return (await query_api_logs_page(api_name=api_name, limit=limit, fields=fields))["logs"]
+
+
+async def stream_api_logs(
+    api_name: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    fields: Optional[List[str]] = None,
+    cursor: Optional[str] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yields API logs newest first, as Firestore streams them, without holding the
+    whole result in memory. Unlike the other helpers it is not retried: a stream
+    that fails midway stops, and can be resumed with the cursor of the last log
+    yielded (each log carries it as `cursor`).
+
+    Args:
+        api_name: The name of the API to filter logs by. If None, no filter is applied.
+        start: Only logs at or after this time, if given.
+        end: Only logs before this time, if given.
+        fields: Only return these fields (dot notation for nested ones); all fields if None.
+        cursor: Resume after the log this cursor was taken from.
+
+    Yields:
+        Log documents with their `id` and `cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if not db:
+        print("Firestore client is not initialized. Cannot export logs.")
+        return
+
+    query = _api_logs_query(api_name, cursor)
+    if start is not None:
+        query = query.where(filter=firestore.FieldFilter('timestamp', '>=', start))
+    if end is not None:
+        query = query.where(filter=firestore.FieldFilter('timestamp', '<', end))
+    if fields:
+        query = query.select(fields if 'timestamp' in fields else fields + ['timestamp'])
+
+    exported = 0
+    started_at = time.monotonic()
+    async for doc in query.stream():
+        log = _serializable_log(doc)
+        log['id'] = doc.id
+        log['cursor'] = encode_cursor(doc.get('timestamp'), doc.id)
+        exported += 1
+        yield log
+    metrics.registry.inc("firestore_export_documents_total", {"query": "api_logs"}, exported)
+    print(f"Exported {exported} API logs in {time.monotonic() - started_at:.1f}s.")
 
 
 async def count_collection_with_filters(
@@ -126,7 +493,7 @@ async def count_collection_with_filters(
 
         # Use the count aggregation query for efficiency
         aggregate_query = query.count()
-        result = await aggregate_query.get()
+        result = await _guarded(aggregate_query.get)
         # The result of a count aggregation is a list of AggregateQueryResponse objects
         if result and result[0]:
             count = result[0][0].value
@@ -135,6 +502,8 @@ async def count_collection_with_filters(
 
         print(f"Successfully counted {count} documents in '{collection_name}'.")
         return count
+    except resilience.UpstreamError:
+        raise
     except Exception as e:
         print(f"Error counting documents in collection '{collection_name}': {e}")
         return 0
@@ -175,7 +544,8 @@ async def get_distinct_values(
         query = query.limit(limit)
 
         distinct_values = set()
-        async for doc in query.stream():
+        # Only the one field is read, not whole documents with their request data.
+        for doc in await _fetch_documents(query, 'distinct_values', [field_name]):
             doc_dict = doc.to_dict()
             # Handle nested fields using dot notation
             keys = field_name.split('.')
@@ -190,6 +560,8 @@ async def get_distinct_values(
 
         print(f"Found {len(distinct_values)} distinct values for field '{field_name}' in '{collection_name}'.")
         return list(distinct_values)
+    except resilience.UpstreamError:
+        raise
     except Exception as e:
         print(f"Error getting distinct values from collection '{collection_name}': {e}")
         return []
@@ -230,7 +602,7 @@ async def group_and_count_by_field(
         query = query.limit(limit)
 
         counts = Counter()
-        async for doc in query.stream():
+        for doc in await _fetch_documents(query, 'group_and_count', [group_by_field]):
             doc_dict = doc.to_dict()
             
             # Helper to get nested values from a dictionary using dot notation
@@ -246,16 +618,314 @@ async def group_and_count_by_field(
 
         print(f"Successfully grouped and counted by '{group_by_field}' in '{collection_name}'.")
         return dict(counts)
+    except resilience.UpstreamError:
+        raise
     except Exception as e:
         print(f"Error during group and count in collection '{collection_name}': {e}")
         return {}
 
+async def get_api_call_counts(group_by_field: str, start: datetime, end: datetime) -> Optional[Dict[str, Any]]:
+    """
+    Counts API calls per API or per user over a time range from the pre-aggregated
+    counters, reading a few counter documents instead of the logs themselves.
+    Counts are exact, with no scan limit, for calls logged since the counters
+    were introduced.
+
+    Args:
+        group_by_field: 'api_name' or 'user_details.user_email'.
+        start: The start of the range (inclusive).
+        end: The end of the range (exclusive).
+
+    Returns:
+        The counts per value, together with the range actually counted (widened
+        to whole hours or days), or None if the field is not counted.
+    """
+    choice = log_counters.pick_dimension(group_by_field, start, end)
+    if choice is None:
+        return None
+    dimension, counted_start, counted_end = choice
+    if not db:
+        print("Firestore client is not initialized. Cannot read counters.")
+        return {"counts": {}, "start": counted_start.isoformat(), "end": counted_end.isoformat()}
+
+    try:
+        query = (
+            db.collection(API_LOG_COUNTERS_COLLECTION)
+            .where(filter=firestore.FieldFilter('dimension', '==', dimension))
+            .where(filter=firestore.FieldFilter('bucket_start', '>=', counted_start))
+            .where(filter=firestore.FieldFilter('bucket_start', '<', counted_end))
+        )
+        counts = Counter()
+        documents = await _fetch_documents(query, 'api_call_counters', ['value', 'count'])
+        for doc in documents:
+            doc_dict = doc.to_dict()
+            counts[doc_dict['value']] += doc_dict.get('count', 0)
+        print(f"Read {len(documents)} '{dimension}' counter documents.")
+        return {"counts": dict(counts), "start": counted_start.isoformat(), "end": counted_end.isoformat()}
+    except resilience.UpstreamError:
+        raise
+    except Exception as e:
+        print(f"Error reading API call counters: {e}")
+        return {"counts": {}, "start": counted_start.isoformat(), "end": counted_end.isoformat()}
+
+API_LOG_ROLLUPS_COLLECTION = 'api_log_rollups'
+# Rollup documents updated per transaction, leaving room for the high-water mark under Firestore's 500 writes.
+_MAX_ROLLUPS_PER_COMMIT = 400
+
+
+class RollupConflictError(Exception):
+    """Another rollup run moved the high-water mark first."""
+
+
+def _rollup_state_ref():
+    return db.collection('api_log_rollups_state').document('high_water_mark')
+
+
+def _same_state(current_state: Dict[str, Any], expected_state: Dict[str, Any]) -> bool:
+    return current_state.get('written_at') == expected_state.get('written_at') and current_state.get('ids', []) == expected_state.get('ids', [])
+
+
+def _before_high_water_mark(document_id: str, log: Dict[str, Any], state: Dict[str, Any]) -> bool:
+    """Whether a log was already folded in by the rollup job, or never will be (no `written_at`)."""
+    written_at, high_water_mark = log.get('written_at'), state.get('written_at')
+    if written_at is None:
+        return True
+    if high_water_mark is None:
+        return False
+    return written_at < high_water_mark or (written_at == high_water_mark and document_id in state.get('ids', []))
+
+
+async def _commit_rollups(rollups: Dict[str, log_rollups.Rollup], expected_state: Dict[str, Any], new_state: Dict[str, Any]):
+    """Adds rollups to the stored ones and moves the high-water mark, atomically."""
+    state_ref = _rollup_state_ref()
+    refs = {document_id: db.collection(API_LOG_ROLLUPS_COLLECTION).document(document_id) for document_id in rollups}
+
+    @firestore.async_transactional
+    async def commit(transaction):
+        state_snapshot = await state_ref.get(transaction=transaction)
+        if not _same_state(state_snapshot.to_dict() or {}, expected_state):
+            raise RollupConflictError()
+        snapshots = await transaction.get_all(list(refs.values()))
+        stored = {snapshot.id: snapshot.to_dict() async for snapshot in snapshots if snapshot.exists}
+        for document_id, rollup in rollups.items():
+            if document_id in stored:
+                rollup = log_rollups.Rollup.from_document(stored[document_id]).merged(rollup)
+            transaction.set(refs[document_id], rollup.to_document())
+        transaction.set(state_ref, new_state)
+
+    await _guarded(lambda: commit(db.transaction()))
+
+
+async def materialize_api_log_rollups(max_logs: int = 5000, page_size: int = 500, settle_seconds: float = 60.0) -> Dict[str, Any]:
+    """
+    Folds the API logs written since the last run into the hourly and daily rollups.
+
+    Logs are read in `written_at` order from the stored high-water mark, and each
+    page is added to the rollups in the same transaction that moves the mark, so
+    a log is never counted twice, even if runs overlap or fail halfway.
+
+    Args:
+        max_logs: The most logs processed by this run; the next run continues from there.
+        page_size: The logs read and committed at a time.
+        settle_seconds: Logs written more recently than this are left for the next run,
+            so writes still committing with an earlier timestamp are not skipped.
+
+    Returns:
+        How many logs were processed and the new high-water mark.
+    """
+    if not db:
+        raise RuntimeError("Firestore client is not initialized")
+
+    state = (await _guarded(_rollup_state_ref().get)).to_dict() or {}
+    settled_before = datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)
+    processed = 0
+    while processed < max_logs:
+        query = (
+            db.collection('api_logs')
+            .where(filter=firestore.FieldFilter('written_at', '<', settled_before))
+            .order_by('written_at')
+        )
+        if state.get('written_at') is not None:
+            query = query.where(filter=firestore.FieldFilter('written_at', '>=', state['written_at']))
+        # Logs at exactly the mark were already counted; read past them.
+        seen_ids = set(state.get('ids', []))
+        documents = [
+            doc for doc in await _fetch_documents(query.limit(page_size + len(seen_ids)), 'rollup_logs', log_rollups.LOG_FIELDS + ['written_at'])
+            if doc.id not in seen_ids
+        ]
+        if not documents:
+            break
+
+        rollups: Dict[str, log_rollups.Rollup] = {}
+        included = []
+        for doc in documents:
+            doc_dict = doc.to_dict()
+            # Stop the page early if its rollups would not fit in one transaction.
+            if included and len(rollups.keys() | set(log_rollups.rollup_ids_of(doc_dict))) > _MAX_ROLLUPS_PER_COMMIT:
+                break
+            log_rollups.add_to_rollups(rollups, doc_dict)
+            included.append((doc.id, doc_dict['written_at']))
+
+        last_written_at = included[-1][1]
+        ids = [doc_id for doc_id, written_at in included if written_at == last_written_at]
+        if last_written_at == state.get('written_at'):
+            ids = state.get('ids', []) + ids
+        new_state = {'written_at': last_written_at, 'ids': ids}
+        try:
+            await _commit_rollups(rollups, state, new_state)
+        except RollupConflictError:
+            print("Another rollup run is in progress; stopping this one.")
+            break
+        state = new_state
+        processed += len(included)
+
+    high_water_mark = state.get('written_at')
+    print(f"Rolled up {processed} API logs.")
+    return {"processed": processed, "high_water_mark": high_water_mark.isoformat() if high_water_mark else None}
+
+
+async def rebuild_api_log_rollups(start: datetime, end: datetime, page_size: int = 1000) -> Dict[str, Any]:
+    """
+    Recomputes the rollups of whole days from the logs themselves, e.g. to backfill
+    logs written before rollups existed or to repair them. The high-water mark is
+    left alone: only logs at or before it (or without a `written_at`) are counted,
+    and logs written after it are left for the rollup job to add. Each write
+    batch checks the mark in its transaction, so a rollup run that moves it
+    midway stops the rebuild instead of being overwritten.
+
+    Args:
+        start: The first day to rebuild (rounded down to a UTC day).
+        end: The end of the range (rounded up to a UTC day).
+        page_size: The logs read at a time.
+
+    Returns:
+        How many logs were read and rollup documents written, and the days rebuilt.
+
+    Raises:
+        RollupConflictError: A rollup run moved the high-water mark during the
+            rebuild; the days not written yet are unchanged and the rebuild can be rerun.
+    """
+    if not db:
+        raise RuntimeError("Firestore client is not initialized")
+
+    range_start, range_end = log_counters.aligned_range(start, end, "day")
+    state = (await _guarded(_rollup_state_ref().get)).to_dict() or {}
+
+    rollups: Dict[str, log_rollups.Rollup] = {}
+    read = 0
+    skipped = 0
+    query = (
+        db.collection('api_logs')
+        .where(filter=firestore.FieldFilter('timestamp', '>=', range_start))
+        .where(filter=firestore.FieldFilter('timestamp', '<', range_end))
+        .order_by('timestamp')
+    )
+    last_document = None
+    while True:
+        page_query = query.start_after(last_document) if last_document is not None else query
+        documents = await _fetch_documents(page_query.limit(page_size), 'rollup_rebuild_logs', log_rollups.LOG_FIELDS + ['written_at'])
+        for doc in documents:
+            doc_dict = doc.to_dict()
+            if _before_high_water_mark(doc.id, doc_dict, state):
+                log_rollups.add_to_rollups(rollups, doc_dict)
+            else:
+                skipped += 1
+        read += len(documents)
+        if len(documents) < page_size:
+            break
+        last_document = documents[-1]
+
+    # Rollups in the range that no longer have any logs are removed.
+    stale_query = (
+        db.collection(API_LOG_ROLLUPS_COLLECTION)
+        .where(filter=firestore.FieldFilter('bucket_start', '>=', range_start))
+        .where(filter=firestore.FieldFilter('bucket_start', '<', range_end))
+    )
+    stale_ids = [doc.id for doc in await _fetch_documents(stale_query, 'rollup_rebuild_existing', ['granularity']) if doc.id not in rollups]
+
+    writes = [(document_id, rollup.to_document()) for document_id, rollup in rollups.items()] + [(document_id, None) for document_id in stale_ids]
+    collection_ref = db.collection(API_LOG_ROLLUPS_COLLECTION)
+    state_ref = _rollup_state_ref()
+
+    @firestore.async_transactional
+    async def commit(transaction, chunk):
+        state_snapshot = await state_ref.get(transaction=transaction)
+        if not _same_state(state_snapshot.to_dict() or {}, state):
+            raise RollupConflictError()
+        for document_id, data in chunk:
+            if data is None:
+                transaction.delete(collection_ref.document(document_id))
+            else:
+                transaction.set(collection_ref.document(document_id), data)
+
+    for chunk_start in range(0, len(writes), _MAX_ROLLUPS_PER_COMMIT):
+        chunk = writes[chunk_start:chunk_start + _MAX_ROLLUPS_PER_COMMIT]
+        await _guarded(lambda: commit(db.transaction(), chunk))
+
+    print(f"Rebuilt {len(rollups)} rollups from {read} API logs between {range_start} and {range_end} ({skipped} past the high-water mark left for the rollup job).")
+    return {
+        "logs_read": read,
+        "logs_after_high_water_mark": skipped,
+        "rollups_written": len(rollups),
+        "rollups_deleted": len(stale_ids),
+        "start": range_start.isoformat(),
+        "end": range_end.isoformat(),
+    }
+
+
+async def get_api_log_rollups(granularity: str, start: datetime, end: datetime, api_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Summarizes API usage over a range from the hourly or daily rollups.
+
+    Args:
+        granularity: 'hour' or 'day'; the range is widened to whole hours or days.
+        start: The start of the range (inclusive).
+        end: The end of the range (exclusive).
+        api_name: Only summarize this API, if given.
+
+    Returns:
+        Per API, the number of calls and errors, distinct users and prompt-length and
+        latency summaries; the range covered; and the rollups' high-water mark, the
+        write time of the newest log they include.
+    """
+    if granularity not in log_rollups.GRANULARITIES:
+        raise ValueError(f"granularity must be one of {log_rollups.GRANULARITIES}")
+    range_start, range_end = log_counters.aligned_range(start, end, granularity)
+    if not db:
+        print("Firestore client is not initialized. Cannot read rollups.")
+        return {"apis": {}, "start": range_start.isoformat(), "end": range_end.isoformat(), "high_water_mark": None}
+
+    try:
+        query = (
+            db.collection(API_LOG_ROLLUPS_COLLECTION)
+            .where(filter=firestore.FieldFilter('granularity', '==', granularity))
+            .where(filter=firestore.FieldFilter('bucket_start', '>=', range_start))
+            .where(filter=firestore.FieldFilter('bucket_start', '<', range_end))
+        )
+        rollups = [log_rollups.Rollup.from_document(doc.to_dict()) for doc in await _fetch_documents(query, 'rollups')]
+        if api_name:
+            rollups = [rollup for rollup in rollups if rollup.api_name == api_name]
+        state = (await _guarded(_rollup_state_ref().get)).to_dict() or {}
+        high_water_mark = state.get('written_at')
+        return {
+            "apis": {name: rollup.summary() for name, rollup in log_rollups.combine_by_api(rollups).items()},
+            "start": range_start.isoformat(),
+            "end": range_end.isoformat(),
+            "high_water_mark": high_water_mark.isoformat() if high_water_mark else None,
+        }
+    except resilience.UpstreamError:
+        raise
+    except Exception as e:
+        print(f"Error reading API log rollups: {e}")
+        return {"apis": {}, "start": range_start.isoformat(), "end": range_end.isoformat(), "high_water_mark": None}
+
 async def query_collection_with_filters(
     collection_name: str,
     filters: List[Dict[str, Any]],
     limit: int = 20,
     order_by_field: str = 'timestamp',
-    order_by_direction: str = 'DESCENDING'
+    order_by_direction: str = 'DESCENDING',
+    fields: Optional[List[str]] = None
 ) -> List[Dict[str, Any]]:
     """
     Queries a Firestore collection with a list of filters.
@@ -267,6 +937,7 @@ async def query_collection_with_filters(
         limit: The maximum number of documents to return.
         order_by_field: The field to order the results by.
         order_by_direction: The direction to order by ('ASCENDING' or 'DESCENDING').
+        fields: Only return these fields (dot notation for nested ones); all fields if None.
 
     Returns:
         A list of document dictionaries.
@@ -289,7 +960,7 @@ async def query_collection_with_filters(
         query = query.limit(limit)
 
         documents = []
-        async for doc in query.stream():
+        for doc in await _fetch_documents(query, f'query_{collection_name}', fields):
             doc_data = doc.to_dict()
             # Ensure timestamp is JSON serializable
             if 'timestamp' in doc_data and isinstance(doc_data.get('timestamp'), datetime):
@@ -297,6 +968,8 @@ async def query_collection_with_filters(
             documents.append(doc_data)
         print(f"Successfully queried {len(documents)} documents from '{collection_name}'.")
         return documents
+    except resilience.UpstreamError:
+        raise
     except Exception as e:
         print(f"Error querying collection '{collection_name}' from Firestore: {e}")
         return []
\ No newline at end of file
@@ -0,0 +1,110 @@
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+from core.services.tokens import estimate_tokens
+
+# Folds messages into a running summary: (previous summary or None, messages to fold) -> new summary, or None on failure.
+Summarizer = Callable[[Optional[str], List[Dict[str, Any]]], Awaitable[Optional[str]]]
+
+
+@dataclass
+class CompactedHistory:
+    """A conversation history reduced to a rolling summary plus the most recent messages."""
+    summary: Optional[str]
+    messages: List[Dict[str, Any]]
+
+
+@dataclass
+class _SummaryEntry:
+    folded_count: int
+    prefix_hash: str
+    summary: str
+
+
+def _messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(str(message.get("content", ""))) for message in messages)
+
+
+def _prefix_hash(messages: List[Dict[str, Any]]) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class HistoryCompactor:
+    """
+    Keeps the prompt of a long conversation roughly constant in size.
+
+    The last `keep_turns` turns are kept verbatim. Older messages are folded into a
+    rolling summary, cached per conversation, so that each turn only summarizes the
+    messages added since the previous fold rather than the whole history. Folding
+    happens in batches: older messages are carried verbatim until there are at least
+    `keep_turns` turns of them or the verbatim part exceeds `max_tokens`.
+    """
+
+    def __init__(self, summarize: Summarizer, keep_turns: int = 3, max_tokens: int = 1500, max_conversations: int = 1000):
+        self._summarize = summarize
+        self.keep_messages = 2 * keep_turns
+        self.max_tokens = max_tokens
+        self.max_conversations = max_conversations
+        self._summaries: "OrderedDict[str, _SummaryEntry]" = OrderedDict()
+        self._summary_hits = 0
+        self._folds = 0
+        self._folded_messages = 0
+        self._failed_folds = 0
+
+    async def compact(self, conversation_key: str, history: List[Dict[str, Any]]) -> CompactedHistory:
+        """
+        Compacts a conversation history.
+
+        Args:
+            conversation_key: Identifies the conversation whose summary is cached.
+            history: The full list of messages, each a dict with "role" and "content".
+
+        Returns:
+            The rolling summary (if any) and the messages to include verbatim.
+        """
+        if len(history) <= self.keep_messages and _messages_tokens(history) <= self.max_tokens:
+            return CompactedHistory(summary=None, messages=list(history))
+
+        older = history[:-self.keep_messages] if self.keep_messages else list(history)
+        recent = history[len(older):]
+
+        summary, folded_count = None, 0
+        entry = self._summaries.get(conversation_key)
+        # The cached summary is only reused if the messages it covers are unchanged.
+        if entry is not None and entry.folded_count <= len(older) and entry.prefix_hash == _prefix_hash(older[:entry.folded_count]):
+            summary, folded_count = entry.summary, entry.folded_count
+            self._summaries.move_to_end(conversation_key)
+            self._summary_hits += 1
+
+        pending = older[folded_count:]
+        if pending and (len(pending) >= self.keep_messages or _messages_tokens(pending + recent) > self.max_tokens):
+            new_summary = await self._summarize(summary, pending)
+            if new_summary:
+                summary, folded_count = new_summary, len(older)
+                self._store(conversation_key, _SummaryEntry(folded_count, _prefix_hash(older), summary))
+                self._folds += 1
+                self._folded_messages += len(pending)
+                pending = []
+            else:
+                self._failed_folds += 1
+
+        return CompactedHistory(summary=summary, messages=pending + recent)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns how often summaries were reused and how many messages were folded."""
+        return {
+            "conversations": len(self._summaries),
+            "summary_hits": self._summary_hits,
+            "folds": self._folds,
+            "folded_messages": self._folded_messages,
+            "failed_folds": self._failed_folds,
+        }
+
+    def _store(self, conversation_key: str, entry: _SummaryEntry):
+        self._summaries[conversation_key] = entry
+        self._summaries.move_to_end(conversation_key)
+        while len(self._summaries) > self.max_conversations:
+            self._summaries.popitem(last=False)
@@ -0,0 +1,112 @@
+import os
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.services.prompt_templates import CompiledPrompt
+
+
+class LLMBackend(ABC):
+    """
+    The model provider behind llm_services and the admin agent.
+
+    Models returned by a backend follow the Vertex AI SDK's GenerativeModel API:
+    `generate_content_async(prompt, stream=False)` returns a response with `.text`
+    and `.usage_metadata` (or an async iterator of such chunks when streaming),
+    and `start_chat(history)` returns a chat with `send_message_async(prompt, stream=False)`.
+    A backend missing any of the abstract methods fails when it is instantiated.
+    """
+    name = "base"
+    supports_context_cache = False
+
+    def initialize(self):
+        """Connects to the provider. Called once at startup."""
+
+    @abstractmethod
+    def get_model(self, model_name: str, system_instruction: Optional[str] = None) -> Any:
+        """Returns a model that sends `system_instruction` with every request."""
+
+    @abstractmethod
+    def create_context_cached_model(self, model_name: str, system_prompt: CompiledPrompt, ttl_seconds: float) -> Any:
+        """Places a system prompt in a provider-side context cache and returns a model reading from it."""
+
+    @abstractmethod
+    def start_chat(self, chat_model: Any, history: List[Tuple[str, str]]) -> Any:
+        """Starts a chat seeded with (role, text) history turns."""
+
+    def generation_config(self, config: Dict[str, Any]) -> Any:
+        """Converts generation parameters (e.g. a response schema) into the provider's config type."""
+        return config
+
+    @abstractmethod
+    def create_agent_chat_model(self, model_name: str, system_instruction: str) -> Any:
+        """Returns a LangChain chat model supporting tool calls, for the admin agent."""
+
+
+class VertexBackend(LLMBackend):
+    """Gemini models on Vertex AI."""
+    name = "vertex"
+    supports_context_cache = True
+
+    def initialize(self):
+        import vertexai
+
+        # Project ID and location can be fetched from environment variables
+        # for better flexibility in different environments.
+        # Ensure these environment variables (GCP_PROJECT_ID, GCP_LOCATION) are set in your Cloud Run service.
+        # The defaults 'ai-agent-repo' and 'us-east1' are used if the environment variables are not set.
+        project_id = os.getenv('GCP_PROJECT_ID', 'ai-agent-repo')
+        location = os.getenv('GCP_LOCATION', 'us-east1')
+
+        # DO NOT set os.environ['GOOGLE_APPLICATION_CREDENTIALS'] here for Cloud Run.
+        # vertexai.init() will use Application Default Credentials (ADC).
+        # On Cloud Run, ADC uses the service's runtime service account.
+        # For local development, run 'gcloud auth application-default login'.
+        print(f"Initializing Vertex AI with Project ID: {project_id}, Location: {location}")
+        vertexai.init(project=project_id, location=location)
+
+    def get_model(self, model_name: str, system_instruction: Optional[str] = None) -> Any:
+        from vertexai.generative_models import GenerativeModel
+        return GenerativeModel(model_name, system_instruction=system_instruction)
+
+    def create_context_cached_model(self, model_name: str, system_prompt: CompiledPrompt, ttl_seconds: float) -> Any:
+        from vertexai.preview import caching
+        from vertexai.preview.generative_models import GenerativeModel as PreviewGenerativeModel
+
+        cached_content = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=system_prompt.text,
+            ttl=timedelta(seconds=ttl_seconds),
+            display_name=f"{system_prompt.name}-{system_prompt.fingerprint}"
+        )
+        print(f"Created context cache '{cached_content.name}' for prompt '{system_prompt.name}' ({system_prompt.token_count} tokens) on '{model_name}'.")
+        return PreviewGenerativeModel.from_cached_content(cached_content=cached_content)
+
+    def start_chat(self, chat_model: Any, history: List[Tuple[str, str]]) -> Any:
+        from vertexai.generative_models import Content, Part
+        return chat_model.start_chat(history=[
+            Content(role=role, parts=[Part.from_text(text)]) for role, text in history
+        ])
+
+    def generation_config(self, config: Dict[str, Any]) -> Any:
+        from vertexai.generative_models import GenerationConfig
+        # GenerationConfig converts an OpenAPI-style `response_schema` dict into the API's Schema type.
+        return GenerationConfig(**config)
+
+    def create_agent_chat_model(self, model_name: str, system_instruction: str) -> Any:
+        from langchain_google_vertexai import ChatVertexAI
+        return ChatVertexAI(model_name=model_name, system_instruction=system_instruction)
+
+
+def create_backend_from_env() -> LLMBackend:
+    """
+    Returns the backend selected by LLM_BACKEND: "vertex" (the default) or "fake",
+    an in-process model for load testing without GCP credentials or network access.
+    """
+    backend_name = os.getenv('LLM_BACKEND', 'vertex').lower()
+    if backend_name == "fake":
+        from core.services.fake_llm_backend import create_fake_backend_from_env
+        return create_fake_backend_from_env()
+    if backend_name != "vertex":
+        print(f"Unknown LLM_BACKEND '{backend_name}', using Vertex AI.")
+    return VertexBackend()
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalizes a prompt so trivially different spellings of the same question
+    (case, surrounding or repeated whitespace) share a cache entry.
+    """
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+
+def make_cache_key(
+    prompt: str,
+    model_name: str,
+    language: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+    system_prompt: Optional[str] = None
+) -> str:
+    """
+    Builds the cache key of a completion from the normalized prompt, the model name,
+    the response language, the generation config and the system prompt's fingerprint.
+    """
+    key_material = json.dumps({
+        "prompt": normalize_prompt(prompt),
+        "model": model_name,
+        "language": (language or "").lower(),
+        "generation_config": generation_config or {},
+        "system_prompt": system_prompt,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of LLM completions with a TTL and a size cap in bytes.
+
+    If `sqlite_path` is given, entries are also written to an on-disk sqlite tier
+    so they survive restarts. Memory misses fall back to that tier and promote
+    the entry back into memory.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2000,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl_seconds: float = 24 * 3600,
+        sqlite_path: Optional[str] = None
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._total_bytes = 0
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._open_disk_tier(sqlite_path)
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached completion for a key, or None if absent or expired."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, created_at = entry
+            if time.time() - created_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return value
+            self._remove(key)
+
+        disk_entry = self._disk_get(key)
+        if disk_entry is not None:
+            value, created_at = disk_entry
+            self._disk_hits += 1
+            self._put_memory(key, value, created_at)
+            return value
+
+        self._misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        """Stores a completion under a key in memory and, if enabled, on disk."""
+        created_at = time.time()
+        self._put_memory(key, value, created_at)
+        if self._db is not None:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, value, created_at)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing to the on-disk response cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the size of the cache and its hit/miss/eviction counters."""
+        return {
+            "entries": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "hits": self._hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "disk_tier": self._db is not None,
+        }
+
+    def _put_memory(self, key: str, value: str, created_at: float):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (value, created_at)
+        self._total_bytes += size
+        while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= len(entry[0].encode("utf-8"))
+
+    def _open_disk_tier(self, sqlite_path: str):
+        try:
+            directory = os.path.dirname(sqlite_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Drop entries that expired while the service was down.
+            self._db.execute("DELETE FROM response_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self._db.commit()
+            print(f"On-disk response cache opened at '{sqlite_path}'.")
+        except sqlite3.Error as e:
+            print(f"Failed to open the on-disk response cache at '{sqlite_path}': {e}")
+            self._db = None
+
+    def _disk_get(self, key: str) -> Optional[Tuple[str, float]]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT value, created_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading from the on-disk response cache: {e}")
+            return None
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        return row[0], row[1]
@@ -1,78 +1,744 @@
 import os
-import vertexai
-# google.generativeai is not used in this file.
-from vertexai.generative_models import GenerativeModel, ChatSession # Part is not used.
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
-model: GenerativeModel = None # Added type hint for clarity
-chat: ChatSession = None # Global chat session variable
+from core.services import metrics, resilience
+from core.services.admission import AdmissionController, Permit
+from core.services.chat_session_store import ChatSessionStore
+from core.services.llm_backend import LLMBackend, create_backend_from_env
+from core.services.llm_cache import ResponseCache, make_cache_key
+from core.services.model_router import ModelRouter, create_router_from_env
+from core.services.prompt_templates import CompiledPrompt, registry as prompt_registry
+from core.services.single_flight import SingleFlight
+from core.services.tokens import estimate_tokens
+
+# The model provider, selected with LLM_BACKEND ("vertex" or "fake").
+backend: LLMBackend = create_backend_from_env()
+model: Any = None
+model_name: str = None # The standard tier model; the router may pick another model per request
+model_router: ModelRouter = None
+
+# Models keyed by (model name, system prompt fingerprint), together with the time
+# their provider-side context cache expires (None if not cached).
+_models: Dict[Tuple[str, str], Tuple[Any, Optional[float]]] = {}
+
+# System prompts of at least this many tokens are placed in a Vertex AI context cache
+# so the static prefix is not re-billed and re-processed on every call. Smaller prompts
+# are sent as a plain system instruction, which keeps the prefix stable for the
+# provider's implicit caching.
+context_cache_min_tokens = int(os.getenv('PROMPT_CONTEXT_CACHE_MIN_TOKENS', '4096'))
+context_cache_ttl_seconds = int(os.getenv('PROMPT_CONTEXT_CACHE_TTL_SECONDS', '3600'))
+
+# Per-conversation chat histories, replacing the single process-wide ChatSession.
+session_store = ChatSessionStore(
+    max_turns=int(os.getenv('CHAT_SESSION_MAX_TURNS', '10')),
+    max_tokens=int(os.getenv('CHAT_SESSION_MAX_TOKENS', '8000')),
+    ttl_seconds=float(os.getenv('CHAT_SESSION_TTL_SECONDS', '1800')),
+    max_sessions=int(os.getenv('CHAT_SESSION_MAX_SESSIONS', '1000')),
+    max_bytes=int(os.getenv('CHAT_SESSION_MAX_BYTES', str(64 * 1024 * 1024)))
+)
+
+# Cache of completions for prompts that do not depend on conversation history.
+# Set LLM_CACHE_SQLITE_PATH to keep entries across restarts.
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '2000')),
+    max_bytes=int(os.getenv('LLM_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv('LLM_CACHE_TTL_SECONDS', str(24 * 3600))),
+    sqlite_path=os.getenv('LLM_CACHE_SQLITE_PATH') or None
+)
+response_cache_enabled = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+
+# Identical requests in flight at the same time share a single upstream call.
+single_flight = SingleFlight()
+
+# Calls to Vertex AI are admitted within the project's request and token quotas;
+# the rest wait in a bounded priority queue or are rejected with a 429.
+admission = AdmissionController(
+    requests_per_minute=float(os.getenv('VERTEX_QUOTA_REQUESTS_PER_MINUTE', '300')),
+    tokens_per_minute=float(os.getenv('VERTEX_QUOTA_TOKENS_PER_MINUTE', '1000000')),
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '32')),
+    max_queue=int(os.getenv('LLM_ADMISSION_MAX_QUEUE', '100')),
+    max_wait_seconds=float(os.getenv('LLM_ADMISSION_MAX_WAIT_SECONDS', '10'))
+)
+# Output tokens are unknown when a request is admitted; this much is reserved for them.
+admission_output_token_reserve = int(os.getenv('LLM_ADMISSION_OUTPUT_TOKEN_RESERVE', '512'))
+
+
+@dataclass
+class LLMResponse:
+    """The result of a model call."""
+    text: str
+    cached: bool = False
+    usage: Optional[Dict[str, int]] = None
+    model_name: Optional[str] = None
+    error: Optional[str] = None
+    latency_seconds: Optional[float] = None
+
+
+@dataclass
+class _CallContext:
+    """Where a request goes: the calling endpoint, the routed model and the system prompt."""
+    endpoint: str
+    model_name: str
+    system_prompt: Optional[CompiledPrompt]
+    context_tokens: int = 0
+    generation_config: Optional[Dict[str, Any]] = None
+
+
+class LLMStream:
+    """
+    Async iterator over the text chunks of a streamed model response.
+
+    Once iteration has finished, `text` holds the full response, `usage` the
+    token usage reported by the model on the final chunk, and `first_token_seconds`
+    and `latency_seconds` the time from `started_at` to the first and last chunk.
+
+    A stream that is not read to the end must be closed with `aclose`, which
+    also frees what an unread stream holds, such as its admission slot.
+    """
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[Any],
+        on_complete: Optional[Callable[["LLMStream"], None]] = None,
+        cached: bool = False,
+        model_name: Optional[str] = None,
+        started_at: Optional[float] = None
+    ):
+        self._chunks = chunks
+        self._iterator: Optional[AsyncIterator[str]] = None
+        self._on_complete = on_complete
+        self._parts: List[str] = []
+        self._started_at = started_at if started_at is not None else time.monotonic()
+        self.usage: Optional[Dict[str, int]] = None
+        self.cached = cached
+        self.model_name = model_name
+        self.first_token_seconds: Optional[float] = None
+        self.latency_seconds: Optional[float] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def __aiter__(self):
+        if self._iterator is None:
+            self._iterator = self._iterate()
+        return self._iterator
+
+    async def aclose(self):
+        """Stops the stream, whether or not it was read, and closes the chunks it reads from."""
+        if self._iterator is not None:
+            await self._iterator.aclose()
+        close = getattr(self._chunks, "aclose", None)
+        if close is not None:
+            await close()
+
+    async def _iterate(self):
+        async for chunk in self._chunks:
+            usage = _usage_to_dict(getattr(chunk, "usage_metadata", None))
+            if usage:
+                self.usage = usage
+            try:
+                text = chunk.text
+            except (ValueError, IndexError, AttributeError):
+                # The final chunk may carry only usage metadata and no text part.
+                text = ""
+            if text:
+                if self.first_token_seconds is None:
+                    self.first_token_seconds = time.monotonic() - self._started_at
+                self._parts.append(text)
+                yield text
+        self.latency_seconds = time.monotonic() - self._started_at
+        if self._on_complete:
+            self._on_complete(self)
+
+
+class _TextChunk:
+    """Stands in for an SDK response chunk when replaying cached or shared responses."""
+
+    def __init__(self, text: str, usage_metadata: Any = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+async def _replay(text: str):
+    yield _TextChunk(text)
+
+
+async def _text_chunks(stream: "LLMStream"):
+    """Re-emits a stream as chunks, ending with one that carries the token usage."""
+    try:
+        async for text in stream:
+            yield _TextChunk(text)
+        yield _TextChunk("", stream.usage)
+    finally:
+        await stream.aclose()
+
+
+def _usage_to_dict(usage_metadata: Any) -> Optional[Dict[str, int]]:
+    """Converts the SDK's usage metadata into a JSON serializable dict."""
+    if not usage_metadata:
+        return None
+    if isinstance(usage_metadata, dict):
+        return usage_metadata
+    return {
+        "prompt_token_count": getattr(usage_metadata, "prompt_token_count", 0),
+        "candidates_token_count": getattr(usage_metadata, "candidates_token_count", 0),
+        "total_token_count": getattr(usage_metadata, "total_token_count", 0),
+        "cached_content_token_count": getattr(usage_metadata, "cached_content_token_count", 0),
+    }
 
 def initialize_ai():
-    global model, chat # Ensure assignment to global variables
-    # --- CONFIGURATION ---
-    # Project ID and location can be fetched from environment variables
-    # for better flexibility in different environments.
-    # Ensure these environment variables (GCP_PROJECT_ID, GCP_LOCATION) are set in your Cloud Run service.
-    # The defaults 'ai-agent-repo' and 'us-east1' are used if the environment variables are not set.
-    project_id = os.getenv('GCP_PROJECT_ID', 'ai-agent-repo')
-    location = os.getenv('GCP_LOCATION', 'us-east1')
-
-    # DO NOT set os.environ['GOOGLE_APPLICATION_CREDENTIALS'] here for Cloud Run.
-    # vertexai.init() will use Application Default Credentials (ADC).
-    # On Cloud Run, ADC uses the service's runtime service account.
-    # For local development, run 'gcloud auth application-default login'.
-    print(f"Initializing Vertex AI with Project ID: {project_id}, Location: {location}")
-    vertexai.init(project=project_id, location=location)
+    global model, model_name, model_router # Ensure assignment to the global variables
+    backend.initialize()
     model_name = os.getenv('VERTEX_MODEL_NAME', "gemini-2.0-flash-001")
     # Consider making the model name configurable as well, e.g., via an environment variable.
-    model = GenerativeModel(model_name)
-    chat = model.start_chat()
-    print(f"Vertex AI Model '{model_name}' initialized and chat session started.")
+    model = backend.get_model(model_name)
+    model_router = create_router_from_env(model_name)
+    print(f"{backend.name} model '{model_name}' initialized with model tiers {model_router.tiers}.")
+
+
+def _ensure_initialized():
+    if model is None:
+        # This should ideally not be reached if initialize_ai() is called at startup,
+        # but it's a good safeguard.
+        # Reported as a 503, like any other unavailable upstream.
+        raise resilience.UpstreamUnavailableError("vertex", "AI model has not been initialized", retry_after=1.0)
+
+
+def _route(
+    endpoint: str,
+    prompt: str,
+    system_prompt: Optional[CompiledPrompt],
+    history_tokens: int = 0,
+    generation_config: Optional[Dict[str, Any]] = None
+) -> _CallContext:
+    """Picks the model for a request from its endpoint and the size of its context."""
+    _ensure_initialized()
+    context_tokens = estimate_tokens(prompt) + history_tokens + (system_prompt.token_count if system_prompt else 0)
+    decision = model_router.route(endpoint, context_tokens)
+    return _CallContext(
+        endpoint=endpoint,
+        model_name=decision.model_name,
+        system_prompt=system_prompt,
+        context_tokens=context_tokens,
+        generation_config=generation_config
+    )
+
+
+def _record_call(
+    ctx: _CallContext,
+    started_at: float,
+    usage: Optional[Dict[str, int]],
+    first_token_seconds: Optional[float] = None
+):
+    """
+    Records the latency and token usage of an upstream call as per-endpoint and
+    per-model metrics. The first-token latency is only known for streamed calls.
+    """
+    latency_seconds = time.monotonic() - started_at
+    model_router.record(ctx.endpoint, ctx.model_name, latency_seconds)
+    prompt_registry.record_usage(ctx.system_prompt, usage)
+
+    labels = {"endpoint": ctx.endpoint, "model": ctx.model_name}
+    metrics.registry.inc("llm_calls_total", labels)
+    metrics.registry.observe("llm_latency_seconds", latency_seconds, labels)
+    if first_token_seconds is not None:
+        metrics.registry.observe("llm_first_token_seconds", first_token_seconds, labels)
+    if usage:
+        prompt_tokens = usage.get("prompt_token_count") or 0
+        output_tokens = usage.get("candidates_token_count") or 0
+        metrics.registry.inc("llm_prompt_tokens_total", labels, prompt_tokens)
+        metrics.registry.inc("llm_output_tokens_total", labels, output_tokens)
+        metrics.registry.inc("llm_cached_tokens_total", labels, usage.get("cached_content_token_count") or 0)
+        metrics.registry.observe("llm_prompt_tokens", prompt_tokens, labels, metrics.TOKEN_BUCKETS)
+        metrics.registry.observe("llm_output_tokens", output_tokens, labels, metrics.TOKEN_BUCKETS)
+
+
+def _record_cache_hit(ctx: _CallContext):
+    """Counts a response served from the response cache, which costs no tokens."""
+    metrics.registry.inc("llm_response_cache_hits_total", {"endpoint": ctx.endpoint, "model": ctx.model_name})
+
+
+def _upstream(ctx: _CallContext) -> str:
+    """Names the upstream a call goes to, which has its own circuit breaker."""
+    return f"vertex:{ctx.model_name}"
+
+
+def _total_tokens(usage_metadata: Any) -> Optional[int]:
+    usage = _usage_to_dict(usage_metadata)
+    return usage.get("total_token_count") if usage else None
+
+
+async def _resilient_call(ctx: _CallContext, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Calls the model under the endpoint's resilience policy. A request the model
+    refuses is raised as an UpstreamRejectedError, reported as a 400 or 502.
+    """
+    try:
+        return await resilience.call(_upstream(ctx), ctx.endpoint, fn)
+    except Exception as e:
+        if resilience.is_upstream_rejection(e):
+            raise resilience.UpstreamRejectedError(_upstream(ctx), e) from e
+        raise
+
+
+async def _call_model(ctx: _CallContext, send: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Sends a request to the model once it has been admitted within the quota, under
+    the endpoint's deadline, retry and hedging policy.
+    """
+    permit = await admission.acquire(ctx.endpoint, ctx.context_tokens + admission_output_token_reserve)
+    actual_tokens = None
+    try:
+        response = await _resilient_call(ctx, send)
+        actual_tokens = _total_tokens(getattr(response, "usage_metadata", None))
+        return response
+    finally:
+        admission.release(permit, actual_tokens)
+
 
-def generate_ai_response(prompt: str) -> str:
+class _AdmittedStream:
+    """
+    The chunks of an opened response stream. Its admission permit is held until
+    the stream has been read to the end or closed, and is released even if the
+    stream is closed without ever being read.
+    """
+
+    def __init__(self, first: Any, iterator: AsyncIterator[Any], permit: Permit):
+        self._first = first
+        self._upstream = iterator
+        self._permit = permit
+        self._usage_metadata = None
+        self._iterator: Optional[AsyncIterator[Any]] = None
+
+    def __aiter__(self):
+        if self._iterator is None:
+            self._iterator = self._iterate()
+        return self._iterator
+
+    async def _iterate(self):
+        try:
+            if self._first is not None:
+                self._usage_metadata = getattr(self._first, "usage_metadata", None)
+                yield self._first
+            async for chunk in self._upstream:
+                self._usage_metadata = getattr(chunk, "usage_metadata", None) or self._usage_metadata
+                yield chunk
+        finally:
+            self._release()
+
+    def _release(self):
+        # Releasing a permit twice is a no-op.
+        admission.release(self._permit, _total_tokens(self._usage_metadata))
+
+    async def aclose(self):
+        if self._iterator is not None:
+            await self._iterator.aclose()
+        close = getattr(self._upstream, "aclose", None)
+        if close is not None:
+            try:
+                await close()
+            except Exception as e:
+                print(f"Error closing a response stream: {e}")
+        self._release()
+
+
+async def _open_stream(ctx: _CallContext, send: Callable[[], Awaitable[AsyncIterable[Any]]]) -> AsyncIterator[Any]:
+    """
+    Opens a response stream under the endpoint's resilience policy. The call only
+    counts as successful once the first chunk has arrived, so a stream that fails
+    before producing anything is retried; later failures end the stream.
+    """
+    async def first_chunk():
+        iterator = (await send()).__aiter__()
+        try:
+            return await iterator.__anext__(), iterator
+        except StopAsyncIteration:
+            return None, iterator
+
+    # The admission permit is held until the stream has been fully consumed or closed.
+    permit = await admission.acquire(ctx.endpoint, ctx.context_tokens + admission_output_token_reserve)
+    try:
+        first, iterator = await _resilient_call(ctx, first_chunk)
+    except BaseException:
+        admission.release(permit)
+        raise
+    return _AdmittedStream(first, iterator, permit)
+
+
+async def _get_model(ctx: _CallContext) -> Any:
+    """Returns the model to call, creating and reusing one per (model, compiled system prompt)."""
+    system_prompt = ctx.system_prompt
+    key = (ctx.model_name, system_prompt.fingerprint if system_prompt else "")
+    entry = _models.get(key)
+    if entry is not None and (entry[1] is None or entry[1] > time.time()):
+        return entry[0]
+
+    expires_at = None
+    target_model = None
+    if backend.supports_context_cache and system_prompt is not None and system_prompt.token_count >= context_cache_min_tokens:
+        try:
+            # Creating the cache is a blocking network call; keep it off the event loop.
+            target_model = await asyncio.to_thread(
+                backend.create_context_cached_model, ctx.model_name, system_prompt, context_cache_ttl_seconds
+            )
+            # Recreate the cache shortly before the provider expires it.
+            expires_at = time.time() + context_cache_ttl_seconds - 60
+        except Exception as e:
+            print(f"Failed to create context cache for prompt '{system_prompt.name}', sending it inline: {e}")
+    if target_model is None:
+        target_model = backend.get_model(
+            ctx.model_name,
+            system_instruction=system_prompt.text if system_prompt else None
+        )
+    _models[key] = (target_model, expires_at)
+    return target_model
+
+
+async def _start_chat(session_id: str, ctx: _CallContext) -> Any:
+    """Starts a chat session seeded with the stored history of the given conversation."""
+    chat_model = await _get_model(ctx)
+    return backend.start_chat(chat_model, session_store.get_history(session_id))
+
+
+async def _send_chat_message(session_id: str, ctx: _CallContext, prompt: str, stream: bool = False) -> Any:
+    chat = await _start_chat(session_id, ctx)
+    return await chat.send_message_async(prompt, stream=stream)
+
+
+def _request_key(prompt: str, language: Optional[str], ctx: _CallContext) -> str:
+    """Returns the key identifying a stateless request, shared by the response cache and coalescing."""
+    return make_cache_key(
+        prompt, ctx.model_name, language=language,
+        generation_config=ctx.generation_config,
+        system_prompt=ctx.system_prompt.fingerprint if ctx.system_prompt else None
+    )
+
+
+def _generation_kwargs(ctx: _CallContext) -> Dict[str, Any]:
+    """Returns the extra arguments of a generate call, e.g. a response schema."""
+    if not ctx.generation_config:
+        return {}
+    return {"generation_config": backend.generation_config(ctx.generation_config)}
+
+
+def _cache_get(request_key: str) -> Optional[str]:
+    if not response_cache_enabled:
+        return None
+    return response_cache.get(request_key)
+
+
+def _cache_set(request_key: str, text: str):
+    if response_cache_enabled and text:
+        response_cache.set(request_key, text)
+
+
+async def _generate_shared(prompt: str, request_key: str, ctx: _CallContext):
+    """
+    Calls the model for a stateless prompt. Concurrent callers with the same
+    request key share one upstream call, whose result is cached once.
+    """
+    async def call():
+        target_model = await _get_model(ctx)
+        started_at = time.monotonic()
+        response = await _call_model(ctx, lambda: target_model.generate_content_async(prompt, **_generation_kwargs(ctx)))
+        _record_call(ctx, started_at, _usage_to_dict(getattr(response, "usage_metadata", None)))
+        _cache_set(request_key, response.text)
+        return response
+    return await single_flight.do(request_key, call)
+
+
+async def _stream_shared(prompt: str, request_key: str, ctx: _CallContext) -> AsyncIterator[_TextChunk]:
+    """
+    Streams the model's response to a stateless prompt. Concurrent callers with the
+    same request key share one upstream stream and each receive every chunk.
+    Returns once the stream is open: admission and the first chunk have been waited
+    for, so their failures are raised here rather than in the middle of the stream.
+    """
+    async def start():
+        target_model = await _get_model(ctx)
+        started_at = time.monotonic()
+        responses = await _open_stream(ctx, lambda: target_model.generate_content_async(prompt, stream=True, **_generation_kwargs(ctx)))
+
+        def on_complete(done: LLMStream):
+            _record_call(ctx, started_at, done.usage, done.first_token_seconds)
+            _cache_set(request_key, done.text)
+
+        return _text_chunks(LLMStream(responses, on_complete=on_complete, started_at=started_at))
+    return await single_flight.stream(request_key, start)
+
+
+def get_stats() -> Dict[str, Any]:
+    """Returns runtime statistics of the LLM service layer."""
+    return {
+        "chat_sessions": session_store.stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "prompt_templates": prompt_registry.stats(),
+        "backend": backend.name,
+        "model_router": model_router.stats() if model_router else None,
+        "resilience": resilience.get_stats(),
+        "admission": admission.stats(),
+    }
+
+
+async def generate_ai_response(
+    prompt: str,
+    language: Optional[str] = None,
+    refresh_cache: bool = False,
+    system_prompt: Optional[CompiledPrompt] = None,
+    endpoint: str = "generate_ai_response",
+    generation_config: Optional[Dict[str, Any]] = None
+) -> LLMResponse:
     """
     Generates an AI response to a given prompt using a transformer model.
+    Uses the SDK's async generation so the event loop is never blocked while
+    waiting for the model. Identical prompts are answered from the response cache
+    without calling the model, and identical prompts in flight share one call.
 
     Args:
         prompt: The input prompt string.
+        language: The language the response is requested in, part of the cache key.
+        refresh_cache: If true, the cache is not consulted but is updated with the new response.
+        system_prompt: A compiled system prompt sent as the model's system instruction.
+        endpoint: The calling endpoint, used to pick the model tier.
+        generation_config: Generation parameters such as `response_mime_type` and
+                           `response_schema` for constrained JSON output; part of the cache key.
 
     Returns:
-        The generated AI response string.
+        The generated AI response.
+
+    Raises:
+        QuotaExceededError: The request was not admitted within the quota (a 429 with Retry-After).
+        resilience.UpstreamError: The model is unavailable or did not answer within the endpoint's deadline.
+        resilience.UpstreamRejectedError: The model rejected the request (not retried): 400 if it was invalid, else 502.
     """
-    try:
-        print(f"Generating AI response for prompt: {prompt}")
-        if model is None:
-            # This should ideally not be reached if initialize_ai() is called at startup,
-            # but it's a good safeguard.
-            raise RuntimeError("AI model has not been initialized. Call initialize_ai() first.")
-        response = model.generate_content(prompt)
-        # For Vertex AI GenerativeModel, the text response is typically accessed via response.text
-        print(f"Raw AI response: {response}")
-        return response.text
-    except Exception as e:
-        print(f"Error generating AI response: {e}")
-        return f"Error generating AI response: {e}"
+    request_started_at = time.monotonic()
+    print(f"Generating AI response for prompt: {prompt}")
+    ctx = _route(endpoint, prompt, system_prompt, generation_config=generation_config)
+    request_key = _request_key(prompt, language, ctx)
+    cached_text = None if refresh_cache else _cache_get(request_key)
+    if cached_text is not None:
+        _record_cache_hit(ctx)
+        return LLMResponse(
+            text=cached_text, cached=True, model_name=ctx.model_name,
+            latency_seconds=time.monotonic() - request_started_at
+        )
+
+    response = await _generate_shared(prompt, request_key, ctx)
+    # For Vertex AI GenerativeModel, the text response is typically accessed via response.text
+    usage = _usage_to_dict(getattr(response, "usage_metadata", None))
+    return LLMResponse(
+        text=response.text, usage=usage, model_name=ctx.model_name,
+        latency_seconds=time.monotonic() - request_started_at
+    )
 
-def chat_with_ai(prompt: str) -> str:
+async def chat_with_ai(
+    prompt: str,
+    session_id: str,
+    language: Optional[str] = None,
+    system_prompt: Optional[CompiledPrompt] = None,
+    endpoint: str = "chat"
+) -> LLMResponse:
     """
-    Sends a message to the AI in an ongoing chat session and gets a response.
+    Sends a message to the AI in the chat session of a conversation and gets a response.
+    The message is sent asynchronously so other requests keep being served.
+
+    The opening message of a conversation does not depend on any history, so it
+    is answered like a stateless prompt: from the response cache, or through an
+    upstream call shared with identical opening messages in flight.
 
     Args:
         prompt: The user's message to the AI.
+        session_id: Identifies the conversation whose history is used and extended.
+        language: The language the response is requested in, part of the cache key.
+        system_prompt: A compiled system prompt sent as the model's system instruction.
+        endpoint: The calling endpoint, used to pick the model tier.
 
     Returns:
-        The AI's response string.
+        The AI's response.
+
+    Raises:
+        QuotaExceededError: The request was not admitted within the quota (a 429 with Retry-After).
+        resilience.UpstreamError: The model is unavailable or did not answer within the endpoint's deadline.
+        resilience.UpstreamRejectedError: The model rejected the request (not retried): 400 if it was invalid, else 502.
     """
+    request_started_at = time.monotonic()
+    print(f"Sending message to AI chat session '{session_id}': {prompt}")
+    ctx = _route(endpoint, prompt, system_prompt, session_store.token_count(session_id))
+    if session_store.has_history(session_id):
+        started_at = time.monotonic()
+        # Every attempt starts a fresh chat from the stored history, so retries are idempotent.
+        response = await _call_model(ctx, lambda: _send_chat_message(session_id, ctx, prompt))
+        _record_call(ctx, started_at, _usage_to_dict(getattr(response, "usage_metadata", None)))
+    else:
+        request_key = _request_key(prompt, language, ctx)
+        cached_text = _cache_get(request_key)
+        if cached_text is not None:
+            _record_cache_hit(ctx)
+            session_store.append_turn(session_id, prompt, cached_text)
+            return LLMResponse(
+                text=cached_text, cached=True, model_name=ctx.model_name,
+                latency_seconds=time.monotonic() - request_started_at
+            )
+        response = await _generate_shared(prompt, request_key, ctx)
+    # For ChatSession, the text response is typically accessed via response.text
+    session_store.append_turn(session_id, prompt, response.text)
+    usage = _usage_to_dict(getattr(response, "usage_metadata", None))
+    return LLMResponse(
+        text=response.text, usage=usage, model_name=ctx.model_name,
+        latency_seconds=time.monotonic() - request_started_at
+    )
+
+async def generate_ai_responses(
+    prompts: List[str],
+    max_concurrency: int,
+    endpoint: str = "generate_ai_response_batch"
+) -> AsyncIterator[Tuple[int, LLMResponse]]:
+    """
+    Generates responses to a batch of prompts, running at most `max_concurrency`
+    of them at a time, and yields each result as soon as it completes.
+
+    A prompt whose call fails (an upstream error or a rejected request) yields
+    an LLMResponse with `error` set instead of failing the whole batch.
+
+    Args:
+        prompts: The input prompt strings.
+        max_concurrency: The maximum number of prompts generated concurrently.
+        endpoint: The calling endpoint, used to pick the model tier and priority.
+
+    Returns:
+        An async iterator of (prompt index, response) pairs, in completion order.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def generate(index: int, prompt: str) -> Tuple[int, LLMResponse]:
+        async with semaphore:
+            try:
+                return index, await generate_ai_response(prompt, endpoint=endpoint)
+            except Exception as e:
+                return index, LLMResponse(text="", model_name=model_name, error=str(e))
+
+    tasks = [asyncio.ensure_future(generate(index, prompt)) for index, prompt in enumerate(prompts)]
     try:
-        print(f"Sending message to AI chat: {prompt}")
-        if chat is None:
-            # This safeguard ensures initialize_ai() has been successfully called
-            # and the chat session was started.
-            raise RuntimeError("AI chat session has not been initialized. Call initialize_ai() first.")
-        
-        response = chat.send_message(prompt)
-        # For ChatSession, the text response is typically accessed via response.text
-        print(f"Raw AI chat response: {response}")
-        return response.text
-    except Exception as e:
-        print(f"Error in AI chat: {e}")
-        return f"Error in AI chat: {e}"
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The caller stopped early (e.g. the client disconnected): drop the remaining prompts.
+        for task in tasks:
+            task.cancel()
+
+async def stream_ai_response(
+    prompt: str,
+    language: Optional[str] = None,
+    system_prompt: Optional[CompiledPrompt] = None,
+    endpoint: str = "generate_ai_response"
+) -> LLMStream:
+    """
+    Generates an AI response to a given prompt, streaming it chunk by chunk.
+    A cached completion is replayed as a single chunk, and identical prompts
+    streaming at the same time share one upstream stream. Returns once the stream
+    has produced its first chunk.
+
+    Args:
+        prompt: The input prompt string.
+        language: The language the response is requested in, part of the cache key.
+        system_prompt: A compiled system prompt sent as the model's system instruction.
+        endpoint: The calling endpoint, used to pick the model tier.
+
+    Returns:
+        An LLMStream yielding the response text as it is generated.
+
+    Raises:
+        QuotaExceededError: The request was not admitted within the quota (a 429 with Retry-After).
+        resilience.UpstreamError: The model is unavailable or did not answer within the endpoint's deadline.
+        resilience.UpstreamRejectedError: The model rejected the request (not retried): 400 if it was invalid, else 502.
+    """
+    print(f"Streaming AI response for prompt: {prompt}")
+    ctx = _route(endpoint, prompt, system_prompt)
+    request_key = _request_key(prompt, language, ctx)
+    cached_text = _cache_get(request_key)
+    if cached_text is not None:
+        _record_cache_hit(ctx)
+        return LLMStream(_replay(cached_text), cached=True, model_name=ctx.model_name)
+    return LLMStream(await _stream_shared(prompt, request_key, ctx), model_name=ctx.model_name)
+
+async def stream_chat_with_ai(
+    prompt: str,
+    session_id: str,
+    language: Optional[str] = None,
+    system_prompt: Optional[CompiledPrompt] = None,
+    endpoint: str = "chat"
+) -> LLMStream:
+    """
+    Sends a message to the chat session of a conversation and streams the response back.
+    The conversation history is updated once the stream has been fully consumed.
+    Returns once the stream has produced its first chunk, whether it is the
+    conversation's own or shared with identical opening messages.
+
+    Args:
+        prompt: The user's message to the AI.
+        session_id: Identifies the conversation whose history is used and extended.
+        language: The language the response is requested in, part of the cache key.
+        system_prompt: A compiled system prompt sent as the model's system instruction.
+        endpoint: The calling endpoint, used to pick the model tier.
+
+    Returns:
+        An LLMStream yielding the response text as it is generated.
+
+    Raises:
+        QuotaExceededError: The request was not admitted within the quota (a 429 with Retry-After).
+        resilience.UpstreamError: The model is unavailable or did not answer within the endpoint's deadline.
+        resilience.UpstreamRejectedError: The model rejected the request (not retried): 400 if it was invalid, else 502.
+    """
+    request_started_at = time.monotonic()
+    print(f"Streaming message to AI chat session '{session_id}': {prompt}")
+    ctx = _route(endpoint, prompt, system_prompt, session_store.token_count(session_id))
+    append_turn = lambda stream: session_store.append_turn(session_id, prompt, stream.text)
+
+    if session_store.has_history(session_id):
+        started_at = time.monotonic()
+        responses = await _open_stream(ctx, lambda: _send_chat_message(session_id, ctx, prompt, stream=True))
+
+        def on_complete(stream: LLMStream):
+            append_turn(stream)
+            _record_call(ctx, started_at, stream.usage, stream.first_token_seconds)
+
+        return LLMStream(responses, on_complete=on_complete, model_name=ctx.model_name, started_at=request_started_at)
+
+    request_key = _request_key(prompt, language, ctx)
+    cached_text = _cache_get(request_key)
+    if cached_text is not None:
+        _record_cache_hit(ctx)
+        return LLMStream(_replay(cached_text), on_complete=append_turn, cached=True, model_name=ctx.model_name)
+    return LLMStream(await _stream_shared(prompt, request_key, ctx), on_complete=append_turn, model_name=ctx.model_name)
+
+def chat_reply_from_text(prompt: str, session_id: str, text: str) -> LLMResponse:
+    """
+    Answers a chat message with an already generated reply, recording the turn
+    in the conversation history as if the model had produced it.
+
+    Args:
+        prompt: The user's message to the AI.
+        session_id: Identifies the conversation whose history is extended.
+        text: The pre-generated reply.
+
+    Returns:
+        The reply, flagged as cached.
+    """
+    session_store.append_turn(session_id, prompt, text)
+    return LLMResponse(text=text, cached=True, model_name=model_name)
+
+def stream_chat_reply_from_text(prompt: str, session_id: str, text: str) -> LLMStream:
+    """
+    Streaming counterpart of `chat_reply_from_text`: replays a pre-generated reply
+    as a single chunk and records the turn once it has been consumed.
+    """
+    return LLMStream(
+        _replay(text),
+        on_complete=lambda stream: session_store.append_turn(session_id, prompt, stream.text),
+        cached=True
+    )
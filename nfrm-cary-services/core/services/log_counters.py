@@ -0,0 +1,101 @@
+import hashlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+# Counters maintained as API logs are written: dimension -> (log field, bucket size).
+DIMENSIONS: Dict[str, Tuple[str, str]] = {
+    "api_name_day": ("api_name", "day"),
+    "user_email_day": ("user_details.user_email", "day"),
+    "api_name_hour": ("api_name", "hour"),
+}
+
+# The fields that can be counted, and the dimensions counting them from finest to coarsest bucket.
+GROUP_BY_DIMENSIONS: Dict[str, List[str]] = {
+    "api_name": ["api_name_hour", "api_name_day"],
+    "user_details.user_email": ["user_email_day"],
+}
+
+BUCKET_SIZES = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+
+def _field_value(document: Dict[str, Any], field_name: str) -> Optional[Any]:
+    value: Any = document
+    for key in field_name.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+        if value is None:
+            return None
+    return value
+
+
+def bucket_start(timestamp: datetime, bucket: str) -> datetime:
+    """Returns the start of the hour or day (UTC) a timestamp falls in."""
+    timestamp = timestamp.astimezone(timezone.utc)
+    if bucket == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def aligned_range(start: datetime, end: datetime, bucket: str) -> Tuple[datetime, datetime]:
+    """Widens [start, end) to whole hours or days. Times without a timezone are taken as UTC."""
+    start, end = (t if t.tzinfo else t.replace(tzinfo=timezone.utc) for t in (start, end))
+    aligned_end = bucket_start(end, bucket)
+    if aligned_end != end:
+        aligned_end += BUCKET_SIZES[bucket]
+    return bucket_start(start, bucket), aligned_end
+
+
+def counter_updates(log_documents: List[Dict[str, Any]], shard: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Aggregates a batch of API log documents into counter increments.
+
+    Args:
+        log_documents: The log documents being written.
+        shard: The counter shard these increments go to.
+
+    Returns:
+        The counter documents to increment, keyed by document id, each with its
+        dimension, counted value, bucket start, shard and the `count` to add.
+    """
+    counts: Counter = Counter()
+    for log_document in log_documents:
+        timestamp = log_document.get('timestamp')
+        if not isinstance(timestamp, datetime):
+            continue
+        for dimension, (field_name, bucket) in DIMENSIONS.items():
+            value = _field_value(log_document, field_name)
+            counts[(dimension, str(value) if value is not None else "unknown", bucket_start(timestamp, bucket))] += 1
+
+    updates = {}
+    for (dimension, value, start), count in counts.items():
+        value_hash = hashlib.sha1(value.encode("utf-8")).hexdigest()[:16]
+        document_id = f"{dimension}_{start.strftime('%Y%m%d%H')}_{value_hash}_{shard}"
+        updates[document_id] = {
+            "dimension": dimension,
+            "value": value,
+            "bucket_start": start,
+            "shard": shard,
+            "count": count,
+        }
+    return updates
+
+
+def pick_dimension(group_by_field: str, start: datetime, end: datetime) -> Optional[Tuple[str, datetime, datetime]]:
+    """
+    Picks the coarsest counter that covers [start, end) exactly, or failing that the
+    finest one, with the range widened to whole buckets.
+
+    Returns:
+        The dimension and the bucket-aligned range it is read over, or None if
+        the field is not counted.
+    """
+    dimensions = GROUP_BY_DIMENSIONS.get(group_by_field)
+    if not dimensions:
+        return None
+    # Times without a timezone are taken as UTC, like the counter buckets.
+    start, end = (t if t.tzinfo else t.replace(tzinfo=timezone.utc) for t in (start, end))
+    for dimension in reversed(dimensions):
+        bucket = DIMENSIONS[dimension][1]
+        if bucket_start(start, bucket) == start and bucket_start(end, bucket) == end:
+            return dimension, start, end
+    return (dimensions[0], *aligned_range(start, end, DIMENSIONS[dimensions[0]][1]))
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional
+
+from core.services.log_counters import bucket_start
+
+# The columns of the exported table: (column, dotted path in the API log, Arrow type).
+# `request_data` is reduced to a few small fields; the document content and chat history stay out.
+COLUMNS = [
+    ("id", "id", "string"),
+    ("api_name", "api_name", "string"),
+    ("timestamp", "timestamp", "timestamp"),
+    ("written_at", "written_at", "timestamp"),
+    ("prompt", "prompt", "string"),
+    ("user_email", "user_details.user_email", "string"),
+    ("user_name", "user_details.user_name", "string"),
+    ("language", "request_data.language", "string"),
+    ("conversation_id", "request_data.conversation_id", "string"),
+    ("document_id", "request_data.document_id", "string"),
+    ("model_name", "response_metadata.model_name", "string"),
+    ("cached", "response_metadata.cached", "bool"),
+    ("streamed", "response_metadata.streamed", "bool"),
+    ("latency_ms", "response_metadata.latency_ms", "float64"),
+    ("prompt_tokens", "response_metadata.usage.prompt_token_count", "int64"),
+    ("output_tokens", "response_metadata.usage.candidates_token_count", "int64"),
+    ("total_tokens", "response_metadata.usage.total_token_count", "int64"),
+    ("error", "response_metadata.error", "string"),
+    ("status_code", "response_metadata.status_code", "int64"),
+]
+
+# The log fields read from Firestore to fill the columns.
+EXPORT_FIELDS = [path for _, path, _ in COLUMNS if path != "id"]
+
+# Reads the logs of [start, end) as dicts carrying their document `id`.
+LogSource = Callable[[datetime, datetime], AsyncIterator[Dict[str, Any]]]
+
+
+def _field_value(document: Dict[str, Any], path: str) -> Any:
+    value: Any = document
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+        if value is None:
+            return None
+    return value
+
+
+def _to_timestamp(value: Any) -> Optional[datetime]:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if not isinstance(value, datetime):
+        return None
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    "string": lambda value: value if isinstance(value, str) else json.dumps(value, default=str),
+    "timestamp": _to_timestamp,
+    # Only real booleans: bool("false") would be True.
+    "bool": lambda value: value if isinstance(value, bool) else None,
+    "float64": lambda value: float(value) if isinstance(value, (int, float)) else None,
+    "int64": lambda value: int(value) if isinstance(value, (int, float)) else None,
+}
+
+
+def flatten_log(log: Dict[str, Any]) -> Dict[str, Any]:
+    """Turns an API log into one row of the exported table."""
+    row = {}
+    for column, path, arrow_type in COLUMNS:
+        value = _field_value(log, path)
+        row[column] = _CONVERTERS[arrow_type](value) if value is not None else None
+    return row
+
+
+def arrow_schema():
+    """Returns the Arrow schema of the exported table."""
+    import pyarrow as pa
+    types = {
+        "string": pa.string(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+        "bool": pa.bool_(),
+        "float64": pa.float64(),
+        "int64": pa.int64(),
+    }
+    return pa.schema([(column, types[arrow_type]) for column, _, arrow_type in COLUMNS])
+
+
+class DayPartitionWriter:
+    """
+    Writes the rows of one day to `<target_dir>/date=YYYY-MM-DD/api_logs.parquet`,
+    one row group of `row_group_size` rows at a time, so a day never has to fit in
+    memory. The file is written under a temporary name and renamed on `close`,
+    so a partition is either complete or absent, and re-exporting a day replaces it.
+    """
+
+    def __init__(self, target_dir: str, day: datetime, row_group_size: int = 10000):
+        import pyarrow.parquet as pq
+        self.path = os.path.join(target_dir, f"date={day.strftime('%Y-%m-%d')}", "api_logs.parquet")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._temp_path = self.path + ".tmp"
+        self._schema = arrow_schema()
+        self._writer = pq.ParquetWriter(self._temp_path, self._schema, compression="zstd")
+        self.row_group_size = row_group_size
+        self._rows: List[Dict[str, Any]] = []
+        self.rows_written = 0
+
+    def add(self, row: Dict[str, Any]):
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        if self._rows:
+            self._writer.write_table(pa.Table.from_pylist(self._rows, schema=self._schema))
+            self.rows_written += len(self._rows)
+            self._rows = []
+
+    def close(self) -> str:
+        """Writes the remaining rows and publishes the file. Returns its path."""
+        self._flush()
+        self._writer.close()
+        os.replace(self._temp_path, self.path)
+        return self.path
+
+    def abort(self):
+        self._writer.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+class ExportCheckpoint:
+    """The first day not exported yet, kept in a small JSON file that is replaced atomically."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[datetime]:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return _to_timestamp(json.load(f)["next_day"])
+
+    def save(self, next_day: datetime):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"next_day": next_day.isoformat(), "saved_at": datetime.now(timezone.utc).isoformat()}, f)
+        os.replace(temp_path, self.path)
+
+
+def load_partition_to_bigquery(path: str, table_id: str, day: datetime):
+    """
+    Loads a day's Parquet file into its partition of a BigQuery table partitioned by
+    `timestamp`, replacing the partition, so loading a day twice does not duplicate it.
+    Blocks until the load job is done.
+    """
+    from google.cloud import bigquery
+    client = bigquery.Client()
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        time_partitioning=bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY, field="timestamp"),
+    )
+    with open(path, "rb") as f:
+        job = client.load_table_from_file(f, f"{table_id}${day.strftime('%Y%m%d')}", job_config=job_config)
+    job.result()
+
+
+async def export_logs(
+    source: LogSource,
+    target_dir: str,
+    checkpoint: ExportCheckpoint,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    settle_hours: float = 6.0,
+    bigquery_table: Optional[str] = None,
+    row_group_size: int = 10000
+) -> Dict[str, Any]:
+    """
+    Exports API logs to Parquet one UTC day at a time, resuming from the checkpoint.
+
+    A day is exported only once it ended at least `settle_hours` ago, so logs
+    replayed late from the writers' spools are included. The checkpoint moves past
+    a day only after its file is written (and loaded into BigQuery, if a table is
+    given); a run that stops midway redoes at most that one day.
+
+    Args:
+        source: Reads the logs of a time range.
+        target_dir: The directory the day partitions are written to.
+        checkpoint: Where the next day to export is kept.
+        start: The first day to export when there is no checkpoint yet, or to re-export from.
+        end: Stop before this day; defaults to the last settled day.
+        settle_hours: How long after a day ends it is exported.
+        bigquery_table: Also load each day into this table ('project.dataset.table'), if given.
+        row_group_size: The rows per Parquet row group.
+
+    Returns:
+        The days exported, with their row counts and files.
+    """
+    next_day = bucket_start(_to_timestamp(start), "day") if start else checkpoint.load()
+    if next_day is None:
+        raise ValueError("No checkpoint yet: give the first day to export.")
+    last_settled = bucket_start(datetime.now(timezone.utc) - timedelta(hours=settle_hours), "day")
+    end_day = min(bucket_start(_to_timestamp(end), "day"), last_settled) if end else last_settled
+
+    exported = []
+    while next_day < end_day:
+        day_end = next_day + timedelta(days=1)
+        writer = DayPartitionWriter(target_dir, next_day, row_group_size)
+        try:
+            async for log in source(next_day, day_end):
+                writer.add(flatten_log(log))
+            path = writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+        if bigquery_table:
+            await asyncio.to_thread(load_partition_to_bigquery, path, bigquery_table, next_day)
+        checkpoint.save(day_end)
+        exported.append({"day": next_day.date().isoformat(), "rows": writer.rows_written, "path": path})
+        next_day = day_end
+
+    return {"days": exported, "next_day": next_day.isoformat()}
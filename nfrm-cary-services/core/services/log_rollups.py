@@ -0,0 +1,176 @@
+import hashlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, Iterable, List, Optional, Set
+
+from core.services.log_counters import bucket_start
+from core.services.metrics import Histogram
+
+GRANULARITIES = ("hour", "day")
+
+# Bucket upper bounds for prompt lengths (characters) and response latencies (milliseconds).
+PROMPT_LENGTH_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+LATENCY_MS_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+# The fields of an API log a rollup reads; the large `request_data` is not needed.
+LOG_FIELDS = ['api_name', 'timestamp', 'prompt', 'user_details.user_email', 'response_metadata.error', 'response_metadata.latency_ms']
+
+# Distinct users are kept as a set per rollup; past this many the distinct count is a lower bound.
+MAX_USERS_PER_ROLLUP = 5000
+
+
+def _histogram_to_dict(histogram: Histogram) -> Dict[str, Any]:
+    return {"counts": list(histogram.counts), "sum": histogram.sum, "count": histogram.count}
+
+
+def _histogram_from_dict(data: Optional[Dict[str, Any]], buckets) -> Histogram:
+    histogram = Histogram(buckets)
+    if data and len(data.get("counts", [])) == len(histogram.counts):
+        histogram.counts = list(data["counts"])
+        histogram.sum = data.get("sum", 0.0)
+        histogram.count = data.get("count", 0)
+    return histogram
+
+
+def _merge_histograms(first: Histogram, second: Histogram) -> Histogram:
+    merged = Histogram(first.buckets)
+    merged.counts = [a + b for a, b in zip(first.counts, second.counts)]
+    merged.sum = first.sum + second.sum
+    merged.count = first.count + second.count
+    return merged
+
+
+def _histogram_summary(histogram: Histogram) -> Optional[Dict[str, Any]]:
+    if histogram.count == 0:
+        return None
+    return {
+        "mean": round(histogram.sum / histogram.count, 1),
+        "p50": histogram.quantile(0.5),
+        "p95": histogram.quantile(0.95),
+    }
+
+
+def rollup_id(granularity: str, start: datetime, api_name: str) -> str:
+    """Returns the id of the rollup document of an API in an hour or day."""
+    api_hash = hashlib.sha1(api_name.encode("utf-8")).hexdigest()[:16]
+    return f"{granularity}_{start.strftime('%Y%m%d%H')}_{api_hash}"
+
+
+@dataclass
+class Rollup:
+    """The calls of one API in one hour or day: counts, distinct users, prompt lengths and latencies."""
+    granularity: str
+    bucket_start: datetime
+    api_name: str
+    calls: int = 0
+    errors: int = 0
+    users: Set[str] = field(default_factory=set)
+    users_truncated: bool = False
+    prompt_length: Histogram = field(default_factory=lambda: Histogram(PROMPT_LENGTH_BUCKETS))
+    latency_ms: Histogram = field(default_factory=lambda: Histogram(LATENCY_MS_BUCKETS))
+
+    def add(self, log_document: Dict[str, Any]):
+        """Counts one API log."""
+        self.calls += 1
+        response_metadata = log_document.get('response_metadata') or {}
+        if response_metadata.get('error'):
+            self.errors += 1
+        user_email = (log_document.get('user_details') or {}).get('user_email')
+        if user_email:
+            self._add_users({user_email})
+        self.prompt_length.observe(len(log_document.get('prompt') or ""))
+        if isinstance(response_metadata.get('latency_ms'), (int, float)):
+            self.latency_ms.observe(response_metadata['latency_ms'])
+
+    def merged(self, other: "Rollup") -> "Rollup":
+        """Returns a new rollup combining this one with another of the same API (and period, when storing)."""
+        result = Rollup(
+            granularity=self.granularity,
+            bucket_start=self.bucket_start,
+            api_name=self.api_name,
+            calls=self.calls + other.calls,
+            errors=self.errors + other.errors,
+            users=set(self.users),
+            users_truncated=self.users_truncated or other.users_truncated,
+            prompt_length=_merge_histograms(self.prompt_length, other.prompt_length),
+            latency_ms=_merge_histograms(self.latency_ms, other.latency_ms)
+        )
+        result._add_users(other.users)
+        return result
+
+    def _add_users(self, users: Iterable[str]):
+        for user in users:
+            if len(self.users) >= MAX_USERS_PER_ROLLUP and user not in self.users:
+                self.users_truncated = True
+                return
+            self.users.add(user)
+
+    def to_document(self) -> Dict[str, Any]:
+        return {
+            "granularity": self.granularity,
+            "bucket_start": self.bucket_start,
+            "api_name": self.api_name,
+            "calls": self.calls,
+            "errors": self.errors,
+            "users": sorted(self.users),
+            "distinct_users": len(self.users),
+            "users_truncated": self.users_truncated,
+            "prompt_length": _histogram_to_dict(self.prompt_length),
+            "latency_ms": _histogram_to_dict(self.latency_ms),
+        }
+
+    @classmethod
+    def from_document(cls, data: Dict[str, Any]) -> "Rollup":
+        return cls(
+            granularity=data["granularity"],
+            bucket_start=data["bucket_start"],
+            api_name=data["api_name"],
+            calls=data.get("calls", 0),
+            errors=data.get("errors", 0),
+            users=set(data.get("users", [])),
+            users_truncated=data.get("users_truncated", False),
+            prompt_length=_histogram_from_dict(data.get("prompt_length"), PROMPT_LENGTH_BUCKETS),
+            latency_ms=_histogram_from_dict(data.get("latency_ms"), LATENCY_MS_BUCKETS)
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        """Returns the figures an admin asks about, without the raw user list and histograms."""
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "distinct_users": len(self.users),
+            "distinct_users_is_lower_bound": self.users_truncated,
+            "prompt_length_chars": _histogram_summary(self.prompt_length),
+            "latency_ms": _histogram_summary(self.latency_ms),
+        }
+
+
+def rollup_ids_of(log_document: Dict[str, Any]) -> List[str]:
+    """Returns the ids of the rollups a log counts towards."""
+    timestamp = log_document.get('timestamp')
+    if not isinstance(timestamp, datetime):
+        return []
+    api_name = str(log_document.get('api_name') or "unknown")
+    return [rollup_id(granularity, bucket_start(timestamp, granularity), api_name) for granularity in GRANULARITIES]
+
+
+def add_to_rollups(rollups: Dict[str, Rollup], log_document: Dict[str, Any]):
+    """Counts a log in its hourly and daily rollups, creating them as needed."""
+    timestamp = log_document.get('timestamp')
+    if not isinstance(timestamp, datetime):
+        return
+    api_name = str(log_document.get('api_name') or "unknown")
+    for granularity in GRANULARITIES:
+        start = bucket_start(timestamp, granularity)
+        document_id = rollup_id(granularity, start, api_name)
+        if document_id not in rollups:
+            rollups[document_id] = Rollup(granularity=granularity, bucket_start=start, api_name=api_name)
+        rollups[document_id].add(log_document)
+
+
+def combine_by_api(rollups: Iterable[Rollup]) -> Dict[str, Rollup]:
+    """Combines the rollups of several periods into one per API."""
+    combined: Dict[str, Rollup] = {}
+    for rollup in rollups:
+        combined[rollup.api_name] = combined[rollup.api_name].merged(rollup) if rollup.api_name in combined else rollup
+    return combined
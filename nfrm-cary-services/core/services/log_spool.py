@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from core.services import metrics
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Cannot spool a value of type {type(value).__name__}")
+
+
+def _decode(value: Dict[str, Any]) -> Any:
+    if len(value) == 1 and "$datetime" in value:
+        return datetime.fromisoformat(value["$datetime"])
+    return value
+
+
+class LogSpool:
+    """
+    A crash-safe, size-capped local queue of log records that could not be written
+    upstream, kept in a sqlite database in WAL mode.
+
+    Records are appended in batches and claimed back oldest first. Several worker
+    processes may share one spool file: a claim takes sqlite's write lock and leases
+    the records it returns, so no two processes replay the same records; a lease
+    that is neither deleted nor released expires and the records can be claimed
+    again. Once the spool holds `max_bytes` of records, further records are
+    refused rather than growing the disk usage without bound. Calls block on disk
+    I/O, so async callers run them in a worker thread.
+    """
+
+    def __init__(self, name: str, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.name = name
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Every committed append survives a crash of the process or the machine.
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, claimed_until REAL NOT NULL DEFAULT 0)"
+        )
+        # Spools created before records were claimed lack the lease column.
+        if "claimed_until" not in [row[1] for row in self._db.execute("PRAGMA table_info(spool)")]:
+            self._db.execute("ALTER TABLE spool ADD COLUMN claimed_until REAL NOT NULL DEFAULT 0")
+        self._db.commit()
+        self._records, self._bytes = 0, 0
+        self._refresh()
+        self._publish()
+        if self._records:
+            print(f"Log spool '{name}' at '{path}' holds {self._records} records from before the restart.")
+
+    def append(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Spools records, in order.
+
+        Args:
+            records: The JSON-serializable records (datetimes are allowed).
+
+        Returns:
+            How many records were spooled; the rest were refused because the spool is full.
+        """
+        payloads = [json.dumps(record, default=_encode) for record in records]
+        with self._lock:
+            # Other processes sharing the file may have spooled records since the last count.
+            self._refresh()
+            rows = []
+            size = 0
+            for payload in payloads:
+                payload_size = len(payload.encode("utf-8"))
+                if self._bytes + size + payload_size > self.max_bytes:
+                    break
+                rows.append((payload, payload_size, time.time()))
+                size += payload_size
+            if rows:
+                self._db.executemany("INSERT INTO spool (payload, size, created_at) VALUES (?, ?, ?)", rows)
+                self._db.commit()
+                self._records += len(rows)
+                self._bytes += size
+        self._publish()
+        return len(rows)
+
+    def claim(self, limit: int, lease_seconds: float) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Claims up to `limit` of the oldest unclaimed records for `lease_seconds`.
+
+        Returns:
+            The records with their spool ids, to `delete` once written upstream or
+            `release` if the write failed.
+        """
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock of the file, so processes sharing it claim in turn.
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT id, payload FROM spool WHERE claimed_until < ? ORDER BY id LIMIT ?", (now, limit)
+                ).fetchall()
+                if rows:
+                    ids = [row_id for row_id, _ in rows]
+                    placeholders = ",".join("?" * len(ids))
+                    self._db.execute(f"UPDATE spool SET claimed_until = ? WHERE id IN ({placeholders})", [now + lease_seconds, *ids])
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._refresh()
+        self._publish()
+        return [(row_id, json.loads(payload, object_hook=_decode)) for row_id, payload in rows]
+
+    def release(self, ids: List[int]):
+        """Makes claimed records available again, e.g. after their write failed."""
+        if not ids:
+            return
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            self._db.execute(f"UPDATE spool SET claimed_until = 0 WHERE id IN ({placeholders})", ids)
+            self._db.commit()
+
+    def delete(self, ids: List[int]):
+        """Removes records once they have been written upstream."""
+        if not ids:
+            return
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            self._db.execute(f"DELETE FROM spool WHERE id IN ({placeholders})", ids)
+            self._db.commit()
+            self._refresh()
+        self._publish()
+
+    def is_empty(self) -> bool:
+        """Whether the spool was empty when last counted (on open and after every append, claim or delete)."""
+        return self._records == 0
+
+    def _refresh(self):
+        # Counts every process's records; called with the lock held (or before the spool is shared).
+        self._records, self._bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool").fetchone()
+
+    def _publish(self):
+        metrics.registry.set_gauge("log_spool_records", self._records, {"spool": self.name})
+        metrics.registry.set_gauge("log_spool_bytes", self._bytes, {"spool": self.name})
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns how many records the spool holds and their size."""
+        return {"path": self.path, "records": self._records, "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+def open_spool(name: str, path: Optional[str], max_bytes: int) -> Optional[LogSpool]:
+    """Opens a spool, or returns None if no path is configured or it cannot be opened."""
+    if not path:
+        return None
+    try:
+        return LogSpool(name, path, max_bytes)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Failed to open the log spool at '{path}': {e}")
+        return None
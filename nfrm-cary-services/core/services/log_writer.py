@@ -0,0 +1,190 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+from core.services import metrics
+from core.services.log_spool import LogSpool
+
+# Writes a batch of log documents, raising if the write failed.
+BatchWriter = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+class BackgroundLogWriter:
+    """
+    Takes log writes off the request path.
+
+    Handlers enqueue log documents without waiting; a background worker writes
+    them in batches of up to `max_batch`, at least every `flush_interval_seconds`
+    while there is anything to write. The queue holds at most `max_queue`
+    documents: once it is full, new documents are dropped (and counted) rather
+    than slowing requests down. On shutdown the queue is drained within
+    `shutdown_timeout_seconds`.
+
+    With a `spool`, batches whose write fails or takes longer than
+    `write_timeout_seconds` go to the local spool instead of being lost, and are
+    replayed, oldest first, once writes succeed again (retried at most every
+    `replay_interval_seconds` while they fail). Replays must be idempotent, e.g.
+    by giving each document a fixed id.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        write_batch: BatchWriter,
+        max_queue: int = 10000,
+        max_batch: int = 500,
+        flush_interval_seconds: float = 1.0,
+        shutdown_timeout_seconds: float = 10.0,
+        write_timeout_seconds: float = 15.0,
+        spool: Optional[LogSpool] = None,
+        replay_interval_seconds: float = 30.0
+    ):
+        self.name = name
+        self._write_batch = write_batch
+        self.max_batch = max_batch
+        self.flush_interval_seconds = flush_interval_seconds
+        self.shutdown_timeout_seconds = shutdown_timeout_seconds
+        self.write_timeout_seconds = write_timeout_seconds
+        self.spool = spool
+        self.replay_interval_seconds = replay_interval_seconds
+        self._next_replay_at = 0.0
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._flushes = 0
+        self._spooled = 0
+        self._replayed = 0
+        # The batch being written, spooled on shutdown if its write does not finish in time.
+        self._in_flight: List[Dict[str, Any]] = []
+
+    def enqueue(self, document: Dict[str, Any]) -> bool:
+        """Queues a document to be written. Returns False if the queue was full and it was dropped."""
+        try:
+            self._queue.put_nowait(document)
+        except asyncio.QueueFull:
+            self._drop(1, "queue_full")
+            return False
+        metrics.registry.set_gauge("log_writer_queue_depth", self._queue.qsize(), {"writer": self.name})
+        return True
+
+    def start(self):
+        """Starts the background worker."""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Writes everything still queued, waiting at most `shutdown_timeout_seconds`."""
+        if self._task is None:
+            return
+        self._stopping = True
+        try:
+            await asyncio.wait_for(self._task, timeout=self.shutdown_timeout_seconds)
+        except asyncio.TimeoutError:
+            remaining, self._in_flight = self._in_flight, []
+            while not self._queue.empty():
+                remaining.append(self._queue.get_nowait())
+            print(f"Log writer '{self.name}' did not drain within {self.shutdown_timeout_seconds}s; {len(remaining)} documents left.")
+            await self._spool_or_drop(remaining, "shutdown")
+        self._task = None
+
+    async def _run(self):
+        while not (self._stopping and self._queue.empty()):
+            batch = await self._collect()
+            if batch:
+                await self._flush(batch)
+            if self.spool is not None and not self._stopping and not self.spool.is_empty() and time.monotonic() >= self._next_replay_at:
+                await self._replay()
+
+    async def _collect(self) -> List[Dict[str, Any]]:
+        """Collects documents until the batch is full or the flush interval has passed."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval_seconds
+        batch: List[Dict[str, Any]] = []
+        while len(batch) < self.max_batch:
+            if self._stopping:
+                # Shutting down: write whatever is queued without waiting for more.
+                if self._queue.empty():
+                    break
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        started_at = time.monotonic()
+        self._in_flight = batch
+        try:
+            await asyncio.wait_for(self._write_batch(batch), timeout=self.write_timeout_seconds)
+            self._in_flight = []
+            self._written += len(batch)
+            metrics.registry.inc("log_writer_written_total", {"writer": self.name}, len(batch))
+        except Exception as e:
+            print(f"Log writer '{self.name}' failed to write {len(batch)} documents: {e!r}")
+            self._failed += 1
+            # The upstream is struggling: hold off replaying the spool for a while.
+            self._next_replay_at = time.monotonic() + self.replay_interval_seconds
+            self._in_flight = []
+            await self._spool_or_drop(batch, "write_failed")
+        self._flushes += 1
+        metrics.registry.observe("log_writer_flush_seconds", time.monotonic() - started_at, {"writer": self.name})
+        metrics.registry.set_gauge("log_writer_queue_depth", self._queue.qsize(), {"writer": self.name})
+
+    async def _spool_or_drop(self, batch: List[Dict[str, Any]], reason: str):
+        """Keeps documents that could not be written in the spool, dropping what does not fit."""
+        spooled = 0
+        if self.spool is not None and batch:
+            try:
+                spooled = await asyncio.to_thread(self.spool.append, batch)
+            except Exception as e:
+                print(f"Log writer '{self.name}' failed to spool {len(batch)} documents: {e}")
+            self._spooled += spooled
+            metrics.registry.inc("log_writer_spooled_total", {"writer": self.name}, spooled)
+        self._drop(len(batch) - spooled, reason if self.spool is None else "spool_full")
+
+    async def _replay(self):
+        """Writes the oldest unclaimed spooled documents upstream and removes them from the spool."""
+        # Claimed, so other worker processes sharing the spool do not replay the same documents.
+        records = await asyncio.to_thread(self.spool.claim, self.max_batch, 2 * self.write_timeout_seconds)
+        if not records:
+            return
+        try:
+            await asyncio.wait_for(self._write_batch([document for _, document in records]), timeout=self.write_timeout_seconds)
+        except Exception as e:
+            print(f"Log writer '{self.name}' failed to replay {len(records)} spooled documents: {e!r}")
+            self._next_replay_at = time.monotonic() + self.replay_interval_seconds
+            await asyncio.to_thread(self.spool.release, [record_id for record_id, _ in records])
+            return
+        await asyncio.to_thread(self.spool.delete, [record_id for record_id, _ in records])
+        self._replayed += len(records)
+        metrics.registry.inc("log_writer_replayed_total", {"writer": self.name}, len(records))
+
+    def _drop(self, count: int, reason: str):
+        if count <= 0:
+            return
+        self._dropped += count
+        metrics.registry.inc("log_writer_dropped_total", {"writer": self.name, "reason": reason}, count)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the queue depth and how many documents were written or dropped."""
+        histogram = metrics.registry.histogram("log_writer_flush_seconds", {"writer": self.name})
+        return {
+            "queue_depth": self._queue.qsize(),
+            "written": self._written,
+            "dropped": self._dropped,
+            "failed_flushes": self._failed,
+            "flushes": self._flushes,
+            "spooled": self._spooled,
+            "replayed": self._replayed,
+            "spool": self.spool.stats() if self.spool is not None else None,
+            "flush_seconds": histogram.snapshot() if histogram is not None else None,
+        }
@@ -0,0 +1,140 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+
+from core.services import metrics
+
+TIER_LITE = "lite"
+TIER_STANDARD = "standard"
+TIER_LONG_CONTEXT = "long_context"
+
+# Defaults applied to every endpoint unless overridden:
+# - tier: the tier used when no other rule applies.
+# - allow_lite: whether small prompts may be sent to the lite tier.
+# - lite_max_tokens: the largest context (in estimated tokens) sent to the lite tier.
+# - long_context_min_tokens: contexts at least this large go to the long-context tier.
+# - latency_slo_ms: if set, and the chosen model's observed p95 latency exceeds it while
+#   the lite model meets it, prompts up to `slo_lite_max_tokens` are moved to the lite tier.
+DEFAULT_POLICY: Dict[str, Any] = {
+    "tier": TIER_STANDARD,
+    "allow_lite": True,
+    "lite_max_tokens": 1500,
+    "long_context_min_tokens": 200000,
+    "latency_slo_ms": None,
+    "slo_lite_max_tokens": 4000,
+}
+
+DEFAULT_ENDPOINT_POLICIES: Dict[str, Dict[str, Any]] = {
+    "financial_advisor_chat": {"lite_max_tokens": 2000},
+    "popular_answers_warmer": {"allow_lite": False},
+    "document_reviewer_chat": {"allow_lite": False, "long_context_min_tokens": 100000},
+    "document_review_extract": {"tier": TIER_LITE},
+    "budget_planner_chat": {"allow_lite": False},
+    "budget_history_summary": {"tier": TIER_LITE},
+}
+
+
+@dataclass
+class RoutingDecision:
+    model_name: str
+    tier: str
+    reason: str
+
+
+class ModelRouter:
+    """
+    Picks the Gemini model for each request from the endpoint, the size of the
+    context sent to the model and, optionally, a latency SLO, and records per-model
+    latency histograms.
+
+    Short prompts go to a lite model, very large contexts (e.g. long documents)
+    to a long-context model and everything else to the standard model. Policies are
+    set per endpoint and can be overridden with the LLM_ROUTING_POLICY env var, a JSON
+    object mapping endpoint names (or "default") to policy fields.
+    """
+
+    def __init__(self, tiers: Dict[str, str], policy_overrides: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.tiers = tiers
+        self._default_policy = dict(DEFAULT_POLICY)
+        self._endpoint_policies = {endpoint: dict(policy) for endpoint, policy in DEFAULT_ENDPOINT_POLICIES.items()}
+        for endpoint, policy in (policy_overrides or {}).items():
+            if endpoint == "default":
+                self._default_policy.update(policy)
+            else:
+                self._endpoint_policies.setdefault(endpoint, {}).update(policy)
+        self._decisions: Dict[str, int] = {}
+
+    def policy(self, endpoint: str) -> Dict[str, Any]:
+        """Returns the effective policy of an endpoint."""
+        return {**self._default_policy, **self._endpoint_policies.get(endpoint, {})}
+
+    def route(self, endpoint: str, context_tokens: int) -> RoutingDecision:
+        """
+        Chooses the model for a request.
+
+        Args:
+            endpoint: The name of the calling endpoint.
+            context_tokens: The estimated size of everything sent to the model
+                            (system prompt, history, documents and the prompt itself).
+
+        Returns:
+            The chosen model and tier, and why it was chosen.
+        """
+        policy = self.policy(endpoint)
+        tier, reason = policy["tier"], "endpoint default"
+        if context_tokens >= policy["long_context_min_tokens"]:
+            tier, reason = TIER_LONG_CONTEXT, f"context of {context_tokens} tokens"
+        elif policy["allow_lite"] and context_tokens <= policy["lite_max_tokens"]:
+            tier, reason = TIER_LITE, f"short context of {context_tokens} tokens"
+        elif policy["latency_slo_ms"] and tier != TIER_LITE and context_tokens <= policy["slo_lite_max_tokens"]:
+            if self._violates_slo(tier, policy["latency_slo_ms"]) and not self._violates_slo(TIER_LITE, policy["latency_slo_ms"]):
+                tier, reason = TIER_LITE, f"{self.tiers[policy['tier']]} p95 latency above {policy['latency_slo_ms']}ms SLO"
+
+        decision_key = f"{endpoint}:{tier}"
+        self._decisions[decision_key] = self._decisions.get(decision_key, 0) + 1
+        return RoutingDecision(model_name=self.tiers[tier], tier=tier, reason=reason)
+
+    def record(self, endpoint: str, model_name: str, latency_seconds: float):
+        """Records the latency of a completed model call, used for the latency SLO."""
+        metrics.registry.observe("llm_model_latency_seconds", latency_seconds, {"model": model_name})
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the tier models, how often each was chosen and their observed latencies."""
+        latencies = {}
+        for model_name in set(self.tiers.values()):
+            histogram = metrics.registry.histogram("llm_model_latency_seconds", {"model": model_name})
+            if histogram is not None:
+                latencies[model_name] = histogram.snapshot()
+        return {
+            "tiers": dict(self.tiers),
+            "decisions": dict(self._decisions),
+            "latency_seconds": latencies,
+        }
+
+    def _violates_slo(self, tier: str, latency_slo_ms: float) -> bool:
+        histogram = metrics.registry.histogram("llm_model_latency_seconds", {"model": self.tiers[tier]})
+        if histogram is None or histogram.count == 0:
+            return False
+        return histogram.quantile(0.95) * 1000 > latency_slo_ms
+
+
+def create_router_from_env(standard_model_name: str) -> ModelRouter:
+    """Builds the router from the VERTEX_*_MODEL_NAME and LLM_ROUTING_POLICY env vars."""
+    tiers = {
+        TIER_LITE: os.getenv('VERTEX_LITE_MODEL_NAME', "gemini-2.0-flash-lite-001"),
+        TIER_STANDARD: standard_model_name,
+        # The standard model already has a 1M-token window; point this at a Pro model to use one.
+        TIER_LONG_CONTEXT: os.getenv('VERTEX_LONG_CONTEXT_MODEL_NAME', standard_model_name),
+    }
+    policy_overrides = None
+    raw_policy = os.getenv('LLM_ROUTING_POLICY')
+    if raw_policy:
+        try:
+            policy_overrides = json.loads(raw_policy)
+        except json.JSONDecodeError as e:
+            print(f"Ignoring invalid LLM_ROUTING_POLICY: {e}")
+    if os.getenv('LLM_ROUTING_ENABLED', 'true').lower() != 'true':
+        # Routing disabled: every tier maps to the standard model.
+        tiers = {tier: standard_model_name for tier in tiers}
+    return ModelRouter(tiers, policy_overrides)
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+
+from core.services.llm_cache import normalize_prompt
+
+# Generates the answer to a question in a language, returning None if generation failed.
+AnswerGenerator = Callable[[str, str], Awaitable[Optional[str]]]
+
+
+class PopularAnswersWarmer:
+    """
+    Pre-generates answers for a catalogue of popular questions in a set of languages
+    so they can be served instantly instead of triggering a cold model call.
+
+    Answers are generated once at startup and refreshed every `refresh_seconds`.
+    Generation is spread out to stay within `max_requests_per_minute`.
+    """
+
+    def __init__(self, languages: List[str], refresh_seconds: float = 6 * 3600, max_requests_per_minute: float = 30):
+        self.languages = languages
+        self.refresh_seconds = refresh_seconds
+        self.max_requests_per_minute = max_requests_per_minute
+        self._answers: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._hits = 0
+        self._generated = 0
+        self._failed = 0
+        self._last_run_finished_at: Optional[float] = None
+
+    def get(self, question: str, language: str) -> Optional[str]:
+        """Returns the pre-generated answer for a question, if there is one."""
+        entry = self._answers.get((normalize_prompt(question), (language or "").lower()))
+        if entry is None:
+            return None
+        self._hits += 1
+        return entry[0]
+
+    async def warm_once(self, questions: List[str], generate: AnswerGenerator):
+        """Generates (or refreshes) the answer to every question in every configured language."""
+        interval = 60.0 / self.max_requests_per_minute if self.max_requests_per_minute > 0 else 0
+        for language in self.languages:
+            for question in questions:
+                try:
+                    answer = await generate(question, language)
+                except Exception as e:
+                    print(f"Error pre-generating answer for '{question}' in {language}: {e}")
+                    answer = None
+                if answer:
+                    self._answers[(normalize_prompt(question), language.lower())] = (answer, time.time())
+                    self._generated += 1
+                else:
+                    self._failed += 1
+                await asyncio.sleep(interval)
+        self._last_run_finished_at = time.time()
+        print(f"Pre-generated {len(self._answers)} popular answers.")
+
+    def start(self, questions: List[str], generate: AnswerGenerator):
+        """Starts warming in the background and keeps refreshing on schedule."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(questions, generate))
+
+    async def stop(self):
+        """Stops the background warmer."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns how many answers are ready and how often they were served."""
+        return {
+            "answers": len(self._answers),
+            "languages": self.languages,
+            "hits": self._hits,
+            "generated": self._generated,
+            "failed": self._failed,
+            "last_run_finished_at": self._last_run_finished_at,
+        }
+
+    async def _run(self, questions: List[str], generate: AnswerGenerator):
+        while True:
+            await self.warm_once(questions, generate)
+            await asyncio.sleep(self.refresh_seconds)
@@ -0,0 +1,88 @@
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+from core.services.tokens import estimate_tokens
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    """A system prompt rendered for one (template, language) pair."""
+    name: str
+    language: Optional[str]
+    text: str
+    token_count: int
+    fingerprint: str
+
+
+class PromptTemplateRegistry:
+    """
+    Holds the system prompt templates of the services and compiles each one once
+    per (template, language), recording its token count.
+
+    Compiled prompts are sent as the model's system instruction, so the static
+    prefix is identical from call to call and can be served from the provider's
+    context cache. The registry counts how often each compiled prefix is reused
+    and how many prompt tokens the provider reported as cached.
+    """
+
+    def __init__(self):
+        self._templates: Dict[str, str] = {}
+        self._compiled: Dict[Tuple[str, Optional[str]], CompiledPrompt] = {}
+        self._uses: Dict[str, int] = {}
+        self._compilations = 0
+        self._cached_token_count = 0
+        self._prompt_token_count = 0
+
+    def register(self, name: str, template: str):
+        """
+        Registers a template. `{language}` is the only placeholder it may contain.
+        """
+        self._templates[name] = template
+        for key in [key for key in self._compiled if key[0] == name]:
+            del self._compiled[key]
+
+    def get(self, name: str, language: Optional[str] = None) -> CompiledPrompt:
+        """Returns the compiled prompt of a template for a language, compiling it on first use."""
+        key = (name, language)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            text = self._templates[name].format(language=language)
+            compiled = CompiledPrompt(
+                name=name,
+                language=language,
+                text=text,
+                token_count=estimate_tokens(text),
+                fingerprint=hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+            )
+            self._compiled[key] = compiled
+            self._compilations += 1
+        self._uses[name] = self._uses.get(name, 0) + 1
+        return compiled
+
+    def record_usage(self, compiled: Optional[CompiledPrompt], usage: Optional[Dict[str, int]]):
+        """Records the prompt tokens of a call made with a compiled prompt, and how many were cached."""
+        if compiled is None or not usage:
+            return
+        self._prompt_token_count += usage.get("prompt_token_count", 0) or 0
+        self._cached_token_count += usage.get("cached_content_token_count", 0) or 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns prompt-prefix reuse statistics."""
+        total_uses = sum(self._uses.values())
+        return {
+            "templates": len(self._templates),
+            "compiled_prompts": {
+                f"{name}:{language}": compiled.token_count
+                for (name, language), compiled in self._compiled.items()
+            },
+            "compilations": self._compilations,
+            "uses": dict(self._uses),
+            "prefix_reuse_ratio": (total_uses - self._compilations) / total_uses if total_uses else 0.0,
+            "prompt_token_count": self._prompt_token_count,
+            "cached_content_token_count": self._cached_token_count,
+        }
+
+
+# Shared registry the services register their system prompts with.
+registry = PromptTemplateRegistry()
@@ -0,0 +1,356 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from core.services import metrics
+
+T = TypeVar("T")
+
+
+def _google_exceptions() -> Any:
+    """
+    Returns `google.api_core.exceptions` once an SDK has loaded it, otherwise None.
+    It is not imported here because it loads gRPC, which would slow down startup;
+    its errors can only be raised after the Vertex AI or Firestore SDK is loaded.
+    """
+    return sys.modules.get("google.api_core.exceptions")
+
+
+def _retryable_exceptions() -> Tuple[type, ...]:
+    """Errors worth retrying: the upstream is overloaded, briefly unavailable or timed out."""
+    google_exceptions = _google_exceptions()
+    if google_exceptions is None:
+        return (asyncio.TimeoutError, ConnectionError)
+    return (
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.Aborted,
+        asyncio.TimeoutError,
+        ConnectionError,
+    )
+
+
+def _is_client_error(error: BaseException) -> bool:
+    """Whether a non-retryable error was caused by the request itself (reported as HTTP 400)."""
+    google_exceptions = _google_exceptions()
+    return google_exceptions is not None and isinstance(error, (
+        google_exceptions.InvalidArgument,
+        google_exceptions.OutOfRange,
+        google_exceptions.FailedPrecondition,
+    ))
+
+
+def is_upstream_rejection(error: BaseException) -> bool:
+    """Whether an error is a non-retryable refusal from a Google API (e.g. an invalid request)."""
+    google_exceptions = _google_exceptions()
+    return google_exceptions is not None and isinstance(error, google_exceptions.GoogleAPICallError)
+
+
+class UpstreamError(Exception):
+    """Base class for upstream failures that are reported to the client as an HTTP error."""
+    status_code = 503
+
+    def __init__(self, upstream: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class UpstreamUnavailableError(UpstreamError):
+    """The upstream kept failing, or its circuit breaker is open (HTTP 503)."""
+    status_code = 503
+
+
+class UpstreamTimeoutError(UpstreamError):
+    """The upstream did not answer within the endpoint's deadline (HTTP 504)."""
+    status_code = 504
+
+
+class UpstreamRejectedError(UpstreamError):
+    """
+    The upstream refused the request and it was not retried: HTTP 400 if the request
+    was invalid, 502 for any other refusal (e.g. permission denied or an unknown model).
+    """
+    status_code = 502
+
+    def __init__(self, upstream: str, error: BaseException):
+        super().__init__(upstream, str(error))
+        self.status_code = 400 if _is_client_error(error) else 502
+
+
+def error_status(error: BaseException) -> int:
+    """
+    Returns the HTTP status an error is reported with: the status of an UpstreamError
+    as is, 400 or 502 for a Google API refusal, and 500 for anything else.
+    """
+    if isinstance(error, UpstreamError):
+        return error.status_code
+    if _is_client_error(error):
+        return 400
+    if is_upstream_rejection(error):
+        return 502
+    return 500
+
+
+@dataclass(frozen=True)
+class ResiliencePolicy:
+    """
+    How calls of one endpoint are guarded:
+    - deadline_seconds: total time allowed for the call, retries included.
+    - max_attempts: attempts made on retryable errors.
+    - backoff_base_seconds / backoff_max_seconds: bounds of the full-jitter exponential backoff.
+    - hedge: whether a second, identical request is sent once the first one is slower
+      than the upstream's observed p95 latency. Only for idempotent calls.
+    - hedge_min_delay_seconds: the shortest delay before a hedged request is sent.
+    """
+    deadline_seconds: float = 30.0
+    max_attempts: int = 3
+    backoff_base_seconds: float = 0.2
+    backoff_max_seconds: float = 2.0
+    hedge: bool = False
+    hedge_min_delay_seconds: float = 0.5
+
+
+DEFAULT_POLICY = ResiliencePolicy()
+
+DEFAULT_ENDPOINT_POLICIES: Dict[str, Dict[str, Any]] = {
+    "generate_ai_response": {"deadline_seconds": 30.0, "hedge": True},
+    "generate_ai_response_batch": {"deadline_seconds": 60.0},
+    "financial_advisor_chat": {"deadline_seconds": 30.0, "hedge": True},
+    "document_reviewer_chat": {"deadline_seconds": 90.0, "max_attempts": 2},
+    "document_review_extract": {"deadline_seconds": 45.0, "max_attempts": 2},
+    "budget_planner_chat": {"deadline_seconds": 45.0, "hedge": True},
+    "budget_history_summary": {"deadline_seconds": 20.0, "max_attempts": 2},
+    "popular_answers_warmer": {"deadline_seconds": 60.0, "max_attempts": 2},
+    "firestore": {"deadline_seconds": 10.0, "backoff_base_seconds": 0.1, "backoff_max_seconds": 1.0},
+}
+
+
+class CircuitBreaker:
+    """
+    Fails fast once an upstream is unhealthy.
+
+    After `failure_threshold` consecutive retryable failures the circuit opens and
+    calls are rejected for `reset_seconds`. Then a single trial call is let through
+    (half-open): its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._rejected = 0
+        self._opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Returns whether a call may be made now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self._rejected += 1
+        return False
+
+    def retry_after(self) -> float:
+        """Returns the seconds until the circuit lets a trial call through."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """Lets another trial call through after one that proved nothing about the upstream's health."""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+        if self._trial_in_flight or self._consecutive_failures >= self.failure_threshold:
+            if self._opened_at is None or self._trial_in_flight:
+                self._opened += 1
+                print(f"Circuit breaker '{self.name}' opened after {self._consecutive_failures} consecutive failures.")
+            self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "opened": self._opened,
+            "rejected": self._rejected,
+        }
+
+
+def _load_policy_overrides() -> Dict[str, Dict[str, Any]]:
+    raw_policy = os.getenv('RESILIENCE_POLICY')
+    if not raw_policy:
+        return {}
+    try:
+        return json.loads(raw_policy)
+    except json.JSONDecodeError as e:
+        print(f"Ignoring invalid RESILIENCE_POLICY: {e}")
+        return {}
+
+
+_policy_overrides = _load_policy_overrides()
+_breakers: Dict[str, CircuitBreaker] = {}
+_stats: Dict[str, int] = {"calls": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0, "failures": 0}
+
+breaker_failure_threshold = int(os.getenv('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '5'))
+breaker_reset_seconds = float(os.getenv('CIRCUIT_BREAKER_RESET_SECONDS', '30'))
+
+
+def policy_for(endpoint: str) -> ResiliencePolicy:
+    """
+    Returns the policy of an endpoint. Defaults can be overridden with the
+    RESILIENCE_POLICY env var, a JSON object mapping endpoint names (or "default")
+    to policy fields, e.g. {"financial_advisor_chat": {"deadline_seconds": 15}}.
+    """
+    fields = {
+        **_policy_overrides.get("default", {}),
+        **DEFAULT_ENDPOINT_POLICIES.get(endpoint, {}),
+        **_policy_overrides.get(endpoint, {}),
+    }
+    return replace(DEFAULT_POLICY, **fields)
+
+
+def breaker_for(upstream: str) -> CircuitBreaker:
+    """Returns the circuit breaker of an upstream, creating it on first use."""
+    breaker = _breakers.get(upstream)
+    if breaker is None:
+        breaker = CircuitBreaker(upstream, breaker_failure_threshold, breaker_reset_seconds)
+        _breakers[upstream] = breaker
+    return breaker
+
+
+def _backoff(policy: ResiliencePolicy, attempt: int) -> float:
+    # Full jitter: spreads the retries of concurrent callers instead of synchronizing them.
+    return random.uniform(0, min(policy.backoff_max_seconds, policy.backoff_base_seconds * (2 ** attempt)))
+
+
+def _hedge_delay(upstream: str, policy: ResiliencePolicy) -> Optional[float]:
+    histogram = metrics.registry.histogram("upstream_latency_seconds", {"upstream": upstream})
+    # Without enough observations there is no meaningful p95 to hedge after.
+    if histogram is None or histogram.count < 20:
+        return None
+    return max(policy.hedge_min_delay_seconds, histogram.quantile(0.95))
+
+
+async def _attempt(upstream: str, fn: Callable[[], Awaitable[T]], policy: ResiliencePolicy) -> T:
+    """Makes one attempt, sending a hedged duplicate if the first request is unusually slow."""
+    delay = _hedge_delay(upstream, policy) if policy.hedge else None
+    if delay is None:
+        return await fn()
+
+    primary = asyncio.ensure_future(fn())
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+
+        _stats["hedged"] += 1
+        hedged = asyncio.ensure_future(fn())
+        pending = {primary, hedged}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedged:
+                        _stats["hedge_wins"] += 1
+                    return task.result()
+        # Both failed: surface the primary's error.
+        return primary.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call(upstream: str, endpoint: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """
+    Calls an upstream under the endpoint's deadline, retrying retryable errors with
+    jittered backoff and failing fast while the upstream's circuit breaker is open.
+
+    Args:
+        upstream: Names the upstream (e.g. the model or "firestore"); each has its own breaker.
+        endpoint: Selects the resilience policy.
+        fn: Makes the call. It is invoked once per attempt (twice when hedged),
+            so it must start a fresh request every time.
+
+    Returns:
+        The result of the first successful attempt.
+
+    Raises:
+        UpstreamUnavailableError: The circuit is open or all attempts failed.
+        UpstreamTimeoutError: The deadline passed before the call succeeded.
+    """
+    policy = policy_for(endpoint)
+    breaker = breaker_for(upstream)
+    deadline = time.monotonic() + policy.deadline_seconds
+    _stats["calls"] += 1
+
+    for attempt in range(policy.max_attempts):
+        is_trial = breaker.state == "half_open"
+        if not breaker.allow():
+            raise UpstreamUnavailableError(upstream, "circuit breaker is open", retry_after=breaker.retry_after())
+        remaining = deadline - time.monotonic()
+        started_at = time.monotonic()
+        try:
+            result = await asyncio.wait_for(_attempt(upstream, fn, policy), timeout=remaining)
+        except _retryable_exceptions() as e:
+            breaker.record_failure()
+            if isinstance(e, asyncio.TimeoutError) and time.monotonic() >= deadline:
+                _stats["timeouts"] += 1
+                raise UpstreamTimeoutError(upstream, f"no response within {policy.deadline_seconds}s") from e
+            print(f"Attempt {attempt + 1}/{policy.max_attempts} to '{upstream}' for '{endpoint}' failed: {e}")
+            sleep_for = _backoff(policy, attempt)
+            if attempt + 1 >= policy.max_attempts or time.monotonic() + sleep_for >= deadline:
+                _stats["failures"] += 1
+                raise UpstreamUnavailableError(upstream, f"failed after {attempt + 1} attempts: {e}", retry_after=sleep_for) from e
+            _stats["retries"] += 1
+            await asyncio.sleep(sleep_for)
+            continue
+        except BaseException:
+            # Not an upstream health problem (e.g. an invalid request, or the caller was cancelled):
+            # leave the circuit as it is, but free the trial slot so the next call can probe.
+            if is_trial:
+                breaker.release_trial()
+            raise
+        breaker.record_success()
+        metrics.registry.observe("upstream_latency_seconds", time.monotonic() - started_at, {"upstream": upstream})
+        return result
+
+    _stats["failures"] += 1
+    raise UpstreamUnavailableError(upstream, f"failed after {policy.max_attempts} attempts")
+
+
+def get_stats() -> Dict[str, Any]:
+    """Returns retry/hedging counters and the state of every circuit breaker."""
+    return {
+        **_stats,
+        "breakers": {name: breaker.stats() for name, breaker in _breakers.items()},
+    }
@@ -0,0 +1,122 @@
+import asyncio
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Broadcast:
+    """
+    Consumes a single async iterable and fans its items out to any number of
+    subscribers. Subscribers that join late first receive the items they missed.
+    `opened` resolves once `start` has returned, or fails with its error.
+    """
+
+    def __init__(self, start: Callable[[], Awaitable[AsyncIterable[Any]]]):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self.opened: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Marks the error as retrieved even if every subscriber left before it was raised.
+        self.opened.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self.task = asyncio.ensure_future(self._run(start))
+
+    async def _run(self, start: Callable[[], Awaitable[AsyncIterable[Any]]]):
+        source = None
+        try:
+            source = await start()
+            self.opened.set_result(None)
+            async for item in source:
+                async with self._changed:
+                    self.items.append(item)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+            if not self.opened.done():
+                self.opened.set_exception(e)
+        finally:
+            if not self.opened.done():
+                self.opened.cancel()
+            # Closing the source frees what it holds even if it stopped early (e.g. an admission slot).
+            close = getattr(source, "aclose", None)
+            if close is not None:
+                await close()
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self.items) or self.done)
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.done and index >= len(self.items):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests: callers using the same key while a
+    call is in flight share that call's result instead of issuing their own.
+
+    The shared call runs in its own task, so a caller that disconnects does not
+    cancel the work the other callers are waiting on.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._coalesced_calls = 0
+        self._coalesced_streams = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs `fn` unless a call with the same key is already in flight,
+        in which case its result is awaited instead.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(self._calls, key, done))
+        else:
+            self._coalesced_calls += 1
+        return await asyncio.shield(task)
+
+    async def stream(self, key: str, start: Callable[[], Awaitable[AsyncIterable[T]]]) -> AsyncIterator[T]:
+        """
+        Subscribes to the stream for a key, starting it with `start` unless one
+        is already in flight. Every subscriber receives every item of the stream.
+        Returns once the stream has been opened, so an error opening it (e.g. the
+        upstream is unavailable) is raised here, to the caller that started it and
+        to those that joined it alike.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast(start)
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: self._forget(self._streams, key, broadcast))
+        else:
+            self._coalesced_streams += 1
+        await asyncio.shield(broadcast.opened)
+        return broadcast.subscribe()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of in-flight calls and how many requests were coalesced."""
+        return {
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+            "coalesced_calls": self._coalesced_calls,
+            "coalesced_streams": self._coalesced_streams,
+            "coalesced_requests": self._coalesced_calls + self._coalesced_streams,
+        }
+
+    @staticmethod
+    def _forget(registry: Dict[str, Any], key: str, entry: Any):
+        if registry.get(key) is entry:
+            del registry[key]
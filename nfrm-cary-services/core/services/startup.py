@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from core.services import metrics
+
+# Cold-start budgets. Exceeding them is logged at runtime, and startup_check.py
+# fails when a change pushes the import time or the time to ready over them.
+import_budget_seconds = float(os.getenv('STARTUP_IMPORT_BUDGET_SECONDS', '1.5'))
+ready_budget_seconds = float(os.getenv('STARTUP_READY_BUDGET_SECONDS', '10'))
+# How long an API request that arrives during warm-up waits for it before a 503.
+ready_wait_seconds = float(os.getenv('STARTUP_READY_WAIT_SECONDS', '30'))
+
+# main.py imports this module first, so this is roughly when the app started importing.
+_started_at = time.monotonic()
+_phases: Dict[str, float] = {}
+_ready: Optional[asyncio.Event] = None
+_task: Optional[asyncio.Task] = None
+
+
+def mark(phase: str) -> float:
+    """Records the seconds from the start of the import to the end of a startup phase."""
+    elapsed = time.monotonic() - _started_at
+    _phases[phase] = round(elapsed, 3)
+    metrics.registry.set_gauge("startup_seconds", elapsed, {"phase": phase})
+    return elapsed
+
+
+def _ready_event() -> asyncio.Event:
+    global _ready
+    if _ready is None:
+        _ready = asyncio.Event()
+    return _ready
+
+
+def start_warm_up(warm_up: Callable[[], Awaitable[Any]]):
+    """
+    Runs the warm-up (SDK imports, client initialization, opening connections) in
+    the background, so the server binds its port at once, and marks the app ready
+    once it has finished, successfully or not.
+    """
+    global _task
+    imported = _phases.get("imported")
+    if imported is not None and imported > import_budget_seconds:
+        print(f"Import took {imported:.2f}s, over the {import_budget_seconds}s startup budget.")
+
+    async def run():
+        try:
+            await warm_up()
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+        finally:
+            elapsed = mark("ready")
+            _ready_event().set()
+            print(f"Ready {elapsed:.2f}s after start.")
+            if elapsed > ready_budget_seconds:
+                print(f"Time to ready is over the {ready_budget_seconds}s startup budget.")
+
+    _ready_event()
+    _task = asyncio.create_task(run())
+
+
+async def stop():
+    """Cancels a warm-up that is still running."""
+    if _task is not None and not _task.done():
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+
+
+def is_ready() -> bool:
+    return _ready is not None and _ready.is_set()
+
+
+async def wait_until_ready(timeout: float = None) -> bool:
+    """Waits for the warm-up to finish. Returns False if it did not finish within `timeout` seconds."""
+    if is_ready():
+        return True
+    try:
+        await asyncio.wait_for(_ready_event().wait(), timeout=ready_wait_seconds if timeout is None else timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def stats() -> Dict[str, Any]:
+    """Returns whether the app is ready and when each startup phase finished."""
+    return {
+        "ready": is_ready(),
+        "phases_seconds": dict(_phases),
+        "import_budget_seconds": import_budget_seconds,
+        "ready_budget_seconds": ready_budget_seconds,
+    }
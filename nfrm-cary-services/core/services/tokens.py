@@ -0,0 +1,19 @@
+# Rough token estimation used for budgeting prompt and history sizes without
+# a round trip to the model's count_tokens API.
+
+# Gemini tokenizers average roughly four characters per token for English text.
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a piece of text.
+
+    Args:
+        text: The text to estimate.
+
+    Returns:
+        The approximate token count.
+    """
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
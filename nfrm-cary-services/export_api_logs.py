@@ -0,0 +1,61 @@
+"""
+Exports the API logs to Parquet files partitioned by day, for offline analytics.
+
+Each run continues from the checkpoint in the target directory, exporting every
+day that has settled since; schedule it daily. The output is a Hive-style
+`date=YYYY-MM-DD/api_logs.parquet` layout that pandas, DuckDB or BigQuery read
+directly. Against the Firestore emulator (FIRESTORE_EMULATOR_HOST) it runs fully
+offline; --bigquery-table additionally loads each day into that table.
+
+    python export_api_logs.py --target exports/api_logs --start 2024-05-01
+    python export_api_logs.py --target exports/api_logs --bigquery-table ai-agent-repo.analytics.api_logs
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+from core.services import firestore_service, log_export
+
+
+def _firestore_source(start: datetime, end: datetime):
+    return firestore_service.stream_api_logs(start=start, end=end, fields=log_export.EXPORT_FIELDS)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--target", default=os.getenv('API_LOG_EXPORT_DIR', 'exports/api_logs'), help="Directory the day partitions are written to")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <target>/_checkpoint.json)")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None, help="First day to export, on the first run or to re-export from")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None, help="Stop before this day (default: the last settled day)")
+    parser.add_argument("--settle-hours", type=float, default=float(os.getenv('API_LOG_EXPORT_SETTLE_HOURS', '6')), help="Export a day this long after it ends")
+    parser.add_argument("--bigquery-table", default=os.getenv('API_LOG_EXPORT_BIGQUERY_TABLE'), help="Also load each day into this table (project.dataset.table)")
+    args = parser.parse_args()
+
+    firestore_service.initialize_firestore()
+    if not firestore_service.db:
+        print("Firestore is not available; nothing exported.")
+        return 1
+    checkpoint = log_export.ExportCheckpoint(args.checkpoint or os.path.join(args.target, "_checkpoint.json"))
+    try:
+        result = asyncio.run(log_export.export_logs(
+            source=_firestore_source,
+            target_dir=args.target,
+            checkpoint=checkpoint,
+            start=args.start,
+            end=args.end,
+            settle_hours=args.settle_hours,
+            bigquery_table=args.bigquery_table
+        ))
+    except ValueError as e:
+        print(f"FAILED: {e}")
+        return 1
+    for day in result["days"]:
+        print(f"Exported {day['rows']} API logs of {day['day']} to {day['path']}.")
+    print(f"Exported {len(result['days'])} days; the next run starts at {result['next_day']}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,13 @@
-from fastapi import FastAPI
+from core.services import startup  # Imported first: it records when the app started loading.
+import asyncio
+import importlib
+import math
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from core.routers import rest_llm
 from core.dependencies import init_app
-from core.services import llm_services, firestore_service
+from core.services import llm_services, firestore_service, financial_advice_service, metrics, resilience
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
@@ -21,20 +25,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows GET, POST, PUT, DELETE, etc.
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Next-Cursor"],  # Lets browser clients page through the admin log list
 )
 app.include_router(rest_llm.router)
 
+@app.exception_handler(resilience.UpstreamError)
+async def upstream_error_handler(request: Request, exc: resilience.UpstreamError):
+    # Upstream outages and deadline misses are reported as 503/504 so clients can back off,
+    # quota rejections as 429, and requests the upstream refused as 400/502.
+    headers = {}
+    if exc.retry_after:
+        headers["Retry-After"] = str(math.ceil(exc.retry_after))
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=headers)
+
+@app.middleware("http")
+async def wait_for_warm_up(request: Request, call_next):
+    # API requests that arrive during the background warm-up wait for it to finish.
+    if request.url.path.startswith("/api/") and not startup.is_ready():
+        if not await startup.wait_until_ready():
+            return JSONResponse(status_code=503, content={"detail": "The service is starting up."}, headers={"Retry-After": "1"})
+    return await call_next(request)
+
+async def warm_up():
+    # The SDKs are imported in a worker thread so the event loop keeps serving health checks.
+    await asyncio.to_thread(llm_services.initialize_ai)
+    startup.mark("llm")
+    await asyncio.to_thread(importlib.import_module, "google.cloud.firestore")
+    firestore_service.initialize_firestore()
+    await firestore_service.warm_up_connection()
+    startup.mark("firestore")
+    financial_advice_service.start_popular_answers_warmer()
+
 @app.on_event("startup")
 async def startup_event():
     print("Starting up...")
     await init_app(app)
-    llm_services.initialize_ai()
-    firestore_service.initialize_firestore()
+    # Started before the warm-up so its queue drains even if the warm-up fails: batches
+    # written before the Firestore client exists are spooled and replayed once it does.
+    firestore_service.api_log_writer.start()
+    # Model and Firestore clients are set up after the port is bound, not before.
+    startup.start_warm_up(warm_up)
 
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Shutting down...")
+    await startup.stop()
+    await financial_advice_service.popular_answers.stop()
+    # Queued API logs are written before the instance goes away.
+    await firestore_service.api_log_writer.stop()
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    # 503 until warm-up has finished, for use as the Cloud Run startup probe.
+    stats = startup.stats()
+    return JSONResponse(status_code=200 if stats["ready"] else 503, content=stats)
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    # Per-endpoint and per-model call counts, token usage and latencies, for Prometheus to scrape.
+    return PlainTextResponse(metrics.registry.render_prometheus(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def read_index():
     return FileResponse(os.path.join(static_dir, 'index.html'))
+
+startup.mark("imported")
@@ -0,0 +1,61 @@
+"""
+Checks the cold-start budget of the service.
+
+Imports main.py in a fresh interpreter, runs the startup hooks and waits for the
+background warm-up, then exits with status 1 if the import or the time to ready
+went over STARTUP_IMPORT_BUDGET_SECONDS / STARTUP_READY_BUDGET_SECONDS, or if a
+heavy SDK is imported eagerly again. Run it in CI before deploying:
+
+    python startup_check.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+# SDKs that must only be loaded by the background warm-up or on first use.
+LAZY_MODULES = ["langgraph", "langchain_google_vertexai", "vertexai", "google.cloud.firestore", "google.api_core"]
+
+
+async def _time_to_ready(main_module, timeout: float) -> bool:
+    await main_module.startup_event()
+    try:
+        return await main_module.startup.wait_until_ready(timeout)
+    finally:
+        await main_module.shutdown_event()
+
+
+def run_check() -> int:
+    # The warmer would call the model right away; it is not part of the startup path.
+    os.environ.setdefault('POPULAR_ANSWERS_WARMER_ENABLED', 'false')
+
+    started_at = time.monotonic()
+    import main
+    import_seconds = time.monotonic() - started_at
+    startup = main.startup
+
+    failures = []
+    eager = [name for name in LAZY_MODULES if name in sys.modules]
+    if eager:
+        failures.append(f"imported at startup instead of lazily: {', '.join(eager)}")
+    if import_seconds > startup.import_budget_seconds:
+        failures.append(f"import took {import_seconds:.2f}s, budget {startup.import_budget_seconds}s")
+
+    ready = asyncio.run(_time_to_ready(main, timeout=startup.ready_budget_seconds))
+    ready_seconds = startup.stats()["phases_seconds"].get("ready")
+    if not ready or ready_seconds is None:
+        failures.append(f"not ready within {startup.ready_budget_seconds}s")
+    elif ready_seconds > startup.ready_budget_seconds:
+        failures.append(f"ready after {ready_seconds:.2f}s, budget {startup.ready_budget_seconds}s")
+
+    print(f"Startup phases (seconds since import started): {startup.stats()['phases_seconds']}")
+    if failures:
+        for failure in failures:
+            print(f"FAILED: {failure}")
+        return 1
+    print(f"Startup within budget: import {import_seconds:.2f}s, ready {ready_seconds:.2f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_check())